@@ -0,0 +1,219 @@
+"""
+Microbenchmarks of the curation hot path.
+
+Times transform_data, infer_schema and generate_parquet_table over a number of
+observations, and pq.write_table over a table with that many rows, for several payload
+shapes. Results are saved as JSON and compared with the committed baseline; a stage more
+than --tolerance slower per record than the baseline is reported as a regression and
+the script exits with status 1.
+
+Usage:
+    python benchmarks/bench_curation.py
+    python benchmarks/bench_curation.py --sizes 1 100 10000 1000000 --loop-cap 1000000
+    python benchmarks/bench_curation.py --update-baseline
+
+Observations are processed one at a time by the per-observation stages, so sizes above
+--loop-cap are only run for pq.write_table. Baselines are only comparable on the same
+machine and library versions, which are saved with the results.
+"""
+
+import argparse
+import copy
+import gc
+import json
+import os
+import platform
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'lambda'))
+
+from curation import generate_parquet_table, infer_schema, transform_data
+import numpy as np
+import pyarrow as pa
+import pyarrow.parquet as pq
+from schema import conform
+
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+BASELINE = os.path.join(HERE, 'baseline.json')
+RESULTS = os.path.join(HERE, 'results.json')
+
+DEFAULT_SIZES = (1, 100, 10000, 1000000)
+DEFAULT_LOOP_CAP = 10000
+DEFAULT_TOLERANCE = 0.25
+
+# Each measurement is repeated at least MIN_REPEATS times and until it has run for
+# MIN_SECONDS, keeping the fastest run
+MIN_REPEATS = 3
+MIN_SECONDS = 0.2
+MAX_REPEATS = 1000
+
+# A current.json response for the original site
+CURRENT = {
+    "location": {
+        "name": "Healesville", "region": "Victoria", "country": "Australia", "lat": -37.5, "lon": 145.74,
+        "tz_id": "Australia/Melbourne", "localtime_epoch": 1646352000, "localtime": "2022-03-04 11:00",
+    },
+    "current": {
+        "last_updated_epoch": 1646351100, "last_updated": "2022-03-04 10:45", "temp_c": 21.0, "temp_f": 69.8,
+        "is_day": 1, "condition": {"text": "Sunny", "icon": "//cdn.weatherapi.com/weather/64x64/day/113.png", "code": 1000},
+        "wind_mph": 2.2, "wind_kph": 3.6, "wind_degree": 200, "wind_dir": "SSW", "pressure_mb": 1018.0,
+        "pressure_in": 30.06, "precip_mm": 0.0, "precip_in": 0.0, "humidity": 56, "cloud": 0, "feelslike_c": 21.0,
+        "feelslike_f": 69.8, "vis_km": 10.0, "vis_miles": 6.0, "uv": 5.0, "gust_mph": 4.5, "gust_kph": 7.2,
+    },
+}
+
+
+def payload_shapes() -> dict:
+    """Returns the payloads benchmarked, by name"""
+
+    # Half of the current values missing, as in a partial response
+    sparse = copy.deepcopy(CURRENT)
+    for i, key in enumerate(list(sparse['current'])):
+        if i % 2 and key != 'condition':
+            sparse['current'][key] = None
+
+    # A response with many more measurements than the current endpoint
+    wide = copy.deepcopy(CURRENT)
+    wide['current'].update({f'sensor_{i}': float(i) for i in range(200)})
+
+    # Air quality nested one level down, as returned with aqi=yes
+    nested = copy.deepcopy(CURRENT)
+    nested['current']['air_quality'] = {
+        "co": 230.3, "no2": 3.1, "o3": 41.5, "so2": 0.6, "pm2_5": 2.1, "pm10": 3.4,
+        "us-epa-index": 1, "gb-defra-index": 1,
+    }
+
+    return {"current": CURRENT, "sparse": sparse, "wide": wide, "nested": nested}
+
+
+def measure(function) -> float:
+    """Returns the fastest of several runs of function, in seconds, with garbage collection paused as in timeit"""
+
+    best = None
+    repeats = 0
+    total = 0.0
+
+    gc.collect()
+    gc.disable()
+    try:
+        while repeats < MAX_REPEATS and (repeats < MIN_REPEATS or total < MIN_SECONDS):
+            start = time.perf_counter()
+            function()
+            elapsed = time.perf_counter() - start
+            best = elapsed if best is None else min(best, elapsed)
+            total += elapsed
+            repeats += 1
+    finally:
+        gc.enable()
+
+    return best
+
+
+def bench_shape(payload, records, loop_cap) -> dict:
+    """Returns the seconds per record of each stage for one payload shape and size"""
+
+    results = {}
+
+    if records <= loop_cap:
+        observations = [copy.deepcopy(payload) for _ in range(records)]
+        flattened = [transform_data(observation) for observation in observations]
+
+        results['transform_data'] = measure(lambda: [transform_data(observation) for observation in observations])
+        results['infer_schema'] = measure(lambda: [infer_schema(columns, values) for columns, values in flattened])
+        results['generate_parquet_table'] = measure(
+            lambda: [generate_parquet_table(observation) for observation in observations])
+
+    # Curation writes conformed tables, repeated here to the number of records
+    row = conform(generate_parquet_table(payload))
+    table = row.take(pa.array(np.zeros(records, dtype=np.int64)))
+
+    def write():
+        sink = pa.BufferOutputStream()
+        pq.write_table(table, sink)
+
+    results['write_table'] = measure(write)
+
+    return {stage: seconds / records for stage, seconds in results.items()}
+
+
+def run(sizes, loop_cap) -> dict:
+    """Runs every stage for every shape and size, keyed stage/shape/records"""
+
+    results = {}
+
+    for shape, payload in payload_shapes().items():
+        for records in sizes:
+            for stage, seconds in bench_shape(payload, records, loop_cap).items():
+                key = f'{stage}/{shape}/{records}'
+                results[key] = seconds
+                print(f'{key:<40} {seconds * 1e6:>12.3f} us/record')
+
+    return results
+
+
+def environment() -> dict:
+    return {
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "pyarrow": pa.__version__,
+        "numpy": np.__version__,
+    }
+
+
+def compare(results, baseline, tolerance) -> list:
+    """Returns (key, baseline, result) for the stages slower than the baseline by more than tolerance"""
+
+    regressions = []
+
+    for key, seconds in sorted(results.items()):
+        expected = baseline.get(key)
+        if expected and seconds > expected * (1 + tolerance):
+            regressions.append((key, expected, seconds))
+
+    return regressions
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', type=int, nargs='+', default=DEFAULT_SIZES, help='Record counts to run')
+    parser.add_argument('--loop-cap', type=int, default=DEFAULT_LOOP_CAP,
+                        help='Largest record count run through the per-observation stages')
+    parser.add_argument('--tolerance', type=float, default=DEFAULT_TOLERANCE,
+                        help='Slowdown per record tolerated before a stage is a regression, e.g. 0.25 for 25%%')
+    parser.add_argument('--output', default=RESULTS, help='Where to save the results')
+    parser.add_argument('--baseline', default=BASELINE, help='Baseline to compare with')
+    parser.add_argument('--update-baseline', action='store_true', help='Save the results as the baseline')
+
+    args = parser.parse_args(argv)
+
+    results = run(args.sizes, args.loop_cap)
+    document = {"environment": environment(), "seconds_per_record": results}
+
+    with open(args.baseline if args.update_baseline else args.output, 'w') as f:
+        json.dump(document, f, indent=2, sort_keys=True)
+
+    if args.update_baseline or not os.path.exists(args.baseline):
+        return 0
+
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+
+    if baseline.get('environment') != document['environment']:
+        print(f"Baseline was recorded with {baseline.get('environment')}, results may not be comparable")
+
+    regressions = compare(results, baseline['seconds_per_record'], args.tolerance)
+
+    for key, expected, seconds in regressions:
+        print(f'REGRESSION {key}: {expected * 1e6:.3f} -> {seconds * 1e6:.3f} us/record '
+              f'({seconds / expected - 1:+.0%})')
+
+    if not regressions:
+        print(f'No regressions beyond {args.tolerance:.0%} of the baseline')
+
+    return 1 if regressions else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,422 @@
+"""
+Seeded generator of synthetic WeatherAPI current.json payloads.
+
+Emits {"location": ..., "current": ...} payloads for any number of sites across Australia,
+hourly over any span, with values following the sites' climates: temperatures with
+seasonal and diurnal cycles and day to day weather, humidity falling as it warms, Weibull
+winds with gusts, zero-inflated rain driving cloud, conditions and visibility, and UV
+only in daylight. A share of the measurements is null and a share of the payloads vary
+in shape: without gusts, with the nested air_quality block returned with aqi=yes, or
+with the extra fields of newer API versions.
+
+Values are drawn with NumPy a day of all sites at a time and formatted into JSON lines
+from templates, converting only the distinct values to strings, at around 100 MB/s per
+worker process. The same seed and number of sites give the same corpus whatever the
+number of workers.
+
+Usage:
+    python benchmarks/corpus.py --sites 2000 --start 2020-01-01 --days 730 --output corpus.ndjson
+    python benchmarks/corpus.py --sites 3 --days 1 | head -1
+    python benchmarks/corpus.py --sites 10 --days 7 --format json --output ./raw-bucket
+
+ndjson writes one payload per line to --output (stdout by default). json writes each
+payload as its own object in the raw zone layout under --output, encoded as the raw job
+archives it, so it can be replayed through curation.
+"""
+
+import argparse
+from collections import deque
+from datetime import datetime, timedelta
+import json
+from multiprocessing import Pool
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'lambda'))
+
+from keys import raw_key
+import numpy as np
+import pytz
+
+
+DEFAULT_NULL_RATE = 0.01
+DEFAULT_VARIATION_RATE = 0.05
+
+# Timezones of the sites by longitude band, with the state they are labelled with
+TIMEZONES = (
+    (129.0, 'Australia/Perth', 'Western Australia'),
+    (138.0, 'Australia/Adelaide', 'South Australia'),
+    (141.0, 'Australia/Broken_Hill', 'New South Wales'),
+    (150.0, 'Australia/Melbourne', 'Victoria'),
+    (180.0, 'Australia/Sydney', 'New South Wales'),
+)
+
+# (code, day text, night text, icon number)
+CONDITIONS = (
+    (1000, 'Sunny', 'Clear', 113),
+    (1003, 'Partly cloudy', 'Partly cloudy', 116),
+    (1006, 'Cloudy', 'Cloudy', 119),
+    (1063, 'Patchy rain possible', 'Patchy rain possible', 176),
+    (1183, 'Light rain', 'Light rain', 296),
+    (1195, 'Heavy rain', 'Heavy rain', 308),
+)
+
+EPOCH = datetime(1970, 1, 1)
+
+COMPASS = ('N', 'NNE', 'NE', 'ENE', 'E', 'ESE', 'SE', 'SSE', 'S', 'SSW', 'SW', 'WSW', 'W', 'WNW', 'NW', 'NNW')
+
+# Measurements of the current block, in response order, with their decimals (0 for ints)
+MEASUREMENTS = (
+    ('temp_c', 1), ('temp_f', 1), ('is_day', 0), ('condition', None), ('wind_mph', 1), ('wind_kph', 1),
+    ('wind_degree', 0), ('wind_dir', None), ('pressure_mb', 1), ('pressure_in', 2), ('precip_mm', 1),
+    ('precip_in', 2), ('humidity', 0), ('cloud', 0), ('feelslike_c', 1), ('feelslike_f', 1), ('vis_km', 1),
+    ('vis_miles', 1), ('uv', 1), ('gust_mph', 1), ('gust_kph', 1),
+)
+
+# Payload shapes besides the current one, picked for a share of the payloads
+VARIANTS = ('no_gust', 'air_quality', 'extra')
+EXTRA_MEASUREMENTS = (('windchill_c', 1), ('heatindex_c', 1), ('dewpoint_c', 1))
+AIR_QUALITY = (('co', 1), ('no2', 1), ('o3', 1), ('so2', 1), ('pm2_5', 1), ('pm10', 1), ('us-epa-index', 0),
+               ('gb-defra-index', 0))
+
+
+class Sites:
+    """Fixed attributes of the generated sites, drawn from the seed"""
+
+    def __init__(self, count, seed):
+        rng = np.random.default_rng([seed, 0])
+
+        self.count = count
+        self.lat = np.round(rng.uniform(-43.0, -12.0, count), 2)
+        self.lon = np.round(rng.uniform(115.0, 153.0, count), 2)
+        self.zone = np.searchsorted([bound for bound, _, _ in TIMEZONES], self.lon)
+
+        # Warmer towards the tropics, with a wider seasonal swing inland
+        self.mean_temp = 28.0 + 0.45 * (self.lat + 12.0) + rng.normal(0.0, 1.5, count)
+        self.seasonal_amplitude = rng.uniform(3.0, 9.0, count)
+        self.diurnal_amplitude = rng.uniform(3.0, 8.0, count)
+        self.rain_chance = rng.uniform(0.03, 0.2, count)
+        self.wind_scale = rng.uniform(8.0, 25.0, count)
+
+        self.fragments = [
+            '"name":"Site {:04d}","region":"{}","country":"Australia","lat":{},"lon":{},"tz_id":"{}"'.format(
+                i, TIMEZONES[self.zone[i]][2], self.lat[i], self.lon[i], TIMEZONES[self.zone[i]][1])
+            for i in range(count)
+        ]
+
+
+def utc_offsets(start, days) -> dict:
+    """Returns the UTC offset in seconds of every hour of the span, for each timezone"""
+
+    hours = [pytz.utc.localize(start + timedelta(hours=hour)) for hour in range(days * 24)]
+    return {
+        name: np.array([hour.astimezone(pytz.timezone(name)).utcoffset().total_seconds() for hour in hours],
+                       dtype=np.int64)
+        for _, name, _ in TIMEZONES
+    }
+
+
+def formatted(values, decimals, nulls=None) -> np.ndarray:
+    """Formats numbers as JSON with the given decimals into an object array, with null where the mask is set"""
+
+    # Converting each float to a string is the slowest part of generating, so only the
+    # distinct values, rounded to integers of the last decimal, are converted
+    scaled = np.round(np.asarray(values, dtype=np.float64) * 10 ** decimals).astype(np.int64)
+    distinct, index = np.unique(scaled, return_inverse=True)
+
+    if decimals:
+        table = [f'{value / 10 ** decimals:.{decimals}f}' for value in distinct.tolist()]
+    else:
+        table = [str(value) for value in distinct.tolist()]
+
+    strings = np.array(table + ['null'], dtype=object)[index.reshape(-1)]
+    if nulls is not None:
+        strings[nulls] = 'null'
+    return strings
+
+
+def labels(values, names) -> np.ndarray:
+    """Returns an object array of the names indexed by values"""
+
+    return np.array(list(names), dtype=object)[values]
+
+
+def template(names) -> str:
+    """Returns the JSON line template for the measurements of a shape"""
+
+    current = []
+    for name in names:
+        if name == 'condition':
+            current.append('"condition":{"text":"%s","icon":"//cdn.weatherapi.com/weather/64x64/%s.png","code":%s}')
+        elif name == 'wind_dir':
+            current.append('"wind_dir":"%s"')
+        elif name == 'air_quality':
+            current.append('"air_quality":{' + ','.join(f'"{key}":%s' for key, _ in AIR_QUALITY) + '}')
+        else:
+            current.append(f'"{name}":%s')
+
+    return ('{"location":{%s,"localtime_epoch":%s,"localtime":"%s"},'
+            '"current":{"last_updated_epoch":%s,"last_updated":"%s",' + ','.join(current) + '}}')
+
+
+def shape_names(variant) -> list:
+    """Returns the measurements of a payload shape, in order"""
+
+    names = [name for name, _ in MEASUREMENTS]
+    if variant == 'no_gust':
+        names = [name for name in names if not name.startswith('gust_')]
+    elif variant == 'air_quality':
+        names.append('air_quality')
+    elif variant == 'extra':
+        names += [name for name, _ in EXTRA_MEASUREMENTS]
+    return names
+
+
+def generate_day(sites, start, day, offsets, seed, null_rate=DEFAULT_NULL_RATE,
+                 variation_rate=DEFAULT_VARIATION_RATE) -> list:
+    """Returns the JSON lines of every site for one day, hour by hour"""
+
+    rng = np.random.default_rng([seed, 1, day])
+    n_sites = sites.count
+    rows = 24 * n_sites
+
+    hour_of_span = day * 24 + np.repeat(np.arange(24), n_sites)
+    site = np.tile(np.arange(n_sites), 24)
+
+    utc_epoch = int(pytz.utc.localize(start).timestamp()) + hour_of_span * 3600
+    offset = np.empty(rows, dtype=np.int64)
+    for zone, (_, name, _) in enumerate(TIMEZONES):
+        in_zone = sites.zone[site] == zone
+        offset[in_zone] = offsets[name][hour_of_span[in_zone]]
+    local_epoch = utc_epoch + offset
+    local_hour = (local_epoch // 3600) % 24
+    day_of_year = (local_epoch // 86400) % 365.25
+
+    # Southern hemisphere: warmest in late January, coolest in late July
+    season = np.cos(2 * np.pi * (day_of_year - 25) / 365.25)
+    diurnal = np.cos(2 * np.pi * (local_hour - 15) / 24)
+    weather = rng.normal(0.0, 2.5, n_sites)[site]  # the same anomaly all day at a site
+    temp_c = (sites.mean_temp[site] + sites.seasonal_amplitude[site] * season
+              + sites.diurnal_amplitude[site] * diurnal + weather + rng.normal(0.0, 0.8, rows))
+
+    raining = rng.random(rows) < sites.rain_chance[site]
+    precip_mm = np.where(raining, rng.gamma(0.8, 1.5, rows), 0.0)
+    cloud = np.clip(np.where(raining, rng.normal(85, 10, rows), rng.beta(0.6, 1.2, rows) * 100), 0, 100)
+    humidity = np.clip(60 - 2.0 * (temp_c - sites.mean_temp[site]) + 25 * raining + rng.normal(0, 8, rows), 5, 100)
+
+    wind_kph = sites.wind_scale[site] * rng.weibull(2.0, rows)
+    gust_kph = wind_kph * rng.uniform(1.2, 1.8, rows)
+    wind_degree = rng.integers(0, 360, rows)
+    pressure_mb = rng.normal(1015.0, 6.0, rows) - 4.0 * raining
+    vis_km = np.where(raining, np.clip(rng.normal(6, 2, rows), 1, 10), 10.0)
+
+    is_day = (local_hour >= 6) & (local_hour < 19)
+    uv = np.where(is_day, np.clip(np.sin(np.pi * (local_hour - 6) / 13), 0, 1) * (7 + 5 * season) * (1 - cloud / 150), 0.0)
+    feelslike_c = temp_c - 0.1 * wind_kph * (temp_c < 15) + 0.05 * (humidity - 50) * (temp_c > 26)
+
+    condition = np.select(
+        [precip_mm >= 4, precip_mm >= 0.5, raining, cloud >= 80, cloud >= 30],
+        [5, 4, 3, 2, 1], default=0)
+
+    def nulls():
+        return rng.random(rows) < null_rate if null_rate else None
+
+    # Text and icon of each condition at night (even) and by day (odd)
+    state = condition * 2 + is_day
+    texts = [text for _, day_text, night_text, _ in CONDITIONS for text in (night_text, day_text)]
+    icons = [f'{time}/{icon}' for _, _, _, icon in CONDITIONS for time in ('night', 'day')]
+
+    columns = {
+        'temp_c': formatted(temp_c, 1, nulls()),
+        'temp_f': formatted(temp_c * 9 / 5 + 32, 1, nulls()),
+        'is_day': formatted(is_day, 0),
+        'condition': (
+            labels(state, texts),
+            labels(state, icons),
+            labels(condition, [str(code) for code, _, _, _ in CONDITIONS]),
+        ),
+        'wind_mph': formatted(wind_kph / 1.609, 1, nulls()),
+        'wind_kph': formatted(wind_kph, 1, nulls()),
+        'wind_degree': formatted(wind_degree, 0, nulls()),
+        'wind_dir': labels(((wind_degree + 11.25) // 22.5).astype(np.int64) % 16, COMPASS),
+        'pressure_mb': formatted(pressure_mb, 1, nulls()),
+        'pressure_in': formatted(pressure_mb * 0.02953, 2, nulls()),
+        'precip_mm': formatted(precip_mm, 1, nulls()),
+        'precip_in': formatted(precip_mm / 25.4, 2, nulls()),
+        'humidity': formatted(humidity, 0, nulls()),
+        'cloud': formatted(cloud, 0, nulls()),
+        'feelslike_c': formatted(feelslike_c, 1, nulls()),
+        'feelslike_f': formatted(feelslike_c * 9 / 5 + 32, 1, nulls()),
+        'vis_km': formatted(vis_km, 1, nulls()),
+        'vis_miles': formatted(vis_km / 1.609, 1, nulls()),
+        'uv': formatted(uv, 1, nulls()),
+        'gust_mph': formatted(gust_kph / 1.609, 1, nulls()),
+        'gust_kph': formatted(gust_kph, 1, nulls()),
+        'windchill_c': formatted(feelslike_c, 1, nulls()),
+        'heatindex_c': formatted(np.maximum(feelslike_c, temp_c), 1, nulls()),
+        'dewpoint_c': formatted(temp_c - (100 - humidity) / 5, 1, nulls()),
+        'air_quality': tuple(
+            formatted(rng.lognormal(np.log(scale), 0.5, rows), decimals)
+            for scale, (_, decimals) in zip((230, 5, 40, 1, 5, 9, 1, 1), AIR_QUALITY)
+        ),
+    }
+
+    # Observations are published on the quarter hour
+    last_updated = local_epoch - rng.integers(0, 4, rows) * 900
+    header = (
+        labels(site, sites.fragments),
+        formatted(utc_epoch, 0),
+        local_strings(local_epoch),
+        formatted(last_updated - offset, 0),
+        local_strings(last_updated),
+    )
+
+    variant = np.where(rng.random(rows) < variation_rate, rng.integers(1, len(VARIANTS) + 1, rows), 0)
+
+    lines = np.empty(rows, dtype=object)
+    for index, shape in enumerate(('current',) + VARIANTS):
+        selected = np.flatnonzero(variant == index)
+        if not len(selected):
+            continue
+
+        names = shape_names(shape)
+        fields = [column[selected] for column in header]
+        for name in names:
+            value = columns[name]
+            if isinstance(value, tuple):
+                fields.extend(part[selected] for part in value)
+            else:
+                fields.append(value[selected])
+
+        line = template(names)
+        lines[selected] = [line % values for values in zip(*(field.tolist() for field in fields))]
+
+    return lines.tolist()
+
+
+def local_strings(local_epoch) -> np.ndarray:
+    """Formats local epochs as the API does, e.g. 2022-03-04 11:00, into an object array"""
+
+    distinct, index = np.unique(local_epoch, return_inverse=True)
+    table = [(EPOCH + timedelta(seconds=value)).strftime('%Y-%m-%d %H:%M') for value in distinct.tolist()]
+    return np.array(table, dtype=object)[index.reshape(-1)]
+
+
+# Arguments shared by the days generated in a worker process, set once when it starts
+_worker_args = None
+
+
+def _init_worker(*args) -> None:
+    global _worker_args
+    _worker_args = args
+
+
+def _generate_day(day) -> list:
+    sites, start, offsets, seed, null_rate, variation_rate = _worker_args
+    return generate_day(sites, start, day, offsets, seed, null_rate, variation_rate)
+
+
+def generate(sites, start, days, seed=0, null_rate=DEFAULT_NULL_RATE, variation_rate=DEFAULT_VARIATION_RATE,
+             workers=1):
+    """Yields the JSON lines of each day in order, generating days in parallel across workers"""
+
+    sites = sites if isinstance(sites, Sites) else Sites(sites, seed)
+    args = (sites, start, utc_offsets(start, days), seed, null_rate, variation_rate)
+
+    if workers <= 1:
+        _init_worker(*args)
+        for day in range(days):
+            yield _generate_day(day)
+        return
+
+    with Pool(workers, initializer=_init_worker, initargs=args) as pool:
+        # Only a couple of days per worker are generated ahead of the reader, so a slow reader
+        # does not hold every day in memory, and stopping early only waits for those
+        pending = deque(pool.apply_async(_generate_day, (day,)) for day in range(min(days, 2 * workers)))
+        queued = len(pending)
+        try:
+            while pending:
+                lines = pending.popleft().get()
+                if queued < days:
+                    pending.append(pool.apply_async(_generate_day, (queued,)))
+                    queued += 1
+                yield lines
+        finally:
+            # Pool.terminate can deadlock on Python 3.7 while tasks are queued, so the days
+            # in flight are left to finish
+            pool.close()
+            pool.join()
+
+
+def payloads(sites, start, days, seed=0, **kwargs):
+    """Yields the generated payloads as dicts"""
+
+    for lines in generate(sites, start, days, seed, **kwargs):
+        for line in lines:
+            yield json.loads(line)
+
+
+def write_raw_objects(lines, directory, bucket='corpus') -> int:
+    """Writes payloads as raw zone objects under directory, encoded as the raw job archives them"""
+
+    written = 0
+    tz = pytz.timezone('Australia/Melbourne')
+
+    for line in lines:
+        payload = json.loads(line)
+        dt = datetime.fromtimestamp(payload['location']['localtime_epoch'], tz)
+        site = payload['location']['name'].lower().replace(' ', '-')
+        path = os.path.join(directory, raw_key(bucket, dt, site)[len(f's3://{bucket}/'):])
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'w') as f:
+            json.dump(line, f)
+        written += 1
+
+    return written
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sites', type=int, default=10, help='Number of sites')
+    parser.add_argument('--start', type=datetime.fromisoformat, default=datetime(2022, 1, 1),
+                        help='First day, in UTC (default 2022-01-01)')
+    parser.add_argument('--days', type=int, default=1, help='Days of hourly payloads per site')
+    parser.add_argument('--seed', type=int, default=0, help='Seed of every value drawn')
+    parser.add_argument('--null-rate', type=float, default=DEFAULT_NULL_RATE, help='Share of measurements that are null')
+    parser.add_argument('--variation-rate', type=float, default=DEFAULT_VARIATION_RATE,
+                        help='Share of payloads with another shape: ' + ', '.join(VARIANTS))
+    parser.add_argument('--format', choices=('ndjson', 'json'), default='ndjson', help='Lines or raw zone objects')
+    parser.add_argument('--output', help='NDJSON file (default stdout), or directory for --format json')
+    parser.add_argument('--workers', type=int, default=os.cpu_count(), help='Processes generating days')
+
+    args = parser.parse_args(argv)
+
+    days = generate(args.sites, args.start, args.days, args.seed, args.null_rate, args.variation_rate, args.workers)
+
+    if args.format == 'json':
+        if not args.output:
+            parser.error('--format json needs --output')
+        written = sum(write_raw_objects(lines, args.output) for lines in days)
+        print(f'Wrote {written} payloads under {args.output}', file=sys.stderr)
+        return 0
+
+    out = open(args.output, 'w') if args.output else sys.stdout
+    try:
+        for lines in days:
+            out.write('\n'.join(lines))
+            out.write('\n')
+        out.flush()
+    except BrokenPipeError:
+        # The reader closed the pipe early, e.g. head. Stop generating, and point stdout at
+        # devnull so flushing it at exit does not raise again.
+        days.close()
+        os.dup2(os.open(os.devnull, os.O_WRONLY), sys.stdout.fileno())
+    finally:
+        if args.output:
+            out.close()
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,224 @@
+"""
+Cold-start import profile of the handlers.
+
+Imports each handler module in a fresh interpreter under python -X importtime, once with
+the imports made eagerly and once with the lazy_imports environment variable set (see
+lambda/lazy.py), and records:
+
+    init_ms       time to import the handler module, as in the Lambda init phase
+    first_use_ms  time to import the modules deferred by lazy mode, paid by the first
+                  invocation reaching them
+    packages      milliseconds spent importing each top level package during init
+
+Results are saved as JSON and compared with the committed import baseline; a handler
+whose init is more than --tolerance slower than the baseline is reported as a regression
+and the script exits with status 1.
+
+Usage:
+    python benchmarks/import_profile.py
+    python benchmarks/import_profile.py --path build/layers/unpacked/base/python/lib/python3.7/site-packages
+    python benchmarks/import_profile.py --update-baseline
+
+Times depend on the machine, interpreter and library versions, which are saved with the
+results; for numbers close to Lambda, run with python3.7 and the unpacked layers on --path,
+e.g. inside the public.ecr.aws/lambda/python:3.7 image.
+"""
+
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+LAMBDA_DIR = os.path.join(HERE, '..', 'lambda')
+BASELINE = os.path.join(HERE, 'import_baseline.json')
+RESULTS = os.path.join(HERE, 'import_results.json')
+
+HANDLERS = ('raw', 'curation', 'pipeline')
+MODES = ('eager', 'lazy')
+
+DEFAULT_REPEATS = 5
+DEFAULT_TOLERANCE = 0.25
+TOP_PACKAGES = 8
+
+# Libraries whose versions are saved with the results, as they decide most of the import time
+VERSIONED_PACKAGES = ('botocore', 'fsspec', 'numpy', 'pyarrow', 's3fs')
+
+# Separates the init imports from the deferred ones in the importtime output
+MARKER = '-- first use --'
+
+SCRIPT = '''
+import importlib, json, sys, time
+start = time.perf_counter()
+module = importlib.import_module({handler!r})
+init = time.perf_counter() - start
+from lazy import LazyModule
+deferred = sorted({{value.__name__ for value in vars(module).values() if isinstance(value, LazyModule)}})
+sys.stderr.write({marker!r} + '\\n')
+start = time.perf_counter()
+for name in deferred:
+    importlib.import_module(name)
+first_use = time.perf_counter() - start
+print(json.dumps({{"init_ms": init * 1000, "first_use_ms": first_use * 1000, "deferred": deferred}}))
+'''
+
+
+def parse_importtime(lines) -> dict:
+    """Returns the self time in milliseconds of each top level package in -X importtime output"""
+
+    packages = {}
+
+    for line in lines:
+        if not line.startswith('import time:'):
+            continue
+        fields = line[len('import time:'):].split('|')
+        if len(fields) != 3 or not fields[0].strip().isdigit():
+            continue
+        package = fields[2].strip().split('.')[0]
+        packages[package] = packages.get(package, 0.0) + int(fields[0]) / 1000
+
+    return packages
+
+
+def profile_import(python, handler, lazy, paths) -> dict:
+    """Imports a handler in a fresh interpreter and returns its timings and import breakdown"""
+
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join([LAMBDA_DIR] + list(paths)), PYTHONDONTWRITEBYTECODE='1')
+    env['lazy_imports'] = '1' if lazy else ''
+
+    result = subprocess.run(
+        [python, '-X', 'importtime', '-c', SCRIPT.format(handler=handler, marker=MARKER)],
+        env=env, capture_output=True, text=True, timeout=300,
+    )
+    if result.returncode != 0:
+        raise RuntimeError(f'Importing {handler} failed:\n{result.stderr.strip().splitlines()[-1]}')
+
+    lines = result.stderr.splitlines()
+    split = lines.index(MARKER) if MARKER in lines else len(lines)
+
+    profile = json.loads(result.stdout.strip().splitlines()[-1])
+    profile['packages'] = parse_importtime(lines[:split])
+    profile['first_use_packages'] = parse_importtime(lines[split:])
+
+    return profile
+
+
+def run(python, paths, repeats) -> dict:
+    """Profiles every handler in both modes, keeping the fastest of the repeats"""
+
+    results = {}
+
+    for handler in HANDLERS:
+        results[handler] = {}
+        for mode in MODES:
+            runs = [profile_import(python, handler, mode == 'lazy', paths) for _ in range(repeats)]
+            best = min(runs, key=lambda profile: profile['init_ms'])
+            results[handler][mode] = {
+                "init_ms": round(best['init_ms'], 2),
+                "first_use_ms": round(best['first_use_ms'], 2),
+                "deferred": best['deferred'],
+                "packages": top_packages(best['packages']),
+                "first_use_packages": top_packages(best['first_use_packages']),
+            }
+
+    return results
+
+
+def top_packages(packages, count=TOP_PACKAGES) -> dict:
+    """Returns the packages taking the longest to import, slowest first"""
+
+    ordered = sorted(packages.items(), key=lambda item: item[1], reverse=True)[:count]
+    return {name: round(milliseconds, 2) for name, milliseconds in ordered}
+
+
+def environment(python, paths=()) -> dict:
+    """Returns the machine and the versions of the interpreter and of the libraries it imports from the paths"""
+
+    script = (
+        'import importlib, json, platform\n'
+        'versions = {"python": platform.python_version()}\n'
+        f'for name in {VERSIONED_PACKAGES!r}:\n'
+        '    try:\n'
+        '        versions[name] = importlib.import_module(name).__version__\n'
+        '    except ImportError:\n'
+        '        versions[name] = None\n'
+        'print(json.dumps(versions))\n'
+    )
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(list(paths)), PYTHONDONTWRITEBYTECODE='1')
+    result = subprocess.run([python, '-c', script], env=env, capture_output=True, text=True)
+
+    return dict(json.loads(result.stdout.strip().splitlines()[-1]), machine=platform.machine())
+
+
+def print_results(results) -> None:
+    print(f"{'handler':<10} {'eager init':>11} {'lazy init':>10} {'first use':>10}  deferred")
+    for handler, modes in results.items():
+        eager, lazy = modes['eager'], modes['lazy']
+        print(f"{handler:<10} {eager['init_ms']:>9.1f}ms {lazy['init_ms']:>8.1f}ms {lazy['first_use_ms']:>8.1f}ms  "
+              f"{', '.join(lazy['deferred']) or '-'}")
+
+    for handler, modes in results.items():
+        packages = ', '.join(f'{name} {ms:.1f}ms' for name, ms in modes['eager']['packages'].items())
+        print(f'{handler} init, slowest packages: {packages}')
+
+
+def compare(results, baseline, tolerance) -> list:
+    """Returns (key, baseline, result) for the init times slower than the baseline by more than tolerance"""
+
+    regressions = []
+
+    for handler, modes in sorted(results.items()):
+        for mode, profile in sorted(modes.items()):
+            expected = baseline.get(handler, {}).get(mode, {}).get('init_ms')
+            if expected and profile['init_ms'] > expected * (1 + tolerance):
+                regressions.append((f'{handler}/{mode}', expected, profile['init_ms']))
+
+    return regressions
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--python', default=sys.executable, help='Interpreter importing the handlers')
+    parser.add_argument('--path', action='append', default=[], help='Extra directory on the path, e.g. an unpacked layer')
+    parser.add_argument('--repeats', type=int, default=DEFAULT_REPEATS, help='Imports per handler and mode, the fastest is kept')
+    parser.add_argument('--tolerance', type=float, default=DEFAULT_TOLERANCE,
+                        help='Slowdown tolerated before an init time is a regression, e.g. 0.25 for 25%%')
+    parser.add_argument('--output', default=RESULTS, help='Where to save the results')
+    parser.add_argument('--baseline', default=BASELINE, help='Baseline to compare with')
+    parser.add_argument('--update-baseline', action='store_true', help='Save the results as the baseline')
+
+    args = parser.parse_args(argv)
+
+    results = run(args.python, args.path, args.repeats)
+    document = {"environment": environment(args.python, args.path), "handlers": results}
+
+    print_results(results)
+
+    with open(args.baseline if args.update_baseline else args.output, 'w') as f:
+        json.dump(document, f, indent=2, sort_keys=True)
+
+    if args.update_baseline or not os.path.exists(args.baseline):
+        return 0
+
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+
+    if baseline.get('environment') != document['environment']:
+        print(f"Baseline was recorded with {baseline.get('environment')}, results may not be comparable")
+
+    regressions = compare(results, baseline['handlers'], args.tolerance)
+
+    for key, expected, milliseconds in regressions:
+        print(f'REGRESSION {key}: init {expected:.1f} -> {milliseconds:.1f}ms ({milliseconds / expected - 1:+.0%})')
+
+    if not regressions:
+        print(f'No init regressions beyond {args.tolerance:.0%} of the baseline')
+
+    return 1 if regressions else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,304 @@
+"""
+End-to-end load test of the raw and curation handlers against a fake WeatherAPI.
+
+Starts a local aiohttp server imitating /v1/current.json, points the raw handler at it
+with the weather_api_url environment variable, and stands in an fsspec memory:// or
+file:// filesystem for the raw and curated buckets. Each simulated hour, raw.handler and
+then curation.handler run for every location, as the map topology does, and the
+per-stage timings they emit (see lambda/metrics.py) are collected. The report gives the
+throughput and the p50/p95/p99 latency of every stage.
+
+Usage:
+    python benchmarks/load_harness.py --locations 10 --hours 24
+    python benchmarks/load_harness.py --latency lognormal:120:0.6 --error-rate 0.05 --shape wide
+    python benchmarks/load_harness.py --shape corpus
+    python benchmarks/load_harness.py --fs file --root /tmp/tdf-load --output load.json
+
+Latencies are fixed:MS, uniform:LOW_MS:HIGH_MS or lognormal:MEDIAN_MS:SIGMA. Failed calls
+are answered with a 500 status, which the raw handler retries after waiting 3 seconds
+unless --no-retry-wait is given. Invocations run one at a time, as a Lambda container
+serves one invocation at a time and the metrics recorder is per process.
+"""
+
+import argparse
+import asyncio
+from contextlib import ExitStack, redirect_stdout
+import copy
+from datetime import datetime, timedelta
+import io
+import json
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+from types import SimpleNamespace
+from unittest import mock
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'lambda'))
+
+from aiohttp import web
+from bench_curation import payload_shapes
+from corpus import payloads
+import curation
+from fsspec.implementations.local import LocalFileSystem
+from fsspec.implementations.memory import MemoryFileSystem
+import metrics
+import numpy as np
+import pytz
+import raw
+import s3fs
+
+
+RAW_BUCKET = 'load-test-raw'
+CURATED_BUCKET = 'load-test-curated'
+
+# Simulated hours start here, in the timezone the keys are written in
+DEFAULT_START = datetime(2022, 3, 1)
+
+PERCENTILES = (50, 95, 99)
+
+# Sites of the synthetic payloads served with --shape corpus, for a day
+CORPUS_SITES = 50
+
+
+def parse_latency(spec):
+    """Parses a latency distribution into a function returning a delay in seconds from a Random"""
+
+    kind, _, args = spec.partition(':')
+    try:
+        values = [float(value) for value in args.split(':')] if args else []
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"Latency values must be numbers, got '{spec}'")
+
+    if kind == 'fixed' and len(values) == 1:
+        return lambda rng: values[0] / 1000
+    if kind == 'uniform' and len(values) == 2:
+        return lambda rng: rng.uniform(values[0], values[1]) / 1000
+    if kind == 'lognormal' and len(values) == 2:
+        return lambda rng: rng.lognormvariate(np.log(values[0]), values[1]) / 1000
+
+    raise argparse.ArgumentTypeError(
+        f"Expected fixed:MS, uniform:LOW_MS:HIGH_MS or lognormal:MEDIAN_MS:SIGMA, got '{spec}'")
+
+
+class FakeWeatherAPI:
+    """aiohttp server answering /v1/current.json in a background thread"""
+
+    def __init__(self, latency, error_rate=0.0, shape='current', seed=0):
+        self.latency = latency
+        self.error_rate = error_rate
+        # 'corpus' answers each call with one of a day of synthetic payloads (see corpus.py)
+        if shape == 'corpus':
+            self.payloads = list(payloads(CORPUS_SITES, DEFAULT_START, 1, seed))
+        else:
+            self.payloads = [payload_shapes()[shape]]
+        self.rng = random.Random(seed)
+        self.calls = 0
+        self.errors = 0
+        self.url = None
+        self._loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._loop.run_forever, daemon=True)
+
+    async def current(self, request):
+        self.calls += 1
+        await asyncio.sleep(self.latency(self.rng))
+
+        if self.rng.random() < self.error_rate:
+            self.errors += 1
+            return web.json_response({"error": {"code": 9999, "message": "Internal application error."}}, status=500)
+
+        observation = copy.deepcopy(self.rng.choice(self.payloads))
+        observation['location']['name'] = request.query.get('q', observation['location']['name'])
+        return web.json_response(observation)
+
+    async def _start(self):
+        app = web.Application()
+        app.router.add_get('/v1/current.json', self.current)
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, '127.0.0.1', 0)
+        await site.start()
+        port = site._server.sockets[0].getsockname()[1]
+        return f'http://127.0.0.1:{port}'
+
+    def __enter__(self):
+        self._thread.start()
+        self.url = asyncio.run_coroutine_threadsafe(self._start(), self._loop).result()
+        return self
+
+    def __exit__(self, *exc):
+        asyncio.run_coroutine_threadsafe(self._runner.cleanup(), self._loop).result()
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join()
+
+
+class MemoryBuckets(MemoryFileSystem):
+    """In-memory filesystem storing s3://bucket/key as /bucket/key"""
+
+    @classmethod
+    def _strip_protocol(cls, path):
+        path = str(path)
+        if path.startswith('s3://'):
+            path = '/' + path[len('s3://'):]
+        return super()._strip_protocol(path)
+
+
+class LocalBuckets(LocalFileSystem):
+    """Local filesystem storing s3://bucket/key as ROOT/bucket/key"""
+
+    root = None
+
+    def __init__(self, **kwargs):
+        super().__init__(auto_mkdir=True, **kwargs)
+
+    @classmethod
+    def _strip_protocol(cls, path):
+        path = str(path)
+        if path.startswith('s3://'):
+            path = os.path.join(cls.root, path[len('s3://'):])
+        return super()._strip_protocol(path)
+
+
+def bucket_filesystem(kind, root=None):
+    """Returns the filesystem standing in for the buckets, emptied first for memory://"""
+
+    if kind == 'memory':
+        MemoryBuckets.store.clear()
+        MemoryBuckets.pseudo_dirs[:] = ['']
+        return MemoryBuckets()
+
+    LocalBuckets.root = root or tempfile.mkdtemp(prefix='tdf-load-')
+    return LocalBuckets()
+
+
+def stage_timings(document) -> dict:
+    """Returns {function.stage: milliseconds} from the EMF document of an invocation"""
+
+    names = [metric['Name'] for metric in document['_aws']['CloudWatchMetrics'][0]['Metrics']
+             if metric['Unit'] == 'Milliseconds']
+    return {f"{document['function']}.{name}": document[name] for name in names}
+
+
+def percentiles(values) -> dict:
+    return {f'p{q}': float(np.percentile(values, q)) for q in PERCENTILES}
+
+
+def run_load(fs, api_url, locations, hours, start=DEFAULT_START, retry_wait=True) -> dict:
+    """
+    Runs raw.handler then curation.handler for every location in every hour.
+
+    Returns the wall-clock seconds, the invocation counts and the milliseconds recorded
+    for each stage, including the end-to-end time of each location and hour as
+    'pipeline.end_to_end'.
+    """
+
+    samples = {}
+    failed = 0
+    tz = pytz.timezone('Australia/Melbourne')
+
+    def collect(document):
+        for stage, milliseconds in stage_timings(document).items():
+            samples.setdefault(stage, []).append(milliseconds)
+
+    env = {
+        "raw_bucket": RAW_BUCKET,
+        "curated_bucket": CURATED_BUCKET,
+        "secret_name": 'load-test',
+        "weather_api_url": api_url,
+        "metrics_namespace": os.getenv('metrics_namespace') or 'tdf-load-test',
+    }
+
+    with ExitStack() as stack:
+        stack.enter_context(mock.patch.dict(os.environ, env))
+        stack.enter_context(mock.patch.object(s3fs, 'S3FileSystem', lambda *args, **kwargs: fs))
+        stack.enter_context(mock.patch.object(raw, 'get_secret', lambda secret_name: 'load-test'))
+        if not retry_wait:
+            stack.enter_context(mock.patch.object(raw, 'time', SimpleNamespace(sleep=lambda seconds: None)))
+        stack.enter_context(mock.patch.object(metrics, '_listeners', [collect]))
+
+        began = time.perf_counter()
+
+        for hour in range(hours):
+            dt = tz.localize(start + timedelta(hours=hour))
+
+            with mock.patch.object(raw, 'get_local_datetime', lambda: dt):
+                for location in locations:
+                    invocation = time.perf_counter()
+                    with redirect_stdout(io.StringIO()):
+                        result = raw.handler({"location": location}, None)
+                        if result['status'] == 'SUCCEEDED':
+                            curation.handler(result, None)
+                        else:
+                            failed += 1
+                    samples.setdefault('pipeline.end_to_end', []).append((time.perf_counter() - invocation) * 1000)
+
+        elapsed = time.perf_counter() - began
+
+    runs = len(locations) * hours
+
+    return {"seconds": elapsed, "runs": runs, "failed": failed, "samples": samples}
+
+
+def summarise(result) -> dict:
+    """Returns the throughput and the percentiles of every stage"""
+
+    return {
+        "runs": result['runs'],
+        "failed": result['failed'],
+        "seconds": result['seconds'],
+        "runs_per_second": result['runs'] / result['seconds'] if result['seconds'] else None,
+        "stages": {
+            stage: dict(count=len(values), **percentiles(values))
+            for stage, values in sorted(result['samples'].items())
+        },
+    }
+
+
+def print_summary(summary, server) -> None:
+    print(f"{summary['runs']} runs ({summary['failed']} failed) in {summary['seconds']:.2f}s, "
+          f"{summary['runs_per_second']:.1f} runs/s; {server.calls} API calls, {server.errors} errors")
+    print(f"{'stage':<32} {'count':>6} " + ' '.join(f"{f'p{q} ms':>9}" for q in PERCENTILES))
+    for stage, row in summary['stages'].items():
+        print(f"{stage:<32} {row['count']:>6} " + ' '.join(f"{row[f'p{q}']:>9.2f}" for q in PERCENTILES))
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--locations', type=int, default=10, help='Locations polled each hour')
+    parser.add_argument('--hours', type=int, default=24, help='Hours simulated')
+    parser.add_argument('--latency', type=parse_latency, default=parse_latency('lognormal:80:0.5'),
+                        help='API latency distribution (default lognormal:80:0.5)')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='Share of API calls answered with a 500 status')
+    parser.add_argument('--shape', choices=sorted(payload_shapes()) + ['corpus'], default='current',
+                        help='Payload returned by the API')
+    parser.add_argument('--fs', choices=('memory', 'file'), default='memory', help='Filesystem standing in for the buckets')
+    parser.add_argument('--root', help='Directory holding the buckets with --fs file (default: a temporary directory)')
+    parser.add_argument('--no-retry-wait', dest='retry_wait', action='store_false',
+                        help='Retry failed API calls straight away instead of after 3 seconds')
+    parser.add_argument('--seed', type=int, default=0, help='Seed of the latency and error draws')
+    parser.add_argument('--output', help='Where to save the summary as JSON')
+
+    args = parser.parse_args(argv)
+
+    locations = [
+        {"id": f'loc-{i:03d}', "q": f'{-37.5 + i * 0.01:.4f},{145.74 + i * 0.01:.4f}'}
+        for i in range(args.locations)
+    ]
+    fs = bucket_filesystem(args.fs, args.root)
+
+    with FakeWeatherAPI(args.latency, args.error_rate, args.shape, args.seed) as server:
+        summary = summarise(run_load(fs, server.url, locations, args.hours, retry_wait=args.retry_wait))
+
+    print_summary(summary, server)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(summary, f, indent=2)
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,206 @@
+"""
+Runs the TdfTestStack state machine locally against the real handlers.
+
+Synthesizes the stack for a topology, then runs many executions of its state machine
+concurrently with tdf_test.local_executor. The Lambda tasks call the real handlers in
+process, with their environment from the template, and stand-ins for the AWS services:
+an fsspec memory:// filesystem for the buckets, a fake Secrets Manager client, a
+recorder for SNS, and the fake WeatherAPI server of the load harness. The report gives
+the throughput, the p50/p95/p99 latency of every state, and for topologies without a
+Map the orchestration overhead: the time of an execution outside its Task states.
+
+Usage:
+    python benchmarks/orchestration.py --topology chain --executions 100 --concurrency 10
+    python benchmarks/orchestration.py --topology map --locations 20 --executions 10
+    python benchmarks/orchestration.py --topology fused --transition-ms 25 --output orchestration.json
+
+--transition-ms waits before every state, standing in for Step Functions' own time per
+transition, so topologies with more states can be compared with what they cost in AWS.
+Several executions run in threads of one process, so the per-stage metrics of the
+handlers are left off.
+"""
+
+import argparse
+from contextlib import ExitStack, redirect_stdout
+import importlib
+import io
+import json
+import os
+import sys
+import threading
+import time
+from types import SimpleNamespace
+from unittest import mock
+import uuid
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, '..'))
+sys.path.insert(0, os.path.join(HERE, '..', 'lambda'))
+
+import aws_cdk as core
+from load_harness import FakeWeatherAPI, bucket_filesystem, parse_latency, percentiles, PERCENTILES
+import raw
+import s3fs
+from tdf_test.local_executor import LocalExecutor, definition_from_stack
+from tdf_test.tdf_test_stack import TdfTestStack
+
+
+class LocalSecretsManager:
+    """Secrets Manager client answering every secret with the same value"""
+
+    def __init__(self, secret='local-api-key'):
+        self.secret = secret
+
+    def get_secret_value(self, SecretId):
+        return {"Name": SecretId, "SecretString": self.secret}
+
+
+class LocalSNS:
+    """Records the messages published to each topic"""
+
+    def __init__(self):
+        self.messages = []
+        self.lock = threading.Lock()
+
+    def publish(self, topic, message) -> None:
+        with self.lock:
+            self.messages.append((topic, message))
+
+
+def lambda_invoker(functions):
+    """Returns an invoke callable running the handler of a function with a JSON round trip of its input and output"""
+
+    handlers = {}
+    for logical_id, function in functions.items():
+        module, name = function['handler'].split('.')
+        handlers[logical_id] = getattr(importlib.import_module(module), name)
+
+    def invoke(function, payload):
+        context = SimpleNamespace(aws_request_id=str(uuid.uuid4()))
+        result = handlers[function](json.loads(json.dumps(payload)), context)
+        return json.loads(json.dumps(result))
+
+    return invoke
+
+
+def stack_locations(count) -> list:
+    return [{"id": f'loc-{i:03d}', "q": f'{-37.5 + i * 0.01:.4f},{145.74 + i * 0.01:.4f}'} for i in range(count)]
+
+
+def run_executions(topology, executions, concurrency, api_url, fs, locations=None, transition_delay=0.0) -> dict:
+    """Runs the executions of the topology's state machine, returning them with the wall-clock seconds and SNS messages"""
+
+    stack = TdfTestStack(core.App(), 'tdf-local', topology=topology, locations=locations)
+    definition, functions = definition_from_stack(stack)
+
+    # Environments of all the functions, as the handlers read os.environ in one process
+    env = {"weather_api_url": api_url, "metrics_namespace": ''}
+    for function in functions.values():
+        env.update(function['environment'])
+
+    sns = LocalSNS()
+    secrets = LocalSecretsManager()
+    executor = LocalExecutor(definition, lambda_invoker(functions), sns.publish, transition_delay=transition_delay)
+    execution_input = {"locations": locations} if topology == 'map' else {}
+
+    with ExitStack() as stack:
+        stack.enter_context(mock.patch.dict(os.environ, env))
+        stack.enter_context(mock.patch.object(s3fs, 'S3FileSystem', lambda *args, **kwargs: fs))
+        stack.enter_context(mock.patch.object(raw, 'boto3', SimpleNamespace(client=lambda service: secrets)))
+        stack.enter_context(redirect_stdout(io.StringIO()))
+
+        began = time.perf_counter()
+        results = executor.execute_many([execution_input] * executions, concurrency)
+        seconds = time.perf_counter() - began
+
+    return {"executions": results, "seconds": seconds, "messages": sns.messages, "definition": definition}
+
+
+def task_states(definition) -> set:
+    """Returns the names of the Task states of a definition, including Map iterators"""
+
+    names = set()
+    for name, state in definition['States'].items():
+        if state['Type'] == 'Task':
+            names.add(name)
+        if 'Iterator' in state:
+            names |= task_states(state['Iterator'])
+    return names
+
+
+def summarise(run) -> dict:
+    """Returns the throughput, the percentiles of each state and the orchestration overhead"""
+
+    executions = run['executions']
+    tasks = task_states(run['definition'])
+    has_map = any(state['Type'] == 'Map' for state in run['definition']['States'].values())
+
+    states = {}
+    overheads = []
+    for execution in executions:
+        for state, milliseconds in execution['timings']:
+            states.setdefault(state, []).append(milliseconds)
+        if not has_map:
+            in_tasks = sum(milliseconds for state, milliseconds in execution['timings'] if state in tasks)
+            overheads.append(execution['duration_ms'] - in_tasks)
+
+    durations = [execution['duration_ms'] for execution in executions]
+
+    return {
+        "executions": len(executions),
+        "failed": sum(execution['status'] != 'SUCCEEDED' for execution in executions),
+        "published": len(run['messages']),
+        "seconds": run['seconds'],
+        "executions_per_second": len(executions) / run['seconds'] if run['seconds'] else None,
+        "execution": dict(count=len(durations), **percentiles(durations)),
+        "overhead": dict(count=len(overheads), **percentiles(overheads)) if overheads else None,
+        "states": {state: dict(count=len(values), **percentiles(values)) for state, values in states.items()},
+    }
+
+
+def print_summary(summary) -> None:
+    print(f"{summary['executions']} executions ({summary['failed']} failed, {summary['published']} SNS messages) "
+          f"in {summary['seconds']:.2f}s, {summary['executions_per_second']:.1f} executions/s")
+    print(f"{'state':<32} {'count':>6} " + ' '.join(f"{f'p{q} ms':>9}" for q in PERCENTILES))
+
+    rows = [('execution', summary['execution'])] + list(summary['states'].items())
+    if summary['overhead']:
+        rows.append(('orchestration overhead', summary['overhead']))
+
+    for name, row in rows:
+        print(f"{name:<32} {row['count']:>6} " + ' '.join(f"{row[f'p{q}']:>9.2f}" for q in PERCENTILES))
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--topology', choices=('chain', 'fused', 'map', 'events'), default='chain')
+    parser.add_argument('--executions', type=int, default=50, help='Executions of the state machine')
+    parser.add_argument('--concurrency', type=int, default=10, help='Executions running at the same time')
+    parser.add_argument('--locations', type=int, default=10, help='Locations of the map topology')
+    parser.add_argument('--latency', type=parse_latency, default=parse_latency('lognormal:80:0.5'),
+                        help='API latency distribution (default lognormal:80:0.5)')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='Share of API calls answered with a 500 status')
+    parser.add_argument('--transition-ms', type=float, default=0.0, help='Wait before every state, in milliseconds')
+    parser.add_argument('--seed', type=int, default=0, help='Seed of the latency and error draws')
+    parser.add_argument('--output', help='Where to save the summary as JSON')
+
+    args = parser.parse_args(argv)
+
+    locations = stack_locations(args.locations) if args.topology == 'map' else None
+
+    with FakeWeatherAPI(args.latency, args.error_rate, seed=args.seed) as server:
+        run = run_executions(args.topology, args.executions, args.concurrency, server.url, bucket_filesystem('memory'),
+                             locations, args.transition_ms / 1000)
+
+    summary = summarise(run)
+    print_summary(summary)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(summary, f, indent=2)
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,17 @@
+"""
+Writes observations to the raw zone.
+
+Raw objects hold the API response encoded as a JSON string inside a JSON document, as
+they always have, so readers decode them twice.
+"""
+
+import json
+from metrics import timed
+
+
+def archive_observation(s3_client, json_obj, s3_key) -> None:
+    """Writes an observation to its raw key"""
+
+    with timed('s3_write'):
+        with s3_client.open(s3_key, 'w') as f:
+            json.dump(json.dumps(json_obj), f)
@@ -0,0 +1,373 @@
+"""
+Finds hours missing from the raw and curated zones and backfills them.
+
+The pipeline skips an hour when the API is not available, and nothing goes back for it.
+The planner compares the hours expected in a window with the keys in the raw and curated
+buckets, listing only the days of the window. Hours with raw objects but no curated one
+are curated again from every raw object of the hour, each under its own schedule slot
+(set schedule_minutes as the stack does when the pipeline polls more often than hourly). Hours missing from both are fetched from the history endpoint, one call per day
+and location, with bounded concurrency and a rate limit, then archived and curated in
+batches of days. Completed hours are recorded in a checkpoint file after every batch, so
+a stopped backfill resumes where it left off.
+
+With the event-driven topology, every raw object written raises a notification that
+curates it, so --raw-only archives fetched hours without curating them a second time.
+
+Usage:
+    python backfill.py plan --start 2022-03-01 --end 2022-03-08
+    python backfill.py run --start 2022-03-01 --end 2022-03-08 --checkpoint backfill.json
+    python backfill.py run --start 2022-03-01 --end 2022-03-08 --location healesville=-37.504136,145.744302
+    python backfill.py run --start 2022-03-01 --end 2022-03-08 --raw-only
+"""
+
+from archive import archive_observation
+import argparse
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from curation import curate_observation
+from dataset import day_prefixes, find_all
+from datetime import datetime, timedelta, timezone
+from dateutil.parser import parse
+import json
+from keys import location_shard, parse_curated_key, parse_curated_location, parse_raw_key, raw_key, schedule_minute
+import os
+from raw import DEFAULT_API_URL, DEFAULT_QUERY
+import requests
+import threading
+import time
+
+
+HISTORY_URL = '{}/v1/history.json?key={}&q={}&dt={}'
+
+# Keys are written in Melbourne time
+TIMEZONE = 'Australia/Melbourne'
+
+
+def local_timezone():
+    """Returns the timezone the keys are written in"""
+
+    import pytz
+    return pytz.timezone(TIMEZONE)
+
+
+def expected_hours(start, end) -> list:
+    """
+    Returns the (naive, local) hours between start (inclusive) and end (exclusive).
+
+    Steps through UTC so that the hour skipped when daylight saving starts is not
+    expected and the hour repeated when it ends is only expected once.
+    """
+
+    tz = local_timezone()
+    current = tz.localize(start.replace(minute=0, second=0, microsecond=0)).astimezone(timezone.utc)
+    last = tz.localize(end).astimezone(timezone.utc)
+    hours = []
+
+    while current < last:
+        hour = current.astimezone(tz).replace(tzinfo=None)
+        if not hours or hours[-1] != hour:
+            hours.append(hour)
+        current += timedelta(hours=1)
+
+    return hours
+
+
+def raw_hours(fs, s3_bucket, start, end, location_id=None) -> dict:
+    """
+    Returns {hour: [key]} for the raw objects of a location (None for the original single site)
+    in the days of the window. Sub-hourly runs leave one key per schedule slot in an hour.
+    """
+
+    found = {}
+
+    for path in sorted(find_all(fs, day_prefixes(fs, s3_bucket, 'raw', start, end))):
+        parsed = parse_raw_key(path)
+        if parsed is not None and parsed[1] == location_id:
+            found.setdefault(parsed[0].replace(minute=0), []).append(path)
+
+    return found
+
+
+def curated_hours(fs, s3_bucket, start, end, location_id=None) -> set:
+    """
+    Returns the hours with a curated object for a location (None for the original single site)
+    in the days of the window.
+
+    Batch files written by the SQS curation count for the location directory they are in.
+    """
+
+    found = set()
+
+    for path in find_all(fs, day_prefixes(fs, s3_bucket, 'curated', start, end)):
+        dt = parse_curated_key(path)
+        if dt is not None and parse_curated_location(path) == location_id:
+            found.add(dt.replace(minute=0))
+
+    return found
+
+
+def plan_backfill(fs, raw_bucket, curated_bucket, start, end, location_id=None) -> dict:
+    """
+    Returns the gaps in the window as {"recurate": {hour: [raw key]}, "fetch": [hour]}.
+
+    Hours in "recurate" have raw objects that were never curated, hours in "fetch" are
+    missing from both zones.
+    """
+
+    raw = raw_hours(fs, raw_bucket, start, end, location_id)
+    curated = curated_hours(fs, curated_bucket, start, end, location_id)
+
+    gaps = {"recurate": {}, "fetch": []}
+
+    for hour in expected_hours(start, end):
+        if hour in curated:
+            continue
+        if hour in raw:
+            gaps['recurate'][hour] = raw[hour]
+        else:
+            gaps['fetch'].append(hour)
+
+    return gaps
+
+
+class RateLimiter:
+    """Spaces calls made from any thread at least 1 / rate seconds apart"""
+
+    def __init__(self, rate):
+        self.interval = 1.0 / rate if rate else 0.0
+        self.next_call = 0.0
+        self.lock = threading.Lock()
+
+    def wait(self) -> None:
+        with self.lock:
+            now = time.monotonic()
+            delay = self.next_call - now
+            self.next_call = max(now, self.next_call) + self.interval
+
+        if delay > 0:
+            time.sleep(delay)
+
+
+def fetch_history_day(api_key, query, day, limiter, retries=3) -> dict:
+    """Calls the history endpoint for one day, retrying with a growing wait when it does not respond with a '200' status"""
+
+    base_url = os.getenv('weather_api_url', DEFAULT_API_URL)
+    url = HISTORY_URL.format(base_url, api_key, query, day.strftime('%Y-%m-%d'))
+
+    for attempt in range(retries):
+        limiter.wait()
+        response = requests.get(url, timeout=30)
+        if response.status_code == 200:
+            return response.json()
+        print(f'History API not responding for {day:%Y-%m-%d}, status code: {response.status_code}')
+        time.sleep(3 * (attempt + 1))
+
+    raise IOError(f'History API did not respond for {day:%Y-%m-%d}')
+
+
+def history_observation(history, hour) -> dict:
+    """
+    Returns the observation for a (naive, local) hour of a history response in the shape
+    of the current endpoint, or None if the day does not include it.
+
+    The location's local time is that of the hour, as if the current endpoint had been
+    called then, rather than the time the history was fetched.
+    """
+
+    epoch = int(local_timezone().localize(hour, is_dst=False).timestamp())
+
+    for day in history['forecast']['forecastday']:
+        for entry in day['hour']:
+            if entry['time_epoch'] == epoch:
+                current = dict(entry)
+                current['last_updated_epoch'] = current.pop('time_epoch')
+                current['last_updated'] = current.pop('time')
+                location = dict(history['location'])
+                location['localtime_epoch'] = epoch
+                location['localtime'] = f'{hour:%Y-%m-%d} {hour.hour}:{hour:%M}'
+                return {"location": location, "current": current}
+
+    return None
+
+
+def load_checkpoint(path) -> set:
+    """Returns the hours completed by an earlier run"""
+
+    if not path or not os.path.exists(path):
+        return set()
+
+    with open(path) as f:
+        return {datetime.fromisoformat(hour) for hour in json.load(f)['done']}
+
+
+def save_checkpoint(path, done) -> None:
+    """Records the completed hours, replacing the checkpoint only once it is fully written"""
+
+    if not path:
+        return
+
+    tmp = path + '.tmp'
+    with open(tmp, 'w') as f:
+        json.dump({"done": sorted(hour.isoformat() for hour in done)}, f)
+    os.replace(tmp, path)
+
+
+def save_history_raw(fs, observation, dt, s3_bucket, location_id=None) -> str:
+    """Archives a backfilled observation in the raw zone, encoded as the raw job does"""
+
+    s3_key = raw_key(s3_bucket, dt, location_id, schedule_minute(dt), location_shard(location_id))
+
+    archive_observation(fs, observation, s3_key)
+
+    return s3_key
+
+
+def recurate(fs, s3_keys, curated_bucket, location_id=None) -> None:
+    """Curates an hour again from its raw objects, each for the schedule slot in its key"""
+
+    for s3_key in s3_keys:
+        with fs.open(s3_key, 'rb') as f:
+            json_obj = json.loads(json.loads(f.read()))
+
+        dt, _ = parse_raw_key(s3_key)
+        curate_observation(fs, json_obj, dt, curated_bucket, location_id)
+
+
+def backfill_day(fs, history, hours, raw_bucket, curated_bucket, location_id=None, curate=True) -> list:
+    """Archives and curates the hours of one day of history, returning the hours done. Only archives them unless curate is set."""
+
+    done = []
+
+    for hour in hours:
+        observation = history_observation(history, hour)
+        if observation is None:
+            print(f'History for {hour} not found in the response')
+            continue
+
+        save_history_raw(fs, observation, hour, raw_bucket, location_id)
+        if curate:
+            curate_observation(fs, observation, hour, curated_bucket, location_id)
+        done.append(hour)
+
+    return done
+
+
+def run_backfill(fs, raw_bucket, curated_bucket, start, end, api_key, location=None, concurrency=4,
+                 rate=1.0, batch_days=7, checkpoint=None, curate=True) -> dict:
+    """
+    Backfills the gaps in the window for a location ({"id": ..., "q": ...}, None for the
+    original single site). Fetched hours are only archived when curate is not set, for the
+    pipeline to curate from their raw objects.
+
+    Returns the number of hours curated again and fetched, and the hours that failed.
+    """
+
+    location_id = location['id'] if location else None
+    query = location['q'] if location else DEFAULT_QUERY
+
+    gaps = plan_backfill(fs, raw_bucket, curated_bucket, start, end, location_id)
+    done = load_checkpoint(checkpoint)
+    summary = {"recurated": 0, "fetched": 0, "failed": []}
+
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        # Raw objects that were never curated do not need the API
+        pending = {hour: keys for hour, keys in gaps['recurate'].items() if hour not in done}
+        futures = {executor.submit(recurate, fs, keys, curated_bucket, location_id): hour
+                   for hour, keys in pending.items()}
+        for future in as_completed(futures):
+            hour = futures[future]
+            try:
+                future.result()
+                done.add(hour)
+                summary['recurated'] += 1
+            except Exception as e:
+                print(f'Could not curate {hour} again: {e}')
+                summary['failed'].append(hour)
+        save_checkpoint(checkpoint, done)
+
+        # One history call covers every missing hour of a day
+        days = {}
+        for hour in gaps['fetch']:
+            if hour not in done:
+                days.setdefault(hour.date(), []).append(hour)
+
+        limiter = RateLimiter(rate)
+        ordered = sorted(days)
+
+        for batch_start in range(0, len(ordered), batch_days):
+            batch = ordered[batch_start:batch_start + batch_days]
+            futures = {executor.submit(fetch_history_day, api_key, query, day, limiter): day for day in batch}
+
+            for future in as_completed(futures):
+                day = futures[future]
+                try:
+                    hours = backfill_day(fs, future.result(), days[day], raw_bucket, curated_bucket, location_id, curate)
+                except Exception as e:
+                    print(f'Could not backfill {day}: {e}')
+                    hours = []
+
+                done.update(hours)
+                summary['fetched'] += len(hours)
+                summary['failed'].extend(hour for hour in days[day] if hour not in hours)
+
+            save_checkpoint(checkpoint, done)
+            print(f'Backfilled {summary["fetched"]} hours, {len(ordered) - batch_start - len(batch)} days left')
+
+    summary['failed'].sort()
+    return summary
+
+
+def parse_location(value) -> dict:
+    """Parses an id=query location argument"""
+
+    location_id, _, query = value.partition('=')
+    if not query:
+        raise argparse.ArgumentTypeError(f"Expected id=query, got '{value}'")
+    return {"id": location_id, "q": query}
+
+
+def main(argv=None) -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    plan = subparsers.add_parser('plan', help='List the hours missing from the raw and curated zones')
+    run = subparsers.add_parser('run', help='Curate and fetch the missing hours')
+
+    for command in (plan, run):
+        command.add_argument('--raw-bucket', default=os.getenv('raw_bucket'), help='Raw bucket name')
+        command.add_argument('--curated-bucket', default=os.getenv('curated_bucket'), help='Curated bucket name')
+        command.add_argument('--start', type=parse, required=True, help='Start of the window (inclusive, local time)')
+        command.add_argument('--end', type=parse, required=True, help='End of the window (exclusive, local time)')
+        command.add_argument('--location', type=parse_location, help='Configured location as id=query (default: original site)')
+
+    run.add_argument('--secret-name', default=os.getenv('secret_name'), help='Secrets Manager secret holding the API key')
+    run.add_argument('--concurrency', type=int, default=4, help='History calls in flight at the same time')
+    run.add_argument('--rate', type=float, default=1.0, help='Maximum history calls per second')
+    run.add_argument('--batch-days', type=int, default=7, help='Days fetched and curated between checkpoints')
+    run.add_argument('--checkpoint', help='File recording the completed hours, to resume a stopped backfill')
+    run.add_argument('--raw-only', action='store_true',
+                     help='Archive fetched hours without curating them, when raw objects are curated from S3 notifications (events topology)')
+
+    args = parser.parse_args(argv)
+
+    import s3fs
+    fs = s3fs.S3FileSystem()
+
+    location_id = args.location['id'] if args.location else None
+
+    if args.command == 'plan':
+        gaps = plan_backfill(fs, args.raw_bucket, args.curated_bucket, args.start, args.end, location_id)
+        for hour in sorted(gaps['recurate']):
+            print(f'{hour:%Y-%m-%d %H:00}  curate from {", ".join(gaps["recurate"][hour])}')
+        for hour in gaps['fetch']:
+            print(f'{hour:%Y-%m-%d %H:00}  fetch from history')
+        print(f"{len(gaps['recurate'])} hours to curate again, {len(gaps['fetch'])} hours to fetch")
+    elif args.command == 'run':
+        from raw import get_secret
+        summary = run_backfill(fs, args.raw_bucket, args.curated_bucket, args.start, args.end,
+                               get_secret(args.secret_name), args.location, args.concurrency, args.rate,
+                               args.batch_days, args.checkpoint, not args.raw_only)
+        print(f"Curated {summary['recurated']} hours again and fetched {summary['fetched']}, {len(summary['failed'])} failed")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,169 @@
+"""
+Memory-budgeted writing of curated batches.
+
+Batch curation keeps every observation of an SQS batch in memory until the end, then
+encodes each hour into an in-memory parquet buffer and copies it into the upload, so the
+peak grows with the batch. When the ``memory_budget`` environment variable is set to a
+share of the function's configured memory (e.g. 0.25), observations are instead written
+as they are read: rows wait in memory until they reach the budget, or Arrow's memory pool
+does, and are then flushed as one row group per hour through a pq.ParquetWriter streaming
+into the curated object. The peak then depends on the budget rather than the batch size.
+
+The Arrow pool and the process RSS are sampled at every check, and their peaks reported
+with the metrics of the invocation.
+"""
+
+import os
+import pyarrow as pa
+import pyarrow.parquet as pq
+import resource
+from schema import CANONICAL_SCHEMA
+
+
+# Memory assumed when not running in Lambda, in MB
+DEFAULT_MEMORY_MB = 1024
+
+
+def current_rss() -> int:
+    """Returns the resident set size of the process in bytes, or its peak where /proc is not available"""
+
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError):
+        return peak_rss()
+
+
+def peak_rss() -> int:
+    """Returns the peak resident set size of the process in bytes"""
+
+    # Reported in kilobytes on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+class MemoryBudget:
+    """Bytes of curated rows held in memory before they are flushed, with the peaks seen"""
+
+    def __init__(self, limit_bytes):
+        self.limit_bytes = limit_bytes
+        self.arrow_peak_bytes = 0
+        self.rss_peak_bytes = 0
+
+    def sample(self) -> None:
+        """Records the bytes held by Arrow's memory pool and the process"""
+
+        self.arrow_peak_bytes = max(self.arrow_peak_bytes, pa.total_allocated_bytes())
+        self.rss_peak_bytes = max(self.rss_peak_bytes, current_rss())
+
+    def exceeded(self, pending_bytes) -> bool:
+        """Returns whether rows holding pending_bytes, or the Arrow pool, have reached the budget"""
+
+        self.sample()
+        return pending_bytes >= self.limit_bytes or pa.total_allocated_bytes() >= self.limit_bytes
+
+
+def get_budget() -> MemoryBudget:
+    """Returns the budget configured by the memory_budget environment variable, or None to keep batches in memory"""
+
+    share = float(os.getenv('memory_budget') or 0)
+    if share <= 0:
+        return None
+
+    memory_mb = int(os.getenv('AWS_LAMBDA_FUNCTION_MEMORY_SIZE') or DEFAULT_MEMORY_MB)
+    return MemoryBudget(int(memory_mb * 2**20 * share))
+
+
+class ChunkedWriter:
+    """
+    Writes tables conformed to the canonical schema to parquet objects, one row group per
+    flushed chunk, holding at most the budget in rows waiting to be written.
+    """
+
+    def __init__(self, fs, budget):
+        self.fs = fs
+        self.budget = budget
+        self.pending = {}  # key -> [table]
+        self.pending_bytes = 0
+        self.writers = {}  # key -> (file, ParquetWriter)
+        self.failed = set()  # keys whose write failed, to be aborted with every message in them
+        self.row_groups = 0
+
+    def write(self, s3_key, table) -> None:
+        """Adds a table to an object, flushing every pending chunk once the budget is reached"""
+
+        # The object will be aborted, and its messages retried
+        if s3_key in self.failed:
+            return
+
+        self.pending.setdefault(s3_key, []).append(table)
+        self.pending_bytes += table.nbytes
+
+        if self.budget.exceeded(self.pending_bytes):
+            self.flush()
+
+    def _flush_key(self, s3_key) -> None:
+        tables = self.pending.get(s3_key)
+        if not tables:
+            return
+
+        try:
+            if s3_key not in self.writers:
+                f = self.fs.open(s3_key, 'wb')
+                self.writers[s3_key] = (f, pq.ParquetWriter(f, CANONICAL_SCHEMA))
+
+            chunk = pa.concat_tables(tables)
+            self.writers[s3_key][1].write_table(chunk, row_group_size=chunk.num_rows)
+        except Exception:
+            self.failed.add(s3_key)
+            raise
+        finally:
+            # Rows are dropped once written, or once the object is marked failed so that its messages are retried
+            self.pending_bytes -= sum(table.nbytes for table in self.pending.pop(s3_key))
+
+        self.row_groups += 1
+
+    def flush(self) -> None:
+        """
+        Writes the rows waiting for every object as a row group each. Every object is tried,
+        and the first error raised once they all have been.
+        """
+
+        error = None
+        for s3_key in list(self.pending):
+            try:
+                self._flush_key(s3_key)
+            except Exception as e:
+                print(f'Could not write a chunk of {s3_key}: {e}')
+                error = error or e
+
+        self.budget.sample()
+        if error is not None:
+            raise error
+
+    def close(self, s3_key) -> None:
+        """Writes the remaining rows of an object and completes it"""
+
+        self._flush_key(s3_key)
+
+        # Every row of the object may have been quarantined
+        if s3_key not in self.writers:
+            return
+
+        f, writer = self.writers.pop(s3_key)
+        writer.close()
+        f.close()
+
+    def abort(self, s3_key) -> None:
+        """Drops the rows of an object and removes whatever part of it was written"""
+
+        tables = self.pending.pop(s3_key, [])
+        self.pending_bytes -= sum(table.nbytes for table in tables)
+
+        if s3_key in self.writers:
+            f, writer = self.writers.pop(s3_key)
+            try:
+                writer.close()
+                f.close()
+                self.fs.rm(s3_key)
+            except Exception as e:
+                print(f'Could not remove the partial object {s3_key}: {e}')
@@ -0,0 +1,255 @@
+"""
+Write-ahead buffer of curated observations for high-frequency polling.
+
+Polling every minute would write one small parquet object per observation. When the
+``buffer_dir`` environment variable points at a persistent filesystem (EFS or a local
+disk), curation appends each observation as a line to an NDJSON log there instead, and
+flushes the log to the curated bucket as one parquet file (a single row group) per hour
+and location once it holds ``buffer_max_records`` observations or its oldest observation
+is ``buffer_max_seconds`` old. The age is checked on every append and every read, and
+``buffer.py flush --if-due`` checks it from a schedule, so a quiet buffer still flushes.
+
+A flush first renames the log to a segment, so new observations go to a fresh log while
+it is written. Each segment is written under a key named after it and only deleted once
+written, so a flush that stops part way is finished by the next one without duplicates.
+Readers add the rows of the log and of any segments to the flushed files so that fresh
+observations are visible before they are flushed. They list the flushed files and read the
+buffer under the same lock as a flush, so no row is seen twice or missed.
+
+Usage:
+    python buffer.py flush --bucket my-tdf-tech-test-curated --dir /mnt/buffer
+    python buffer.py flush --bucket my-tdf-tech-test-curated --dir /mnt/buffer --if-due
+"""
+
+import argparse
+from contextlib import contextmanager
+from datetime import datetime
+import fcntl
+import json
+from keys import curated_batch_key, location_shard
+import os
+import pyarrow as pa
+import pyarrow.parquet as pq
+from schema import CANONICAL_SCHEMA
+import time
+
+
+DEFAULT_MAX_RECORDS = 60
+DEFAULT_MAX_SECONDS = 15 * 60
+
+LOG_NAME = 'log.ndjson'
+SEGMENT_PREFIX = 'segment-'
+
+
+class WriteAheadBuffer:
+    """Append-only NDJSON log of conformed observations, flushed to parquet in batches"""
+
+    def __init__(self, directory, max_records=DEFAULT_MAX_RECORDS, max_seconds=DEFAULT_MAX_SECONDS):
+        self.directory = directory
+        self.max_records = max_records
+        self.max_seconds = max_seconds
+        self.log_path = os.path.join(directory, LOG_NAME)
+        self._lock_file = None
+        os.makedirs(directory, exist_ok=True)
+
+    @contextmanager
+    def locked(self):
+        """Holds the lock file, so concurrent invocations sharing the directory take turns. Nested calls share it."""
+
+        if self._lock_file is not None:
+            yield
+            return
+
+        with open(os.path.join(self.directory, 'lock'), 'w') as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            self._lock_file = f
+            try:
+                yield
+            finally:
+                self._lock_file = None
+
+    def append(self, dt, table) -> None:
+        """Appends the rows of a table conformed to the canonical schema, observed at the (naive, local) dt"""
+
+        now = time.time()
+        lines = [
+            json.dumps({"dt": dt.isoformat(), "at": now, "row": row}) + '\n'
+            for row in rows_of(table)
+        ]
+
+        with self.locked():
+            with open(self.log_path, 'a') as f:
+                f.writelines(lines)
+
+    def should_flush(self) -> bool:
+        """Returns whether the log holds enough observations, or old enough ones, to be flushed"""
+
+        if not os.path.exists(self.log_path):
+            return False
+
+        with open(self.log_path) as f:
+            lines = f.readlines()
+
+        if not lines:
+            return False
+
+        return len(lines) >= self.max_records or time.time() - json.loads(lines[0])['at'] >= self.max_seconds
+
+    def flush_if_due(self, fs, s3_bucket) -> list:
+        """Flushes the buffer if it should be, returning the keys written"""
+
+        with self.locked():
+            return self.flush(fs, s3_bucket) if self.should_flush() else []
+
+    def _segments(self) -> list:
+        return sorted(name for name in os.listdir(self.directory) if name.startswith(SEGMENT_PREFIX))
+
+    def flush(self, fs, s3_bucket) -> list:
+        """Writes the log and any unfinished segments to the curated bucket, returning the keys written"""
+
+        written = []
+
+        with self.locked():
+            if os.path.exists(self.log_path) and os.path.getsize(self.log_path):
+                segment = f'{SEGMENT_PREFIX}{datetime.utcnow():%Y%m%dT%H%M%S%f}.ndjson'
+                os.replace(self.log_path, os.path.join(self.directory, segment))
+
+            for segment in self._segments():
+                path = os.path.join(self.directory, segment)
+                segment_id = segment[len(SEGMENT_PREFIX):-len('.ndjson')]
+
+                # One file per hour and location, in the layout of the single observation files
+                hours = {}
+                for dt, row in read_lines(path):
+                    hour = dt.replace(minute=0, second=0, microsecond=0)
+                    hours.setdefault((hour, row.get('location_id') or ''), []).append(row)
+
+                for (hour, location), rows in sorted(hours.items()):
+                    location = location or None
+                    s3_key = curated_batch_key(s3_bucket, hour, segment_id, location, location_shard(location))
+                    with fs.open(s3_key, 'wb') as f:
+                        pq.write_table(table_of(rows), f, row_group_size=len(rows))
+                    written.append(s3_key)
+                    print(f'Flushed {len(rows)} buffered observations to {s3_key}')
+
+                os.remove(path)
+
+        return written
+
+    def read(self, start=None, end=None, columns=None) -> pa.Table:
+        """Returns the observations in [start, end) that have not been flushed yet"""
+
+        rows = []
+
+        with self.locked():
+            names = self._segments() + ([LOG_NAME] if os.path.exists(self.log_path) else [])
+            for name in names:
+                for dt, row in read_lines(os.path.join(self.directory, name)):
+                    if start is not None and dt < start:
+                        continue
+                    if end is not None and dt >= end:
+                        continue
+                    rows.append(row)
+
+        table = table_of(rows)
+        if columns is not None:
+            table = table.select(columns)
+
+        return table
+
+
+def rows_of(table) -> list:
+    """Returns the rows of a table as dicts"""
+
+    columns = table.to_pydict()
+    return [{name: values[i] for name, values in columns.items()} for i in range(table.num_rows)]
+
+
+def table_of(rows) -> pa.Table:
+    """Builds a table with the canonical schema from row dicts"""
+
+    return pa.Table.from_arrays(
+        [pa.array([row.get(field.name) for row in rows], field.type) for field in CANONICAL_SCHEMA],
+        schema=CANONICAL_SCHEMA,
+    )
+
+
+def read_lines(path) -> list:
+    """Returns the (dt, row) of each complete line of a log or segment"""
+
+    entries = []
+
+    with open(path) as f:
+        for line in f:
+            # A line cut short by a crash mid append is dropped
+            if not line.endswith('\n'):
+                break
+            entry = json.loads(line)
+            entries.append((datetime.fromisoformat(entry['dt']), entry['row']))
+
+    return entries
+
+
+def get_buffer() -> WriteAheadBuffer:
+    """Returns the buffer configured by the buffer_dir environment variable, or None if buffering is off"""
+
+    buffer_dir = os.getenv('buffer_dir')
+    if not buffer_dir:
+        return None
+
+    return WriteAheadBuffer(
+        buffer_dir,
+        int(os.getenv('buffer_max_records', DEFAULT_MAX_RECORDS)),
+        int(os.getenv('buffer_max_seconds', DEFAULT_MAX_SECONDS)),
+    )
+
+
+def buffer_observation(fs, s3_bucket, dt, table) -> bool:
+    """
+    Appends a conformed observation to the configured buffer and flushes it when due.
+
+    Returns False if buffering is off, in which case the caller writes the file itself.
+    """
+
+    buffer = get_buffer()
+    if buffer is None:
+        return False
+
+    if dt.tzinfo is not None:
+        import pytz
+        dt = dt.astimezone(pytz.timezone('Australia/Melbourne')).replace(tzinfo=None)
+
+    buffer.append(dt, table)
+    print(f'Observation buffered in {buffer.directory}')
+
+    buffer.flush_if_due(fs, s3_bucket)
+
+    return True
+
+
+def main(argv=None) -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    flush = subparsers.add_parser('flush', help='Write everything buffered to the curated bucket now')
+    flush.add_argument('--bucket', default=os.getenv('curated_bucket'), help='Curated bucket name')
+    flush.add_argument('--dir', default=os.getenv('buffer_dir'), required=not os.getenv('buffer_dir'), help='Buffer directory')
+    flush.add_argument('--if-due', action='store_true', help='Only flush when the buffer is full or old enough, e.g. from cron')
+
+    args = parser.parse_args(argv)
+
+    import s3fs
+
+    if args.command == 'flush':
+        buffer = WriteAheadBuffer(
+            args.dir,
+            int(os.getenv('buffer_max_records', DEFAULT_MAX_RECORDS)),
+            int(os.getenv('buffer_max_seconds', DEFAULT_MAX_SECONDS)),
+        )
+        flush_buffer = buffer.flush_if_due if args.if_due else buffer.flush
+        keys = flush_buffer(s3fs.S3FileSystem(), args.bucket)
+        print(f'Flushed {len(keys)} files')
+
+
+if __name__ == '__main__':
+    main()
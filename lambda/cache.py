@@ -0,0 +1,232 @@
+"""
+Size-bounded local cache for reads of the curated parquet files.
+
+Disk mode layers the fsspec ``blockcache`` filesystem over the target filesystem, so
+only the blocks that are actually read (parquet footers and the requested row groups)
+are fetched and kept in sparse files on local disk. Memory mode keeps whole objects in
+process memory. In both modes the least recently used files are evicted once the
+budget is exceeded, and an entry is dropped when the ETag of the object changes. The
+ETags of the disk cache are kept in etags.json in the cache directory, so a later process
+can check the files it finds there.
+
+Configured through environment variables:
+    cache_mode      - 'disk', 'memory' or 'off' (default 'off')
+    cache_max_bytes - budget for the cached data (default 256 MB)
+    cache_dir       - location of the disk cache (default /tmp/tdf_cache)
+"""
+
+from collections import OrderedDict
+import fsspec
+import io
+import json
+import os
+
+
+DEFAULT_MAX_BYTES = 256 * 2 ** 20
+DEFAULT_CACHE_DIR = '/tmp/tdf_cache'
+
+# ETag of a file found in the cache directory without one recorded in etags.json
+UNKNOWN_ETAG = object()
+
+
+def object_etag(info) -> str:
+    """
+    Returns the ETag of an object from its info, as listed or returned by fs.info.
+
+    Filesystems without ETags (local files, memory://) fall back to the size and
+    modification time.
+    """
+
+    etag = info.get('ETag') or info.get('etag')
+    if etag:
+        return etag.strip('"')
+
+    modified = info.get('LastModified') or info.get('mtime') or info.get('created')
+    return f"{info.get('size')}-{modified}"
+
+
+class CuratedCache:
+    """LRU cache of curated objects, keyed by path and invalidated by ETag"""
+
+    def __init__(self, fs, mode='disk', max_bytes=DEFAULT_MAX_BYTES, cache_dir=DEFAULT_CACHE_DIR):
+        if mode not in ('disk', 'memory'):
+            raise ValueError(f'Unknown cache mode: {mode}')
+
+        self.fs = fs
+        self.mode = mode
+        self.max_bytes = max_bytes
+
+        # path -> ETag for disk mode, path -> (ETag, bytes) for memory mode, oldest first
+        self._entries = OrderedDict()
+        # Bytes held by memory mode, kept as entries are added and dropped
+        self._memory_bytes = 0
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+        if mode == 'disk':
+            self._blockcache = fsspec.filesystem('blockcache', fs=fs, cache_storage=cache_dir, expiry_time=False)
+            self._etags_path = os.path.join(cache_dir, 'etags.json')
+
+            etags = {}
+            if os.path.exists(self._etags_path):
+                with open(self._etags_path) as f:
+                    etags = json.load(f)
+
+            # Pick up files cached by an earlier process using the same cache directory. Newer
+            # fsspec releases keep the cache metadata on a separate object. Files without a
+            # known ETag are fetched again on their first read.
+            metadata = getattr(self._blockcache, '_metadata', self._blockcache)
+            cached = sorted(metadata.cached_files[-1].items(), key=lambda item: item[1]['time'])
+            for path, detail in cached:
+                self._entries[path] = etags.get(path, UNKNOWN_ETAG)
+
+    def open(self, path, mode='rb', info=None):
+        """
+        Opens a curated object for reading, serving it locally when the cached copy is current.
+
+        info is the object's detail from a listing, when the caller has it, which saves
+        a HEAD request to find its ETag.
+        """
+
+        if 'r' not in mode:
+            raise ValueError('The curated cache is read only')
+
+        path = self.fs._strip_protocol(path)
+        etag = object_etag(info if info is not None else self.fs.info(path))
+
+        cached = path in self._entries
+        cached_etag = self._entries[path][0] if self.mode == 'memory' and cached else self._entries.get(path)
+
+        if cached and cached_etag == etag:
+            self.hits += 1
+            self._entries.move_to_end(path)
+        else:
+            # Includes files of an earlier process whose ETag is unknown, which may be stale
+            if cached:
+                self.invalidations += 1
+                self._drop(path)
+            self.misses += 1
+
+        if self.mode == 'memory':
+            if path not in self._entries:
+                data = self.fs.cat_file(path)
+                self._entries[path] = (etag, data)
+                self._memory_bytes += len(data)
+            f = io.BytesIO(self._entries[path][1])
+        else:
+            if self._entries.get(path) != etag:
+                self._entries[path] = etag
+                self._save_etags()
+            f = self._blockcache.open(path, mode)
+
+        self._evict(keep=path)
+        return f
+
+    def stats(self) -> dict:
+        """Returns the hit, miss, eviction and invalidation counters and the bytes held"""
+
+        return {
+            "mode": self.mode,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "invalidations": self.invalidations,
+            "files": len(self._entries),
+            "bytes": self.size(),
+            "max_bytes": self.max_bytes,
+        }
+
+    def size(self) -> int:
+        """Returns the number of bytes currently held by the cache"""
+
+        if self.mode == 'memory':
+            return self._memory_bytes
+
+        return sum(self._local_size(path) for path in self._entries)
+
+    def clear(self) -> None:
+        """Removes every cached object"""
+
+        for path in list(self._entries):
+            self._drop(path)
+
+        if self.mode == 'disk':
+            self._save_etags()
+
+    def _local_size(self, path) -> int:
+        """Bytes allocated on disk for a cached file, which is sparse when only part of it was read"""
+
+        detail = self._blockcache._check_file(path)
+        if not detail:
+            return 0
+
+        _, fn = detail
+        return os.stat(fn).st_blocks * 512
+
+    def _entry_size(self, path) -> int:
+        if self.mode == 'memory':
+            return len(self._entries[path][1])
+
+        return self._local_size(path)
+
+    def _save_etags(self) -> None:
+        with open(self._etags_path, 'w') as f:
+            json.dump({path: etag for path, etag in self._entries.items() if etag is not UNKNOWN_ETAG}, f)
+
+    def _drop(self, path) -> None:
+        entry = self._entries.pop(path, None)
+        if self.mode == 'memory':
+            if entry is not None:
+                self._memory_bytes -= len(entry[1])
+        else:
+            self._blockcache.pop_from_cache(path)
+
+    def _evict(self, keep) -> None:
+        """
+        Evicts the least recently used objects until the cache fits in its budget.
+
+        The size of the cache is measured once, then reduced by the size of each object evicted.
+        """
+
+        total = self.size()
+        evicted = False
+
+        while total > self.max_bytes and next(iter(self._entries)) != keep:
+            oldest = next(iter(self._entries))
+            total -= self._entry_size(oldest)
+            self._drop(oldest)
+            self.evictions += 1
+            evicted = True
+
+        if evicted and self.mode == 'disk':
+            self._save_etags()
+
+
+_cache = None
+
+
+def get_cache(fs):
+    """
+    Returns the cache configured by the environment, or None if caching is off.
+
+    The cache is kept at module level so that warm Lambda invocations reuse it.
+    """
+
+    global _cache
+
+    mode = os.getenv('cache_mode', 'off')
+    if mode == 'off':
+        return None
+
+    if _cache is None or _cache.fs is not fs:
+        _cache = CuratedCache(
+            fs,
+            mode=mode,
+            max_bytes=int(os.getenv('cache_max_bytes', DEFAULT_MAX_BYTES)),
+            cache_dir=os.getenv('cache_dir', DEFAULT_CACHE_DIR),
+        )
+
+    return _cache
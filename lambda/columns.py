@@ -0,0 +1,53 @@
+"""
+Columns of the canonical schema of the curated dataset.
+
+Kept free of pyarrow so that the stack can build the Glue table from the same list
+the Lambda functions conform their tables to. Types are the Hive names used by Glue.
+"""
+
+
+CANONICAL_COLUMNS = [
+    # configured location id, null for the original single site
+    ('location_id', 'string'),
+    # location
+    ('name', 'string'),
+    ('region', 'string'),
+    ('country', 'string'),
+    ('lat', 'float'),
+    ('lon', 'float'),
+    ('tz_id', 'string'),
+    ('localtime_epoch', 'int'),
+    ('localtime', 'string'),
+    # current
+    ('last_updated_epoch', 'int'),
+    ('last_updated', 'string'),
+    ('temp_c', 'float'),
+    ('temp_f', 'float'),
+    ('is_day', 'int'),
+    ('text', 'string'),
+    ('icon', 'string'),
+    ('code', 'int'),
+    ('wind_mph', 'float'),
+    ('wind_kph', 'float'),
+    ('wind_degree', 'int'),
+    ('wind_dir', 'string'),
+    ('pressure_mb', 'float'),
+    ('pressure_in', 'float'),
+    ('precip_mm', 'float'),
+    ('precip_in', 'float'),
+    ('humidity', 'int'),
+    ('cloud', 'int'),
+    ('feelslike_c', 'float'),
+    ('feelslike_f', 'float'),
+    ('vis_km', 'float'),
+    ('vis_miles', 'float'),
+    ('uv', 'float'),
+    ('gust_mph', 'float'),
+    ('gust_kph', 'float'),
+    # derived at write time from the measurements above (see derived.py), kept from the
+    # API when it reports them
+    ('dewpoint_c', 'float'),
+    ('heatindex_c', 'float'),
+    ('windchill_c', 'float'),
+    ('apparent_temp_c', 'float'),
+]
@@ -0,0 +1,285 @@
+"""
+Dense time x location x metric cube of the curated observations.
+
+Each year is stored as a NumPy memmap of float32 with shape (location, hour of year,
+metric) in C order, so every metric of one site for a year is a single contiguous
+block and a single metric is a strided view over it. Hours without an observation are
+NaN. The axes are described by a sidecar index.json:
+
+    {"metrics": [...], "locations": [...], "dtype": "float32"}
+
+New locations are appended to the end of every year file, so existing offsets never
+move. Hours are counted from midnight on 1 January in local (Melbourne) time, as used in
+the S3 keys. Changes to the index and the growth of the year files are made under a
+lock file in the cube directory, so processes sharing it do not lose each other's
+locations.
+
+The cube is built from the curated dataset rather than by the Lambda functions, which
+have no persistent filesystem. Rows are written in batches, opening and flushing each
+year file once per batch.
+
+Usage:
+    python cube.py build --bucket my-tdf-tech-test-curated --dir ./cube
+    python cube.py build --bucket my-tdf-tech-test-curated --dir ./cube --start 2022-03-01
+"""
+
+import argparse
+from datetime import datetime
+import fcntl
+import json
+import numpy as np
+import os
+import pyarrow as pa
+from schema import CANONICAL_SCHEMA
+
+
+# Numeric columns of the canonical schema that are not coordinates, identifiers or timestamps
+EXCLUDED_METRICS = ('lat', 'lon', 'localtime_epoch', 'last_updated_epoch', 'code')
+DEFAULT_METRICS = [
+    field.name for field in CANONICAL_SCHEMA
+    if (pa.types.is_floating(field.type) or pa.types.is_integer(field.type)) and field.name not in EXCLUDED_METRICS
+]
+
+DTYPE = np.float32
+
+# Curated rows gathered before they are written to the cube by build_cube
+DEFAULT_BATCH_ROWS = 65536
+
+
+def hours_in_year(year) -> int:
+    return (datetime(year + 1, 1, 1) - datetime(year, 1, 1)).days * 24
+
+
+def hour_offset(dt) -> int:
+    """Hours between the start of the year and dt"""
+
+    return int((dt.replace(tzinfo=None) - datetime(dt.year, 1, 1)).total_seconds() // 3600)
+
+
+class Cube:
+    """Memmap backed cube of hourly metrics per location"""
+
+    def __init__(self, directory, metrics=None):
+        self.directory = directory
+        self.index_path = os.path.join(directory, 'index.json')
+
+        os.makedirs(directory, exist_ok=True)
+
+        index = self._read_index()
+        if index is None:
+            index = {"metrics": list(metrics or DEFAULT_METRICS), "locations": [], "dtype": np.dtype(DTYPE).name}
+
+        self.metrics = index['metrics']
+        self.locations = index['locations']
+        self._metric_index = {name: i for i, name in enumerate(self.metrics)}
+        self._location_index = {name: i for i, name in enumerate(self.locations)}
+
+    def _lock(self):
+        """Opens and locks the lock file, so processes sharing the directory take turns at changing it"""
+
+        f = open(os.path.join(self.directory, 'lock'), 'w')
+        fcntl.flock(f, fcntl.LOCK_EX)
+        return f
+
+    def _read_index(self) -> dict:
+        if not os.path.exists(self.index_path):
+            return None
+
+        with open(self.index_path) as f:
+            return json.load(f)
+
+    def _save_index(self) -> None:
+        tmp_path = f'{self.index_path}.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump({"metrics": self.metrics, "locations": self.locations, "dtype": np.dtype(DTYPE).name}, f)
+        os.replace(tmp_path, self.index_path)
+
+    def _year_path(self, year) -> str:
+        return os.path.join(self.directory, f'{year}.dat')
+
+    def _row_size(self, year) -> int:
+        """Bytes taken by one location in a year file"""
+
+        return hours_in_year(year) * len(self.metrics) * np.dtype(DTYPE).itemsize
+
+    def _open_year(self, year, mode='r'):
+        """Opens the memmap for a year, growing the file with NaN rows for locations added since it was written"""
+
+        path = self._year_path(year)
+        shape = (len(self.locations), hours_in_year(year), len(self.metrics))
+
+        if mode == 'r':
+            if not os.path.exists(path) or not self.locations:
+                return None
+            stored = os.path.getsize(path) // self._row_size(year)
+            return np.memmap(path, dtype=DTYPE, mode='r', shape=(stored,) + shape[1:])
+
+        needed = shape[0] * self._row_size(year)
+
+        if not os.path.exists(path) or os.path.getsize(path) < needed:
+            with self._lock():
+                # Checked again under the lock, another process may have grown the file already
+                size = os.path.getsize(path) if os.path.exists(path) else 0
+                if size < needed:
+                    with open(path, 'ab') as f:
+                        f.truncate(needed)
+                    count = (needed - size) // np.dtype(DTYPE).itemsize
+                    grown = np.memmap(path, dtype=DTYPE, mode='r+', offset=size, shape=(count,))
+                    grown[:] = np.nan
+                    grown.flush()
+                    del grown
+
+        return np.memmap(path, dtype=DTYPE, mode='r+', shape=shape)
+
+    def add_locations(self, locations) -> None:
+        """Adds the locations missing from the location axis, keeping those added by other processes"""
+
+        missing = [location for location in dict.fromkeys(locations) if location not in self._location_index]
+        if not missing:
+            return
+
+        with self._lock():
+            index = self._read_index()
+            if index is not None:
+                self.locations = index['locations']
+                self._location_index = {name: i for i, name in enumerate(self.locations)}
+
+            for location in missing:
+                if location not in self._location_index:
+                    self._location_index[location] = len(self.locations)
+                    self.locations.append(location)
+
+            self._save_index()
+
+    def location_index(self, location, create=False) -> int:
+        """Returns the position of a location on the location axis, adding it when create is set"""
+
+        if location not in self._location_index:
+            if not create:
+                raise KeyError(f'Unknown location: {location}')
+            self.add_locations([location])
+
+        return self._location_index[location]
+
+    def write(self, location, dt, values) -> None:
+        """Stores the metrics in values (a mapping of metric name to number) for one location and hour"""
+
+        table = pa.table({name: pa.array([value], pa.float64()) for name, value in values.items() if name in self._metric_index})
+        self.write_rows([location], [dt], table)
+
+    def write_table(self, location, dt, table) -> None:
+        """Stores the rows of a curated table for one location and hour"""
+
+        self.write_rows([location] * table.num_rows, [dt] * table.num_rows, table)
+
+    def write_rows(self, locations, dts, table) -> None:
+        """
+        Stores every row of a curated table, row i for locations[i] and the hour of dts[i].
+
+        Each year file touched is opened and flushed once. Metrics missing from the table
+        are left as they are, and nulls are stored as NaN.
+        """
+
+        if table.num_rows == 0:
+            return
+
+        self.add_locations(locations)
+
+        names = [name for name in self.metrics if name in table.column_names]
+        columns = np.array([self._metric_index[name] for name in names])
+        values = np.column_stack([table.column(name).cast(pa.float64()).to_numpy() for name in names])
+
+        locs = np.array([self._location_index[location] for location in locations])
+        years = np.array([dt.year for dt in dts])
+        hours = np.array([hour_offset(dt) for dt in dts])
+
+        for year in np.unique(years):
+            rows = years == year
+            cube = self._open_year(int(year), mode='r+')
+            cube[locs[rows, None], hours[rows, None], columns[None, :]] = values[rows]
+            cube.flush()
+            del cube
+
+    def read(self, location, start, end, metrics=None) -> np.ndarray:
+        """
+        Returns an array of shape (hours, metrics) for one location between start
+        (inclusive) and end (exclusive). Reads one contiguous block per year.
+        """
+
+        loc = self.location_index(location)
+        columns = [self._metric_index[name] for name in (metrics or self.metrics)]
+        start, end = start.replace(tzinfo=None), end.replace(tzinfo=None)
+
+        parts = []
+        for year in range(start.year, end.year + 1):
+            first = hour_offset(start) if year == start.year else 0
+            last = hour_offset(end) if year == end.year else hours_in_year(year)
+            if last <= first:
+                continue
+
+            cube = self._open_year(year)
+            if cube is None or loc >= cube.shape[0]:
+                parts.append(np.full((last - first, len(columns)), np.nan, dtype=DTYPE))
+            else:
+                parts.append(np.array(cube[loc, first:last])[:, columns])
+
+        if not parts:
+            return np.empty((0, len(columns)), dtype=DTYPE)
+
+        return np.concatenate(parts)
+
+
+def build_cube(fs, s3_bucket, directory, start=None, end=None, batch_rows=DEFAULT_BATCH_ROWS) -> Cube:
+    """Fills a cube from the curated files in [start, end), writing batch_rows rows at a time"""
+
+    from dataset import list_curated, read_curated_file
+    from keys import parse_curated_key, parse_curated_location
+
+    cube = Cube(directory)
+    tables, locations, dts = [], [], []
+
+    for path in list_curated(fs, s3_bucket, start, end):
+        table = read_curated_file(fs, path)
+        dt = parse_curated_key(path)
+
+        # Batch files hold several observations, each with its own location
+        fallback = parse_curated_location(path)
+        locations += [location_id or fallback or name for location_id, name
+                      in zip(table.column('location_id').to_pylist(), table.column('name').to_pylist())]
+        dts += [dt] * table.num_rows
+        tables.append(table)
+
+        if len(dts) >= batch_rows:
+            cube.write_rows(locations, dts, pa.concat_tables(tables))
+            tables, locations, dts = [], [], []
+
+    if tables:
+        cube.write_rows(locations, dts, pa.concat_tables(tables))
+
+    return cube
+
+
+def main(argv=None) -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    build = subparsers.add_parser('build', help='Fill the cube from the curated dataset')
+    build.add_argument('--bucket', default=os.getenv('curated_bucket'), help='Curated bucket name')
+    build.add_argument('--dir', default=os.getenv('cube_dir'), required=not os.getenv('cube_dir'), help='Cube directory')
+    build.add_argument('--start', help='Start of the window (inclusive, local time), to add new hours to an existing cube')
+    build.add_argument('--end', help='End of the window (exclusive, local time)')
+
+    args = parser.parse_args(argv)
+
+    from dateutil.parser import parse
+    import s3fs
+
+    if args.command == 'build':
+        start = parse(args.start) if args.start else None
+        end = parse(args.end) if args.end else None
+        cube = build_cube(s3fs.S3FileSystem(), args.bucket, args.dir, start, end)
+        print(f'Cube in {args.dir} has {len(cube.locations)} locations and {len(cube.metrics)} metrics')
+
+
+if __name__ == '__main__':
+    main()
@@ -2,17 +2,32 @@
 Lambda function to gather JSON data, convert to parquet and then saves to s3 in new place.
 """
 
-import boto3
+from archive import archive_observation
+from budget import ChunkedWriter, get_budget
+from buffer import buffer_observation
 from collections.abc import Mapping
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timezone
-from dateutil.parser import parse
+from derived import add_derived
 import json
+from keys import curated_batch_key, curated_key, location_shard, parse_raw_key, quarantine_key, schedule_minute
+from lazy import lazy_import
+from metrics import instrumented, record, timed
 import os
+from profiling import profiled
 import pyarrow as pa
 import pyarrow.parquet as pq
-import requests
-import s3fs
+from schema import conform
 import time
+from urllib.parse import unquote_plus
+import uuid
+from validation import save_quarantine, validate
+
+# Loaded on first use when the lazy_imports environment variable is set. pyarrow is
+# always imported, as the canonical schema is built from it at import time.
+dateutil_parser = lazy_import('dateutil.parser')
+pytz = lazy_import('pytz')
+s3fs = lazy_import('s3fs')
 
 
 def is_date(string, fuzzy=False) -> bool:
@@ -24,7 +39,7 @@ def is_date(string, fuzzy=False) -> bool:
     """
 
     try: 
-        parse(string, fuzzy=fuzzy)
+        dateutil_parser.parse(string, fuzzy=fuzzy)
         return True
     except ValueError:
         return False
@@ -78,19 +93,24 @@ def transform_data(json_data) -> (list, list):
 def get_local_datetime() -> datetime:
     """The function returns a datetime object with the AEST timezone"""
 
-    import pytz
     now = datetime.now(pytz.timezone('Australia/Melbourne'))
     return now
 
 
-def save_curated_data(s3_client, table, dt, s3_bucket) -> None:
+def save_curated_data(s3_client, table, dt, s3_bucket, location_id=None) -> None:
     """Saves the curated parquet version of the data in S3"""
 
-    s3_key = f's3://{s3_bucket}/curated/{dt.year}/{dt.month}/{dt.day}/{dt.hour}/weather.parquet'
+    s3_key = curated_key(s3_bucket, dt, location_id, schedule_minute(dt), location_shard(location_id))
+
+    # Serialised in memory first, so the parquet encoding and the upload are timed apart
+    with timed('parquet_write'):
+        sink = pa.BufferOutputStream()
+        pq.write_table(table, sink)
+
+    with timed('s3_write'):
+        with s3_client.open(s3_key, 'wb') as f:
+            f.write(sink.getvalue())
 
-    with s3_client.open(s3_key, 'wb') as f:
-        pq.write_table(table, f)
-        
     print(f'Parquet file saved to s3://{s3_bucket}/curated/')
 
 
@@ -98,10 +118,12 @@ def generate_parquet_table(json_obj) -> pa.Table:
     """Converts the original JSON data into Parquet format for improved queryability"""
 
     # Flatten out the data
-    columns, values = transform_data(json_obj)
+    with timed('flatten'):
+        columns, values = transform_data(json_obj)
 
     # Infer the schema in the data
-    parquet_schema = infer_schema(columns, values)
+    with timed('schema_inference'):
+        parquet_schema = infer_schema(columns, values)
 
     # convert the data into pyarrow arrays
     parquet_data = [pa.array([values[k]]) for k,v in enumerate(columns)]
@@ -118,31 +140,280 @@ def generate_parquet_table(json_obj) -> pa.Table:
     return table
 
 
+def curate_observation(s3_client, json_obj, dt, s3_bucket, location_id=None) -> pa.Table:
+    """Converts an observation to parquet and saves or buffers it for the curated bucket"""
+
+    table = generate_parquet_table(json_obj)
+
+    if location_id is not None:
+        table = table.add_column(0, 'location_id', pa.array([location_id] * table.num_rows, pa.string()))
+
+    # Written with the canonical schema so every file matches the Glue table, with the derived metrics filled in
+    table = conform(table)
+    with timed('derived_metrics'):
+        table = add_derived(table)
+
+    # Rows failing validation go to the quarantine zone instead of the curated one
+    with timed('validation'):
+        table, quarantined, _ = validate(table)
+    record('quarantined_rows', 0 if quarantined is None else quarantined.num_rows)
+
+    if quarantined is not None:
+        s3_key = curated_key(s3_bucket, dt, location_id, schedule_minute(dt), location_shard(location_id))
+        save_quarantine(s3_client, quarantine_key(s3_key), quarantined)
+        if table.num_rows == 0:
+            return table
+
+    # Buffered observations are written in batches when the buffer flushes
+    if not buffer_observation(s3_client, s3_bucket, dt, table):
+        save_curated_data(s3_client, table, dt, s3_bucket, location_id)
+
+    return table
+
+
+@profiled('curation')
+@instrumented('curation')
 def handler(event, context) -> dict:
     """Handler function used to run the code for AWS Labmda.
 
-        event: -> Returned with status
+        event: -> Returned with status and location
         context: -> Not utilised
     """
 
     return_obj = {"event": event, "status": "SUCCEEDED"}
 
+    # Set when the job runs for one of the configured locations
+    location = event.get('location')
+    location_id = location['id'] if location else None
+    return_obj['location'] = location
+
     s3_client = s3fs.S3FileSystem()
 
     raw_bucket = os.getenv('raw_bucket')
     curated_bucket = os.getenv('curated_bucket')
 
-    dt = get_local_datetime()
-
-    with s3_client.open(event['s3_key'], 'rb') as f:
+    # Curate for the slot the raw job archived the observation under, rather than the time this job runs
+    parsed = parse_raw_key(event['s3_key']) if event.get('s3_key') else None
+    dt = parsed[0] if parsed is not None else get_local_datetime()
+
+    # Small observations are passed inline by the raw job, saving a round trip to S3
+    if event.get('payload') is not None:
+        json_obj = event['payload']
+        record('inline_payload', 1)
+    else:
+        record('inline_payload', 0)
+        with timed('s3_read'):
+            with s3_client.open(event['s3_key'], 'rb') as f:
+                data = f.read()
+        record('payload_bytes', len(data), 'Bytes')
         try:
-             json_obj = json.loads(json.loads(f.read()))
+            with timed('json_decode'):
+                json_obj = json.loads(json.loads(data))
         except:
             return_obj['status'] = "FAILED"
             return return_obj
 
-    table = generate_parquet_table(json_obj)
+    # The raw job leaves inlined observations for curation to archive, written while they are curated.
+    # Leaving the executor waits for the write, even when curation fails.
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        archive = None
+        if event.get('archived') is False:
+            archive = executor.submit(archive_observation, s3_client, json_obj, event['s3_key'])
 
-    save_curated_data(s3_client, table, dt, curated_bucket)
+        curate_observation(s3_client, json_obj, dt, curated_bucket, location_id)
+
+    if archive is not None:
+        archive.result()
 
     return return_obj
+
+
+def raw_keys_from_message(message) -> list:
+    """Returns the raw object keys in the S3 event notification carried by an SQS message"""
+
+    body = json.loads(message['body'])
+
+    # S3 sends a test event without records when the notification is first configured
+    return [
+        f"s3://{record['s3']['bucket']['name']}/{unquote_plus(record['s3']['object']['key'])}"
+        for record in body.get('Records', [])
+        if record.get('eventName', '').startswith('ObjectCreated')
+    ]
+
+
+@profiled('curation_batch')
+@instrumented('curation_batch')
+def sqs_handler(event, context) -> dict:
+    """Handler function used to curate batches of raw objects queued by S3 event notifications.
+
+        event: -> SQS batch of S3 ObjectCreated notifications for the raw bucket
+        context: -> Not utilised
+
+    The observations of every raw object in the batch are written to one parquet object per
+    hour, including sub-hourly observations. Error responses archived by the raw job are skipped. Returns the ids of the messages that could not be curated, so only those are
+    retried by SQS. With a memory budget (see budget.py) observations are written in chunks as they are read.
+    """
+
+    s3_client = s3fs.S3FileSystem()
+
+    curated_bucket = os.getenv('curated_bucket')
+
+    record('messages', len(event['Records']))
+
+    batch_id = getattr(context, 'aws_request_id', None) or uuid.uuid4().hex
+    budget = get_budget()
+    writer = ChunkedWriter(s3_client, budget) if budget is not None else None
+
+    failed = set()
+    hours = {}  # batch key of the hour and location -> [(message id, table)], tables are not kept when written in chunks
+    quarantined = {}  # batch key -> [(message id, rows failing validation)], when written in chunks
+
+    for message in event['Records']:
+        try:
+            for s3_key in raw_keys_from_message(message):
+                parsed = parse_raw_key(s3_key)
+                if parsed is None:
+                    print(f'Skipping {s3_key}, not a raw observation key')
+                    continue
+                dt, location_id = parsed
+
+                with timed('s3_read'):
+                    with s3_client.open(s3_key, 'rb') as f:
+                        data = f.read()
+                with timed('json_decode'):
+                    json_obj = json.loads(json.loads(data))
+
+                # The raw job archives the response of a failed API call too, which holds no observation
+                if 'current' not in json_obj:
+                    print(f"Skipping {s3_key}, not an observation: {json_obj.get('error')}")
+                    continue
+
+                table = generate_parquet_table(json_obj)
+                if location_id is not None:
+                    table = table.add_column(0, 'location_id', pa.array([location_id] * table.num_rows, pa.string()))
+
+                # Batches follow the layout of the single observation files, so the Glue table sees them
+                batch_key = curated_batch_key(curated_bucket, dt.replace(minute=0), batch_id, location_id,
+                                              location_shard(location_id))
+
+                if writer is None:
+                    hours.setdefault(batch_key, []).append((message['messageId'], table))
+                    continue
+
+                # The object is tracked before writing, so a failed write also fails the whole object
+                hours.setdefault(batch_key, []).append((message['messageId'], None))
+                with timed('derived_metrics'):
+                    table = add_derived(conform(table))
+                with timed('validation'):
+                    table, rejected, _ = validate(table)
+                if rejected is not None:
+                    quarantined.setdefault(batch_key, []).append((message['messageId'], rejected))
+                if table.num_rows == 0:
+                    continue
+
+                with timed('parquet_write'):
+                    writer.write(batch_key, table)
+        except Exception as e:
+            print(f"Could not curate message {message['messageId']}: {e}")
+            failed.add(message['messageId'])
+
+    if writer is not None:
+        close_chunked_batch(writer, hours, failed)
+        record('quarantined_rows', save_batch_quarantine(s3_client, quarantined, failed))
+        record('row_groups', writer.row_groups)
+        record('arrow_peak_bytes', budget.arrow_peak_bytes, 'Bytes')
+        record('rss_peak_bytes', budget.rss_peak_bytes, 'Bytes')
+    else:
+        record('quarantined_rows', save_batch(s3_client, hours, failed))
+
+    record('failed_messages', len(failed))
+
+    return {"batchItemFailures": [{"itemIdentifier": message_id} for message_id in sorted(failed)]}
+
+
+def save_batch(s3_client, hours, failed) -> int:
+    """
+    Writes the observations of each hour of a batch held in memory, adding the messages of
+    hours that fail to failed. Each hour is validated as a whole, so the monotonic rule
+    compares every observation of a site in the hour. Returns the rows quarantined.
+    """
+
+    quarantined_rows = 0
+
+    for s3_key, observations in hours.items():
+        message_ids = {message_id for message_id, _ in observations}
+        observations = [obs for obs in observations if obs[0] not in failed]
+        if not observations:
+            continue
+
+        try:
+            # Derived metrics and validation run once over the whole hour
+            with timed('derived_metrics'):
+                combined = add_derived(pa.concat_tables([conform(table) for _, table in observations]))
+            with timed('validation'):
+                table, rejected, _ = validate(combined)
+            if rejected is not None:
+                save_quarantine(s3_client, quarantine_key(s3_key), rejected)
+                quarantined_rows += rejected.num_rows
+
+            if table.num_rows:
+                with timed('parquet_write'):
+                    sink = pa.BufferOutputStream()
+                    pq.write_table(table, sink)
+                with timed('s3_write'):
+                    with s3_client.open(s3_key, 'wb') as f:
+                        f.write(sink.getvalue())
+                print(f'Parquet file with {table.num_rows} observations saved to {s3_key}')
+        except Exception as e:
+            print(f'Could not save curated batch {s3_key}: {e}')
+            failed.update(message_ids)
+
+    return quarantined_rows
+
+
+def close_chunked_batch(writer, hours, failed) -> None:
+    """
+    Completes the object of each hour written in chunks, adding the messages of hours that
+    fail to failed.
+
+    Rows of a failed message may already be in the object of its hour, so the object is
+    removed and every message of the hour retried, rather than written with duplicates later.
+    """
+
+    for s3_key, observations in hours.items():
+        message_ids = {message_id for message_id, _ in observations}
+
+        # A chunk of the object that failed to write takes every message in it down
+        if message_ids & failed or s3_key in writer.failed:
+            writer.abort(s3_key)
+            failed.update(message_ids)
+            continue
+
+        try:
+            with timed('s3_write'):
+                writer.close(s3_key)
+            print(f'Parquet file with {len(observations)} observations saved to {s3_key}')
+        except Exception as e:
+            print(f'Could not save curated batch {s3_key}: {e}')
+            writer.abort(s3_key)
+            failed.update(message_ids)
+
+
+def save_batch_quarantine(s3_client, quarantined, failed) -> int:
+    """Writes the rows of each hour written in chunks that failed validation, skipping failed messages. Returns the rows written."""
+
+    quarantined_rows = 0
+
+    for s3_key, rejected in quarantined.items():
+        tables = [table for message_id, table in rejected if message_id not in failed]
+        if not tables:
+            continue
+
+        table = pa.concat_tables(tables)
+        try:
+            save_quarantine(s3_client, quarantine_key(s3_key), table)
+            quarantined_rows += table.num_rows
+        except Exception as e:
+            print(f'Could not save quarantined rows for {s3_key}: {e}')
+
+    return quarantined_rows
@@ -0,0 +1,199 @@
+"""
+Read path for the curated parquet dataset.
+
+Files are listed from the curated prefix, filtered to a time window and conformed to
+the canonical schema. Reads go through the local cache when one is configured, and
+include the observations not yet flushed from the write-ahead buffer.
+"""
+
+from cache import get_cache
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from keys import parse_curated_key
+import pyarrow as pa
+import pyarrow.parquet as pq
+from schema import CANONICAL_SCHEMA, conform
+
+
+# Directories at the top of a zone listed at the same time
+DEFAULT_LIST_WORKERS = 16
+
+
+def to_local_naive(dt):
+    """Converts a timezone aware datetime to naive Melbourne time, as used in the keys"""
+
+    if dt is None or dt.tzinfo is None:
+        return dt
+
+    import pytz
+    return dt.astimezone(pytz.timezone('Australia/Melbourne')).replace(tzinfo=None)
+
+
+def list_zone(fs, s3_bucket, zone, workers=DEFAULT_LIST_WORKERS, detail=False) -> list:
+    """
+    Lists every object under the raw or curated zone.
+
+    The directories at the top of the zone are the years of the unsharded layout and the
+    shard directories of the sharded one. Each is listed separately, in parallel, so a
+    sharded zone is listed one shard per request stream. With detail, the info of each
+    object (name, size, ETag, ...) is returned instead of its key.
+    """
+
+    try:
+        top = fs.ls(f'{s3_bucket}/{zone}', detail=False)
+    except FileNotFoundError:
+        return []
+
+    return find_all(fs, top, workers, detail)
+
+
+def find_all(fs, prefixes, workers=DEFAULT_LIST_WORKERS, detail=False) -> list:
+    """Lists every object under each of the prefixes, listing them in parallel"""
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        listings = executor.map(lambda path: fs.find(path, detail=detail), prefixes)
+
+    if detail:
+        return [info for listing in listings for info in listing.values()]
+
+    return [path for listing in listings for path in listing]
+
+
+def day_prefixes(fs, s3_bucket, zone, start, end) -> list:
+    """
+    Returns the directories of the days between start (inclusive) and end (exclusive)
+    under a zone, in the unsharded layout and in each shard directory present.
+    """
+
+    try:
+        top = fs.ls(f'{s3_bucket}/{zone}', detail=False)
+    except FileNotFoundError:
+        return []
+
+    roots = [path for path in top if path.rstrip('/').rsplit('/', 1)[-1].startswith('shard-')]
+    if len(roots) < len(top):
+        roots.append(f'{s3_bucket}/{zone}')
+
+    prefixes = []
+    day = datetime(start.year, start.month, start.day)
+    while day < end:
+        prefixes += [f'{root}/{day.year}/{day.month}/{day.day}' for root in roots]
+        day += timedelta(days=1)
+
+    return prefixes
+
+
+def list_curated(fs, s3_bucket, start=None, end=None, detail=False) -> list:
+    """
+    Lists the curated parquet keys between start (inclusive) and end (exclusive), oldest
+    first, or their info with detail.
+
+    With both start and end, only the day directories in the window are listed, rather
+    than the whole zone.
+    """
+
+    start, end = to_local_naive(start), to_local_naive(end)
+    found = []
+
+    if start is not None and end is not None:
+        entries = find_all(fs, day_prefixes(fs, s3_bucket, 'curated', start, end), detail=detail)
+    else:
+        entries = list_zone(fs, s3_bucket, 'curated', detail=detail)
+
+    for entry in entries:
+        path = entry['name'] if detail else entry
+        dt = parse_curated_key(path)
+        if dt is None:
+            continue
+        if start is not None and dt < start:
+            continue
+        if end is not None and dt >= end:
+            continue
+        found.append((dt, path, entry))
+
+    return [entry for _, _, entry in sorted(found, key=lambda item: item[:2])]
+
+
+def open_curated(fs, path, info=None):
+    """Opens a curated object, through the cache when one is configured, reusing its listed info if given"""
+
+    cache = get_cache(fs)
+    if cache is not None:
+        return cache.open(path, info=info)
+
+    return fs.open(path, 'rb')
+
+
+def read_curated_file(fs, path, columns=None, info=None) -> pa.Table:
+    """Reads one curated file and conforms it to the canonical schema"""
+
+    with open_curated(fs, path, info) as f:
+        table = pq.read_table(f)
+
+    table = conform(table)
+    if columns is not None:
+        table = table.select(columns)
+
+    return table
+
+
+def iter_curated_batches(fs, paths, columns=None, batch_rows=65536):
+    """
+    Yields record batches of roughly batch_rows rows read from the given curated files,
+    given by key or by their info from list_curated(..., detail=True).
+
+    Curated files hold a single observation each, so files are combined until the batch
+    size is reached. Only one batch worth of data is held in memory at a time.
+    """
+
+    pending = []
+    rows = 0
+
+    for path in paths:
+        info = path if isinstance(path, dict) else None
+        table = read_curated_file(fs, info['name'] if info else path, columns, info)
+        pending.append(table)
+        rows += table.num_rows
+
+        if rows >= batch_rows:
+            yield from pa.concat_tables(pending).combine_chunks().to_batches()
+            pending = []
+            rows = 0
+
+    if pending:
+        yield from pa.concat_tables(pending).combine_chunks().to_batches()
+
+
+def read_curated(fs, s3_bucket, start=None, end=None, columns=None, include_buffer=True) -> pa.Table:
+    """
+    Reads every curated file in the time window into a single table.
+
+    Observations still in the write-ahead buffer configured by buffer_dir are included
+    unless include_buffer is False. The buffer is flushed first if it is due, and files are
+    listed under its lock, so a concurrent flush cannot move rows between the two.
+    """
+
+    from buffer import get_buffer
+
+    buffer = get_buffer() if include_buffer else None
+    tail = None
+
+    if buffer is None:
+        paths = list_curated(fs, s3_bucket, start, end)
+    else:
+        with buffer.locked():
+            buffer.flush_if_due(fs, s3_bucket)
+            paths = list_curated(fs, s3_bucket, start, end)
+            tail = buffer.read(to_local_naive(start), to_local_naive(end), columns)
+
+    tables = [read_curated_file(fs, path, columns) for path in paths]
+    if tail is not None and tail.num_rows:
+        tables.append(tail)
+
+    if not tables:
+        schema = CANONICAL_SCHEMA
+        if columns is not None:
+            schema = pa.schema([schema.field(name) for name in columns])
+        return schema.empty_table()
+
+    return pa.concat_tables(tables)
@@ -0,0 +1,114 @@
+"""
+Derived metrics of the curated dataset, computed once when curated data is written.
+
+Dew point, heat index, wind chill and apparent temperature are computed over whole
+columns of a canonical table with NumPy, from temp_c, humidity and wind_kph:
+
+    dewpoint_c       Magnus formula (Alduchov and Eskridge coefficients)
+    heatindex_c      US National Weather Service heat index (Rothfusz regression with
+                     its adjustments), equal to temp_c below about 27 C
+    windchill_c      North American wind chill index, equal to temp_c above 10 C or
+                     with winds under 4.8 km/h
+    apparent_temp_c  Australian Bureau of Meteorology apparent temperature (Steadman,
+                     shade, without radiation)
+
+Values reported by the API (dewpoint_c, heatindex_c and windchill_c in newer payloads)
+are kept, and only missing ones are computed. Rows missing an input get a null.
+"""
+
+import numpy as np
+import pyarrow as pa
+
+
+DERIVED_COLUMNS = ('dewpoint_c', 'heatindex_c', 'windchill_c', 'apparent_temp_c')
+
+
+def dew_point(temp_c, humidity) -> np.ndarray:
+    """Dew point in C from the temperature in C and relative humidity in %"""
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        gamma = np.log(humidity / 100) + 17.625 * temp_c / (243.04 + temp_c)
+        dew = 243.04 * gamma / (17.625 - gamma)
+
+    # A relative humidity of 0 has no dew point
+    return np.where(np.isfinite(dew), dew, np.nan)
+
+
+def heat_index(temp_c, humidity) -> np.ndarray:
+    """Heat index in C from the temperature in C and relative humidity in %"""
+
+    t = temp_c * 9 / 5 + 32
+    rh = humidity
+
+    # Steadman's simple estimate decides whether the regression applies
+    simple = 0.5 * (t + 61.0 + (t - 68.0) * 1.2 + rh * 0.094)
+
+    full = (-42.379 + 2.04901523 * t + 10.14333127 * rh - 0.22475541 * t * rh - 0.00683783 * t * t
+            - 0.05481717 * rh * rh + 0.00122874 * t * t * rh + 0.00085282 * t * rh * rh - 0.00000199 * t * t * rh * rh)
+
+    with np.errstate(invalid='ignore'):
+        dry = (rh < 13) & (t >= 80) & (t <= 112)
+        full = full - dry * (13 - rh) / 4 * np.sqrt(np.clip(17 - np.abs(t - 95), 0, None) / 17)
+        humid = (rh > 85) & (t >= 80) & (t <= 87)
+        full = full + humid * (rh - 85) / 10 * (87 - t) / 5
+
+        index = np.where((simple + t) / 2 >= 80, full, t)
+
+    # A missing humidity fails the threshold above, but the index is unknown rather than the temperature
+    return np.where(np.isnan(rh), np.nan, (index - 32) * 5 / 9)
+
+
+def wind_chill(temp_c, wind_kph) -> np.ndarray:
+    """Wind chill in C from the temperature in C and wind speed in km/h"""
+
+    with np.errstate(invalid='ignore'):
+        v = np.power(np.clip(wind_kph, 0, None), 0.16)
+        chill = 13.12 + 0.6215 * temp_c - 11.37 * v + 0.3965 * temp_c * v
+        applies = (temp_c <= 10) & (wind_kph > 4.8)
+
+    return np.where(np.isnan(wind_kph), np.nan, np.where(applies, chill, temp_c))
+
+
+def apparent_temperature(temp_c, humidity, wind_kph) -> np.ndarray:
+    """Apparent temperature in C from the temperature in C, relative humidity in % and wind speed in km/h"""
+
+    vapour_hpa = humidity / 100 * 6.105 * np.exp(17.27 * temp_c / (237.7 + temp_c))
+    return temp_c + 0.33 * vapour_hpa - 0.70 * wind_kph / 3.6 - 4.00
+
+
+def column(table, name) -> np.ndarray:
+    """Returns a column as float64 with NaN for nulls, all NaN when the table does not have it"""
+
+    if name not in table.column_names:
+        return np.full(table.num_rows, np.nan)
+
+    return table.column(name).cast(pa.float64()).to_numpy()
+
+
+def add_derived(table) -> pa.Table:
+    """Fills the derived columns of a canonical table, keeping the values it already has"""
+
+    temp_c = column(table, 'temp_c')
+    humidity = column(table, 'humidity')
+    wind_kph = column(table, 'wind_kph')
+
+    computed = {
+        'dewpoint_c': lambda: dew_point(temp_c, humidity),
+        'heatindex_c': lambda: heat_index(temp_c, humidity),
+        'windchill_c': lambda: wind_chill(temp_c, wind_kph),
+        'apparent_temp_c': lambda: apparent_temperature(temp_c, humidity, wind_kph),
+    }
+
+    for name in DERIVED_COLUMNS:
+        index = table.schema.get_field_index(name)
+        field = table.schema.field(name)
+        current = column(table, name)
+        missing = np.isnan(current)
+        if not missing.any():
+            continue
+
+        values = np.where(missing, computed[name](), current)
+        array = pa.array(values, pa.float64(), mask=np.isnan(values)).cast(field.type)
+        table = table.set_column(index, field, array)
+
+    return table
@@ -0,0 +1,261 @@
+"""
+Exports of the curated dataset for analysts and downstream consumers.
+
+Snapshots are uncompressed Arrow IPC (Feather v2) files, so readers can memory map
+them and slice record batches without copying:
+
+    reader = pa.ipc.open_file(pa.memory_map('snapshot.arrow'))
+    table = reader.read_all()
+
+Extracts are CSV or newline-delimited JSON streamed one record batch at a time into an
+S3 multipart upload, so peak memory stays at a few batches whatever the window size.
+
+Usage:
+    python export.py snapshot --start 2022-03-01 --end 2022-04-01 --output snapshot.arrow
+    python export.py snapshot --output snapshot.arrow --refresh
+    python export.py extract --format csv --start 2022-01-01 --end 2023-01-01 --output s3://bucket/exports/2022.csv
+"""
+
+import argparse
+import csv
+from dataset import iter_curated_batches, list_curated
+from datetime import datetime
+from dateutil.parser import parse
+import io
+import json
+from keys import parse_curated_key
+import os
+import pyarrow as pa
+from schema import CANONICAL_SCHEMA
+
+
+# Keys stored in the schema metadata of a snapshot. Snapshots written before the exported
+# files were recorded only have the last hour they cover.
+SNAPSHOT_START = b'tdf.snapshot.start'
+SNAPSHOT_END = b'tdf.snapshot.end'
+SNAPSHOT_LAST = b'tdf.snapshot.last_hour'
+SNAPSHOT_FILES = b'tdf.snapshot.files'
+
+# S3 multipart uploads need parts of at least 5 MB
+DEFAULT_PART_SIZE = 8 * 2 ** 20
+
+EXTRACT_FORMATS = ('csv', 'ndjson')
+
+
+def _format_dt(dt) -> bytes:
+    return b'' if dt is None else dt.isoformat().encode()
+
+
+def _parse_dt(value) -> datetime:
+    return None if not value else datetime.fromisoformat(value.decode())
+
+
+def read_snapshot_metadata(path) -> dict:
+    """Returns the window, the last hour and the curated keys covered by an existing snapshot"""
+
+    with pa.memory_map(path) as source:
+        metadata = pa.ipc.open_file(source).schema.metadata or {}
+
+    files = metadata.get(SNAPSHOT_FILES)
+
+    return {
+        "start": _parse_dt(metadata.get(SNAPSHOT_START)),
+        "end": _parse_dt(metadata.get(SNAPSHOT_END)),
+        "last_hour": _parse_dt(metadata.get(SNAPSHOT_LAST)),
+        "files": None if files is None else set(json.loads(files.decode())),
+    }
+
+
+def export_snapshot(fs, s3_bucket, output, start=None, end=None, refresh=False, batch_rows=65536) -> dict:
+    """
+    Writes the curated files in [start, end) to an Arrow IPC file.
+
+    The keys of the curated files exported are recorded in the snapshot. With refresh,
+    the window of the existing snapshot at output is reused and only the curated files it
+    does not hold yet are read from S3, including files that landed late for an hour it
+    already covers (another location, an SQS batch or a buffer flush). Existing batches
+    are copied from the memory mapped snapshot, which is then replaced atomically.
+    """
+
+    previous = None
+    if refresh and os.path.exists(output):
+        previous = read_snapshot_metadata(output)
+        start = previous['start'] if start is None else start
+        end = previous['end'] if end is None else end
+
+    paths = list_curated(fs, s3_bucket, start, end, detail=True)
+    exported = set()
+
+    if previous is not None and previous['files'] is not None:
+        exported = previous['files']
+        paths = [info for info in paths if info['name'] not in exported]
+    elif previous is not None and previous['last_hour'] is not None:
+        # Older snapshots only know the last hour they cover
+        paths = [info for info in paths if parse_curated_key(info['name']) > previous['last_hour']]
+
+    exported = exported | {info['name'] for info in paths}
+    hours = [parse_curated_key(info['name']) for info in paths]
+    if previous is not None and previous['last_hour'] is not None:
+        hours.append(previous['last_hour'])
+    last_hour = max(hours) if hours else None
+
+    schema = CANONICAL_SCHEMA.with_metadata({
+        SNAPSHOT_START: _format_dt(start),
+        SNAPSHOT_END: _format_dt(end),
+        SNAPSHOT_LAST: _format_dt(last_hour),
+        SNAPSHOT_FILES: json.dumps(sorted(exported)).encode(),
+    })
+
+    tmp_output = f'{output}.tmp'
+    copied = 0
+    appended = 0
+
+    with pa.OSFile(tmp_output, 'wb') as sink:
+        with pa.ipc.new_file(sink, schema) as writer:
+            if previous is not None:
+                with pa.memory_map(output) as source:
+                    reader = pa.ipc.open_file(source)
+                    for i in range(reader.num_record_batches):
+                        batch = reader.get_batch(i)
+                        writer.write_batch(batch)
+                        copied += batch.num_rows
+
+            for batch in iter_curated_batches(fs, paths, batch_rows=batch_rows):
+                writer.write_batch(batch)
+                appended += batch.num_rows
+
+    os.replace(tmp_output, output)
+
+    print(f'Snapshot written to {output}: {copied} rows kept, {appended} rows appended from {len(paths)} files')
+
+    return {"output": output, "rows_kept": copied, "rows_appended": appended, "files": len(paths)}
+
+
+def _column_values(column) -> list:
+    """Converts an Arrow column to python values, printing float32 values at their own precision"""
+
+    values = column.to_pylist()
+
+    if pa.types.is_floating(column.type):
+        return [None if v is None else float('%.7g' % v) for v in values]
+
+    return values
+
+
+def format_batch(batch, fmt, header=False) -> str:
+    """Renders a record batch as CSV or newline-delimited JSON text"""
+
+    names = batch.schema.names
+    rows = zip(*(_column_values(column) for column in batch.columns))
+
+    if fmt == 'ndjson':
+        return ''.join(json.dumps(dict(zip(names, row))) + '\n' for row in rows)
+
+    buffer = io.StringIO()
+    writer = csv.writer(buffer, lineterminator='\n')
+    if header:
+        writer.writerow(names)
+    writer.writerows(rows)
+    return buffer.getvalue()
+
+
+def export_extract(fs, s3_bucket, output, fmt='csv', start=None, end=None, columns=None,
+                   batch_rows=65536, part_size=DEFAULT_PART_SIZE) -> dict:
+    """
+    Streams the curated files in [start, end) to a CSV or NDJSON object.
+
+    Each record batch is rendered and written before the next one is read. The output
+    file buffers at most part_size bytes before uploading it as one part of a multipart
+    upload.
+    """
+
+    if fmt not in EXTRACT_FORMATS:
+        raise ValueError(f'Unknown extract format: {fmt}')
+
+    paths = list_curated(fs, s3_bucket, start, end, detail=True)
+    rows = 0
+    size = 0
+
+    with fs.open(output, 'wb', block_size=part_size) as f:
+        if fmt == 'csv' and not paths:
+            names = columns or CANONICAL_SCHEMA.names
+            f.write((','.join(names) + '\n').encode())
+
+        for batch in iter_curated_batches(fs, paths, columns=columns, batch_rows=batch_rows):
+            data = format_batch(batch, fmt, header=(fmt == 'csv' and rows == 0)).encode()
+            f.write(data)
+            rows += batch.num_rows
+            size += len(data)
+
+    print(f'Extract written to {output}: {rows} rows, {size} bytes from {len(paths)} files')
+
+    return {"output": output, "format": fmt, "rows": rows, "bytes": size, "files": len(paths)}
+
+
+def handler(event, context) -> dict:
+    """Handler function used to run an extract in AWS Lambda.
+
+        event: -> format, start, end, columns and output (defaults to the exports/ prefix of the curated bucket)
+        context: -> Not utilised
+    """
+
+    return_obj = {"event": event, "status": "SUCCEEDED"}
+
+    import s3fs
+    fs = s3fs.S3FileSystem()
+
+    curated_bucket = os.getenv('curated_bucket')
+    fmt = event.get('format', 'csv')
+    start = parse(event['start']) if event.get('start') else None
+    end = parse(event['end']) if event.get('end') else None
+
+    output = event.get('output')
+    if output is None:
+        window = '_'.join(dt.strftime('%Y%m%d%H') if dt else 'all' for dt in (start, end))
+        output = f's3://{curated_bucket}/exports/{fmt}/{window}.{fmt}'
+
+    try:
+        return_obj['extract'] = export_extract(fs, curated_bucket, output, fmt, start, end, event.get('columns'))
+    except (OSError, ValueError) as e:
+        print(f'Extract failed: {e}')
+        return_obj['status'] = "FAILED"
+
+    return return_obj
+
+
+def main(argv=None) -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    snapshot = subparsers.add_parser('snapshot', help='Export a time window to a memory-mappable Arrow IPC file')
+    snapshot.add_argument('--bucket', default=os.getenv('curated_bucket'), help='Curated bucket name')
+    snapshot.add_argument('--start', type=parse, help='Start of the window (inclusive, local time)')
+    snapshot.add_argument('--end', type=parse, help='End of the window (exclusive, local time)')
+    snapshot.add_argument('--output', required=True, help='Path of the snapshot file')
+    snapshot.add_argument('--refresh', action='store_true', help='Only append files newer than the existing snapshot')
+    snapshot.add_argument('--batch-rows', type=int, default=65536, help='Rows per record batch')
+
+    extract = subparsers.add_parser('extract', help='Stream a time window to a CSV or NDJSON object')
+    extract.add_argument('--bucket', default=os.getenv('curated_bucket'), help='Curated bucket name')
+    extract.add_argument('--format', choices=EXTRACT_FORMATS, default='csv', help='Output format')
+    extract.add_argument('--start', type=parse, help='Start of the window (inclusive, local time)')
+    extract.add_argument('--end', type=parse, help='End of the window (exclusive, local time)')
+    extract.add_argument('--columns', nargs='+', help='Columns to export (default: all)')
+    extract.add_argument('--output', required=True, help='Path of the extract, e.g. s3://bucket/exports/2022.csv')
+    extract.add_argument('--batch-rows', type=int, default=65536, help='Rows per record batch')
+    extract.add_argument('--part-size', type=int, default=DEFAULT_PART_SIZE, help='Bytes per multipart upload part')
+
+    args = parser.parse_args(argv)
+
+    import s3fs
+    fs = s3fs.S3FileSystem()
+
+    if args.command == 'snapshot':
+        export_snapshot(fs, args.bucket, args.output, args.start, args.end, args.refresh, args.batch_rows)
+    elif args.command == 'extract':
+        export_extract(fs, args.bucket, args.output, args.format, args.start, args.end, args.columns,
+                       args.batch_rows, args.part_size)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,225 @@
+"""
+Arrow Flight server for the curated dataset.
+
+Tickets and flight descriptors are JSON documents with optional filters:
+
+    {"start": "2022-03-01T00:00:00", "end": "2022-03-02T00:00:00",
+     "locations": ["healesville"], "columns": ["localtime", "temp_c"]}
+
+get_flight_info lists the files of the request once and splits them into one endpoint
+per day, so clients can pull the days in parallel with do_get. Each ticket carries the
+curated keys of its day, so do_get reads them without listing the bucket again. Decoded
+hourly partitions are kept in a size-bounded LRU cache so hot partitions are served
+without reading and decoding parquet again.
+
+Usage:
+    python flight_server.py --bucket my-tdf-tech-test-curated
+    python flight_server.py --local-root ./data --bucket curated-bucket --port 8815
+
+Client:
+    client = flight.connect('grpc://localhost:8815')
+    info = client.get_flight_info(flight.FlightDescriptor.for_command(encode_query(start, end)))
+    tables = [client.do_get(endpoint.ticket).read_all() for endpoint in info.endpoints]
+"""
+
+import argparse
+from collections import OrderedDict
+from dataset import list_curated, read_curated_file
+from datetime import datetime, timedelta
+from dateutil.parser import parse
+import json
+from keys import CURATED_KEY, parse_curated_key
+import os
+import posixpath
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.flight as flight
+from schema import CANONICAL_SCHEMA
+import threading
+
+
+DEFAULT_CACHE_BYTES = 512 * 2 ** 20
+
+
+def parse_query(data) -> dict:
+    """Decodes a ticket or descriptor command into start, end, locations, columns and the curated keys to read"""
+
+    query = json.loads(data) if data else {}
+
+    return {
+        "start": parse(query['start']) if query.get('start') else None,
+        "end": parse(query['end']) if query.get('end') else None,
+        "locations": query.get('locations'),
+        "columns": query.get('columns'),
+        "paths": query.get('paths'),
+    }
+
+
+def encode_query(start=None, end=None, locations=None, columns=None, paths=None) -> bytes:
+    """Encodes filters as a ticket or descriptor command, with the curated keys resolved for a ticket"""
+
+    return json.dumps({
+        "start": start.isoformat() if start else None,
+        "end": end.isoformat() if end else None,
+        "locations": locations,
+        "columns": columns,
+        "paths": paths,
+    }).encode()
+
+
+class CuratedFlightServer(flight.FlightServerBase):
+    """Serves filtered record batches of the curated dataset over Arrow Flight"""
+
+    def __init__(self, fs, s3_bucket, location='grpc://0.0.0.0:8815', cache_bytes=DEFAULT_CACHE_BYTES, **kwargs):
+        super().__init__(location, **kwargs)
+        self.fs = fs
+        self.s3_bucket = s3_bucket
+        self.cache_bytes = cache_bytes
+
+        # path -> decoded table, least recently used first. do_get calls run on several threads.
+        self._partitions = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def _read_partition(self, path) -> pa.Table:
+        """Returns the decoded table for one curated file, from the hot partition cache when possible"""
+
+        with self._lock:
+            table = self._partitions.get(path)
+            if table is not None:
+                self.hits += 1
+                self._partitions.move_to_end(path)
+                return table
+            self.misses += 1
+
+        table = read_curated_file(self.fs, path)
+
+        with self._lock:
+            self._partitions[path] = table
+            while len(self._partitions) > 1 and sum(t.nbytes for t in self._partitions.values()) > self.cache_bytes:
+                self._partitions.popitem(last=False)
+
+        return table
+
+    def _schema(self, columns) -> pa.Schema:
+        if columns is None:
+            return CANONICAL_SCHEMA
+        return pa.schema([CANONICAL_SCHEMA.field(name) for name in columns])
+
+    def _paths(self, query) -> list:
+        """Returns the curated keys of a query, as resolved in its ticket or else by listing the window"""
+
+        if query['paths'] is None:
+            return list_curated(self.fs, self.s3_bucket, query['start'], query['end'])
+
+        # Tickets come from clients, so only keys of the curated zone of the bucket are read. Paths are
+        # normalised first, so '..' cannot leave the zone, and the whole key after the bucket must be curated.
+        bucket = self.s3_bucket.strip('/')
+        paths = []
+        for path in query['paths']:
+            normalised = posixpath.normpath(self.fs._strip_protocol(path))
+            relative = normalised.lstrip('/')
+            if not relative.startswith(f'{bucket}/curated/') or CURATED_KEY.fullmatch(relative[len(bucket) + 1:]) is None:
+                raise flight.FlightServerError(f'Not a curated key of {self.s3_bucket}: {path}')
+            paths.append(normalised)
+
+        return paths
+
+    def _batches(self, query):
+        """Yields the record batches matching a query, one curated partition at a time"""
+
+        for path in self._paths(query):
+            table = self._read_partition(path)
+
+            if query['locations']:
+                # Locations match the configured location id, or the name reported by the API
+                value_set = pa.array(query['locations'])
+                mask = pc.or_kleene(
+                    pc.is_in(table.column('location_id'), value_set=value_set),
+                    pc.is_in(table.column('name'), value_set=value_set),
+                )
+                table = table.filter(mask)
+            if query['columns'] is not None:
+                table = table.select(query['columns'])
+
+            yield from table.to_batches()
+
+    def list_flights(self, context, criteria):
+        query = parse_query(criteria)
+        query.pop('paths')
+        yield self.get_flight_info(context, flight.FlightDescriptor.for_command(encode_query(**query)))
+
+    def get_flight_info(self, context, descriptor):
+        query = parse_query(descriptor.command)
+
+        paths = list_curated(self.fs, self.s3_bucket, query['start'], query['end'])
+        if not paths:
+            return flight.FlightInfo(self._schema(query['columns']), descriptor, [], 0, -1)
+
+        days = {}
+        for path in paths:
+            days.setdefault(parse_curated_key(path).date(), []).append(path)
+
+        endpoints = []
+        for day, day_paths in sorted(days.items()):
+            start = datetime(day.year, day.month, day.day)
+            end = start + timedelta(days=1)
+            if query['start'] is not None:
+                start = max(start, query['start'].replace(tzinfo=None))
+            if query['end'] is not None:
+                end = min(end, query['end'].replace(tzinfo=None))
+            ticket = flight.Ticket(encode_query(start, end, query['locations'], query['columns'], day_paths))
+            # No locations: the endpoint is served by this server
+            endpoints.append(flight.FlightEndpoint(ticket, []))
+
+        return flight.FlightInfo(self._schema(query['columns']), descriptor, endpoints, -1, -1)
+
+    def do_get(self, context, ticket):
+        query = parse_query(ticket.ticket)
+        return flight.GeneratorStream(self._schema(query['columns']), self._batches(query))
+
+    def do_action(self, context, action):
+        if action.type == 'cache_stats':
+            stats = {
+                "hits": self.hits,
+                "misses": self.misses,
+                "partitions": len(self._partitions),
+                "bytes": sum(t.nbytes for t in self._partitions.values()),
+            }
+            yield flight.Result(json.dumps(stats).encode())
+        else:
+            raise NotImplementedError(f'Unknown action: {action.type}')
+
+    def list_actions(self, context):
+        return [('cache_stats', 'Hit and miss counters of the hot partition cache')]
+
+
+def main(argv=None) -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--bucket', default=os.getenv('curated_bucket'),
+                        help='Curated bucket name, or directory under --local-root')
+    parser.add_argument('--local-root', help='Serve a file backed dataset from this directory instead of S3')
+    parser.add_argument('--host', default='0.0.0.0')
+    parser.add_argument('--port', type=int, default=8815)
+    parser.add_argument('--cache-bytes', type=int, default=DEFAULT_CACHE_BYTES, help='Budget of the hot partition cache')
+
+    args = parser.parse_args(argv)
+
+    if args.local_root:
+        import fsspec
+        fs = fsspec.filesystem('file')
+        s3_bucket = os.path.join(os.path.abspath(args.local_root), args.bucket or '')
+    else:
+        import s3fs
+        fs = s3fs.S3FileSystem()
+        s3_bucket = args.bucket
+
+    location = f'grpc://{args.host}:{args.port}'
+    server = CuratedFlightServer(fs, s3_bucket, location, cache_bytes=args.cache_bytes)
+    print(f'Serving {s3_bucket} on {location}')
+    server.serve()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,139 @@
+"""
+Builds and parses the S3 keys used for the raw and curated zones.
+
+Observations for a configured location are written under a location directory inside
+the hour. The single site polled before locations were configured keeps the original
+layout without one. Batches curated from the raw object queue are written as one file
+per hour and location, next to the single observation files. Rows failing validation are written
+under quarantine/ instead of curated/, with the rest of the key unchanged.
+
+When the pipeline polls more often than hourly, each observation is named after the
+minute of its schedule slot (weather_{MM}) inside the hour, so runs within the same
+hour do not overwrite each other.
+
+With sharding on, observations for a configured location go under a shard directory
+(shard-{NN}, from a hash of the location id) ahead of the date path, spreading the writes
+of a run across shard_count prefixes instead of one per hour.
+"""
+
+from datetime import datetime
+import hashlib
+import os
+import re
+
+
+RAW_KEY = re.compile(r'raw/(?:shard-\d+/)?(\d+)/(\d+)/(\d+)/(\d+)(?:/(?!weather_\d+\.json$)([^/]+?))?(?:/weather_(\d+))?\.json$')
+CURATED_KEY = re.compile(r'curated/(?:shard-\d+/)?(\d+)/(\d+)/(\d+)/(\d+)/(?:([^/]+)/)?(?:weather_(\d+)|[^/]+)\.parquet$')
+
+
+def schedule_minute(dt, schedule_minutes=None) -> int:
+    """
+    Returns the minute of the schedule slot dt falls in, or None when polling hourly.
+
+    schedule_minutes defaults to the 'schedule_minutes' environment variable set by the stack.
+    """
+
+    if schedule_minutes is None:
+        schedule_minutes = int(os.getenv('schedule_minutes', 60))
+
+    if schedule_minutes >= 60:
+        return None
+
+    return dt.minute - dt.minute % schedule_minutes
+
+
+def location_shard(location, shard_count=None) -> str:
+    """
+    Returns the shard directory of a location, or None when sharding is off or for the original single site.
+
+    shard_count defaults to the 'shard_count' environment variable set by the stack, 0 turns sharding off.
+    """
+
+    if shard_count is None:
+        shard_count = int(os.getenv('shard_count', 0))
+
+    if not shard_count or location is None:
+        return None
+
+    digest = hashlib.md5(location.encode()).hexdigest()
+    return f'shard-{int(digest[:8], 16) % shard_count:02d}'
+
+
+def zone_prefix(s3_bucket, zone, shard=None) -> str:
+    """Returns the prefix of the raw or curated zone, inside the shard directory when given"""
+
+    return f's3://{s3_bucket}/{zone}' if shard is None else f's3://{s3_bucket}/{zone}/{shard}'
+
+
+def raw_key(s3_bucket, dt, location=None, minute=None, shard=None) -> str:
+    """Returns the key of the raw JSON object for the hour of dt, or for its minute slot when given"""
+
+    hour = f'{zone_prefix(s3_bucket, "raw", shard)}/{dt.year}/{dt.month}/{dt.day}/{dt.hour}'
+
+    if minute is not None:
+        directory = hour if location is None else f'{hour}/{location}'
+        return f'{directory}/weather_{minute:02d}.json'
+
+    if location is None:
+        return f'{hour}.json'
+
+    return f'{hour}/{location}.json'
+
+
+def curated_key(s3_bucket, dt, location=None, minute=None, shard=None) -> str:
+    """Returns the key of the curated parquet object for the hour of dt, or for its minute slot when given"""
+
+    directory = f'{zone_prefix(s3_bucket, "curated", shard)}/{dt.year}/{dt.month}/{dt.day}/{dt.hour}'
+    if location is not None:
+        directory = f'{directory}/{location}'
+
+    name = 'weather' if minute is None else f'weather_{minute:02d}'
+
+    return f'{directory}/{name}.parquet'
+
+
+def curated_batch_key(s3_bucket, dt, batch_id, location=None, shard=None) -> str:
+    """Returns the key of a parquet object holding a batch of observations for the hour of dt, in the location directory when given"""
+
+    directory = f'{zone_prefix(s3_bucket, "curated", shard)}/{dt.year}/{dt.month}/{dt.day}/{dt.hour}'
+    if location is not None:
+        directory = f'{directory}/{location}'
+
+    return f'{directory}/batch-{batch_id}.parquet'
+
+
+def quarantine_key(curated_s3_key) -> str:
+    """Returns the key in the quarantine zone for the rows of a curated key that failed validation"""
+
+    return curated_s3_key.replace('/curated/', '/quarantine/', 1)
+
+
+def parse_raw_key(key) -> tuple:
+    """Returns the (naive, local) time slot and location id of a raw key, or None if it is not a raw key"""
+
+    match = RAW_KEY.search(key)
+    if match is None:
+        return None
+
+    year, month, day, hour = (int(part) for part in match.groups()[:4])
+    minute = int(match.group(6) or 0)
+    return datetime(year, month, day, hour, minute), match.group(5)
+
+
+def parse_curated_key(key) -> datetime:
+    """Returns the (naive, local) time slot a curated key was written for, or None if it is not a curated key"""
+
+    match = CURATED_KEY.search(key)
+    if match is None:
+        return None
+
+    year, month, day, hour = (int(part) for part in match.groups()[:4])
+    minute = int(match.group(6) or 0)
+    return datetime(year, month, day, hour, minute)
+
+
+def parse_curated_location(key) -> str:
+    """Returns the location id of a curated key, or None for the original single site layout"""
+
+    match = CURATED_KEY.search(key)
+    return None if match is None else match.group(5)
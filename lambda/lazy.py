@@ -0,0 +1,46 @@
+"""
+Lazy imports of the heavy modules used by the handlers.
+
+s3fs pulls in aiobotocore, aiohttp and botocore, and boto3 and requests add more, all of
+it imported during the Lambda init phase. With the lazy_imports environment variable set,
+lazy_import returns a stand-in module that only imports the real one when an attribute
+is first read, so modules a handler never reaches are never imported and the others
+load during the invocation that uses them:
+
+    s3fs = lazy_import('s3fs')
+
+The stand-in is not registered in sys.modules, so code importing the module normally
+(or patching it in tests) works with the real module. Unset, lazy_import imports the
+module straight away.
+"""
+
+import importlib
+import os
+import sys
+import types
+
+
+class LazyModule(types.ModuleType):
+    """Module imported on first attribute access"""
+
+    def __getattr__(self, name):
+        module = importlib.import_module(self.__name__)
+        return getattr(module, name)
+
+
+def lazy_enabled() -> bool:
+    """Returns whether the lazy_imports environment variable turns the lazy imports on"""
+
+    return os.getenv('lazy_imports', '').lower() in ('1', 'true', 'yes')
+
+
+def lazy_import(name):
+    """Returns the module, or a stand-in importing it on first use in lazy mode"""
+
+    if not lazy_enabled():
+        return importlib.import_module(name)
+
+    if name in sys.modules:
+        return sys.modules[name]
+
+    return LazyModule(name)
@@ -0,0 +1,142 @@
+"""
+Per-stage timings of the handlers in CloudWatch embedded metric format (EMF).
+
+A handler decorated with @instrumented records the time spent in each stage wrapped in
+timed(...), and values passed to record(...), and prints them as one EMF JSON line when
+it returns. CloudWatch Logs turns the line into metrics in the namespace given by the
+metrics_namespace environment variable, with the function name as the dimension:
+
+    @instrumented('raw')
+    def handler(event, context):
+        with timed('api_call'):
+            ...
+        record('retries', 2)
+
+Stages timed more than once in an invocation (retried calls, several writes) are summed.
+Callbacks registered with add_listener also receive each document, e.g. to aggregate
+latencies in a load test.
+When metrics_namespace is not set, timed returns a shared no-op context manager and
+record returns straight away, so instrumented code costs a function call per stage.
+"""
+
+from contextlib import contextmanager, nullcontext
+import functools
+import json
+import os
+import threading
+import time
+
+
+# Cleared after the first invocation of the process
+_cold_start = True
+
+# Recorder of the running invocation, shared with the worker threads of the handler
+_current = None
+
+_DISABLED = nullcontext()
+
+# Called with the EMF document of every instrumented invocation
+_listeners = []
+
+
+class Recorder:
+    """Collects the timings and values of one invocation"""
+
+    def __init__(self, namespace, function):
+        self.namespace = namespace
+        self.function = function
+        self.timings = {}
+        self.values = {}
+        self.lock = threading.Lock()
+
+    @contextmanager
+    def timer(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = (time.perf_counter() - start) * 1000
+            with self.lock:
+                self.timings[name] = self.timings.get(name, 0.0) + elapsed
+
+    def record(self, name, value, unit='Count') -> None:
+        with self.lock:
+            self.values[name] = (value, unit)
+
+    def emf(self) -> dict:
+        """Returns the EMF document of the collected metrics"""
+
+        metrics = [{"Name": name, "Unit": "Milliseconds"} for name in self.timings]
+        metrics += [{"Name": name, "Unit": unit} for name, (_, unit) in self.values.items()]
+
+        document = {
+            "_aws": {
+                "Timestamp": int(time.time() * 1000),
+                "CloudWatchMetrics": [{
+                    "Namespace": self.namespace,
+                    "Dimensions": [["function"]],
+                    "Metrics": metrics,
+                }],
+            },
+            "function": self.function,
+        }
+        document.update({name: round(value, 3) for name, value in self.timings.items()})
+        document.update({name: value for name, (value, _) in self.values.items()})
+
+        return document
+
+
+def timed(name):
+    """Context manager timing a stage of the running invocation"""
+
+    recorder = _current
+    if recorder is None:
+        return _DISABLED
+
+    return recorder.timer(name)
+
+
+def record(name, value, unit='Count') -> None:
+    """Records a value, such as a retry count or payload size, for the running invocation"""
+
+    recorder = _current
+    if recorder is not None:
+        recorder.record(name, value, unit)
+
+
+def add_listener(callback) -> None:
+    """Registers a callback receiving the EMF document of every instrumented invocation"""
+
+    _listeners.append(callback)
+
+
+def instrumented(function):
+    """Decorates a handler to emit the timings and values recorded while it runs"""
+
+    def decorator(handler):
+        @functools.wraps(handler)
+        def wrapper(event, context):
+            global _cold_start, _current
+
+            namespace = os.getenv('metrics_namespace')
+            if not namespace:
+                return handler(event, context)
+
+            recorder = Recorder(namespace, function)
+            recorder.record('cold_start', 1 if _cold_start else 0)
+            _cold_start = False
+            _current = recorder
+
+            try:
+                with recorder.timer('total'):
+                    return handler(event, context)
+            finally:
+                _current = None
+                document = recorder.emf()
+                print(json.dumps(document))
+                for callback in _listeners:
+                    callback(document)
+
+        return wrapper
+
+    return decorator
@@ -0,0 +1,71 @@
+"""
+Lambda function that runs the raw and curation jobs in a single process.
+
+The API is called once, then the raw response is archived and the curated parquet
+file is written concurrently. This saves the second invocation, its cold start, the
+Step Functions transitions and the S3 read between the two jobs.
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+from curation import curate_observation
+from lazy import lazy_import
+from metrics import instrumented
+import os
+from profiling import profiled
+from raw import DEFAULT_QUERY, fetch_observation, get_local_datetime, save_raw_data
+
+s3fs = lazy_import('s3fs')
+
+
+@profiled('pipeline')
+@instrumented('pipeline')
+def handler(event, context) -> dict:
+    """Handler function used to run the code for AWS Labmda.
+
+        event: -> Returned with status, s3_key and location
+        context: -> Not utilised
+    """
+
+    return_obj = {"event": event, "status": "SUCCEEDED"}
+
+    # Set when the job runs for one of the configured locations, e.g. {"id": "healesville", "q": "-37.5,145.7"}
+    location = event.get('location')
+    location_id = location['id'] if location else None
+    query = location['q'] if location else DEFAULT_QUERY
+    return_obj['location'] = location
+
+    s3_client = s3fs.S3FileSystem()
+
+    raw_bucket = os.getenv('raw_bucket')
+    curated_bucket = os.getenv('curated_bucket')
+    secret_name = os.getenv('secret_name')
+
+    dt = get_local_datetime()
+
+    response, test_status = fetch_observation(secret_name, query)
+
+    if not test_status:
+        return_obj['status'] = "FAILED"
+
+    try:
+        json_obj = response.json()
+    except ValueError:
+        print('API response does not contain properly formed JSON. Exiting.')
+        json_obj = None
+        return_obj['status'] = "FAILED"
+
+    # Without JSON there is nothing to archive or curate
+    s3_key = None
+    if json_obj is not None:
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            archive = executor.submit(save_raw_data, s3_client, response, dt, raw_bucket, location_id)
+
+            if test_status:
+                curated = executor.submit(curate_observation, s3_client, json_obj, dt, curated_bucket, location_id)
+                curated.result()
+
+            _, s3_key = archive.result()
+
+    return_obj['s3_key'] = s3_key
+
+    return return_obj
@@ -0,0 +1,155 @@
+"""
+Sampled cProfile and tracemalloc captures of handler invocations.
+
+A handler decorated with @profiled is profiled in a share of its invocations given by the
+profile_rate environment variable (0 to 1, unset or 0 turns it off). A sampled
+invocation runs under cProfile and tracemalloc, and the bytes allocated by Arrow's
+memory pool are read before and after. Two objects are then uploaded under
+s3://{bucket}/{profile_prefix}/{function}/{year}/{month}/{day}/:
+
+    {invocation id}.prof  cProfile stats, e.g. for snakeviz or flameprof
+    {invocation id}.json  duration, traced and Arrow memory, and the top allocation sites
+
+The bucket is profile_bucket, or the curated or raw bucket of the function, which it can
+already write to. cProfile only sees the thread running the handler, not its worker
+threads. Uploads that fail are logged and never fail the invocation.
+
+    @profiled('curation')
+    @instrumented('curation')
+    def handler(event, context):
+        ...
+"""
+
+import cProfile
+from datetime import datetime
+import functools
+import json
+from lazy import lazy_import
+import os
+import random
+import sys
+import tempfile
+import time
+import tracemalloc
+import uuid
+
+s3fs = lazy_import('s3fs')
+
+
+DEFAULT_PREFIX = 'profiling'
+
+# Frames kept per traced allocation, and allocation sites saved per capture
+TRACEMALLOC_FRAMES = 10
+TOP_ALLOCATIONS = 25
+
+
+def profile_rate() -> float:
+    """Returns the share of invocations profiled"""
+
+    return float(os.getenv('profile_rate') or 0)
+
+
+def profile_bucket() -> str:
+    """Returns the bucket captures are uploaded to"""
+
+    return os.getenv('profile_bucket') or os.getenv('curated_bucket') or os.getenv('raw_bucket')
+
+
+def arrow_memory() -> dict:
+    """Returns the bytes held and the peak of Arrow's default memory pool, if pyarrow is already imported"""
+
+    # The raw function does not ship pyarrow, so it is never imported here
+    pa = sys.modules.get('pyarrow')
+    if pa is None:
+        return None
+
+    return {"allocated_bytes": pa.total_allocated_bytes(), "max_bytes": pa.default_memory_pool().max_memory()}
+
+
+def capture_keys(s3_bucket, function, invocation_id, now=None) -> tuple:
+    """Returns the keys of the cProfile stats and the summary of a capture"""
+
+    now = now or datetime.utcnow()
+    prefix = os.getenv('profile_prefix') or DEFAULT_PREFIX
+    base = f's3://{s3_bucket}/{prefix}/{function}/{now.year}/{now.month}/{now.day}/{invocation_id}'
+
+    return f'{base}.prof', f'{base}.json'
+
+
+def top_allocations(snapshot, limit=TOP_ALLOCATIONS) -> list:
+    """Returns the allocation sites holding the most memory in a tracemalloc snapshot"""
+
+    return [
+        {
+            "size_bytes": stat.size,
+            "count": stat.count,
+            "traceback": [f'{frame.filename}:{frame.lineno}' for frame in stat.traceback],
+        }
+        for stat in snapshot.statistics('traceback')[:limit]
+    ]
+
+
+def upload_capture(profiler, summary, s3_bucket, function, invocation_id) -> None:
+    """Uploads the cProfile stats and the summary of a capture"""
+
+    stats_key, summary_key = capture_keys(s3_bucket, function, invocation_id)
+    fs = s3fs.S3FileSystem()
+
+    with tempfile.NamedTemporaryFile(suffix='.prof') as f:
+        profiler.dump_stats(f.name)
+        fs.put(f.name, stats_key)
+
+    with fs.open(summary_key, 'w') as f:
+        json.dump(summary, f)
+
+    print(f'Profile of {function} invocation {invocation_id} saved to {stats_key}')
+
+
+def profiled(function):
+    """Decorates a handler to profile a sample of its invocations"""
+
+    def decorator(handler):
+        @functools.wraps(handler)
+        def wrapper(event, context):
+            rate = profile_rate()
+            if rate <= 0 or random.random() >= rate:
+                return handler(event, context)
+
+            invocation_id = getattr(context, 'aws_request_id', None) or uuid.uuid4().hex
+            arrow_before = arrow_memory()
+            tracing = tracemalloc.is_tracing()
+            if not tracing:
+                tracemalloc.start(TRACEMALLOC_FRAMES)
+            profiler = cProfile.Profile()
+
+            start = time.perf_counter()
+            profiler.enable()
+            try:
+                return handler(event, context)
+            finally:
+                profiler.disable()
+                duration = time.perf_counter() - start
+                snapshot = tracemalloc.take_snapshot()
+                current, peak = tracemalloc.get_traced_memory()
+                if not tracing:
+                    tracemalloc.stop()
+
+                summary = {
+                    "function": function,
+                    "invocation_id": invocation_id,
+                    "duration_ms": round(duration * 1000, 3),
+                    "traced_bytes": current,
+                    "traced_peak_bytes": peak,
+                    "arrow_before": arrow_before,
+                    "arrow_after": arrow_memory(),
+                    "top_allocations": top_allocations(snapshot),
+                }
+
+                try:
+                    upload_capture(profiler, summary, profile_bucket(), function, invocation_id)
+                except Exception as e:
+                    print(f'Could not save the profile of {function} invocation {invocation_id}: {e}')
+
+        return wrapper
+
+    return decorator
@@ -4,14 +4,34 @@ Lambda function to gather data from an API.
 It stores the raw data in S3.
 """
 
-import boto3
+from archive import archive_observation
 from datetime import datetime, timezone
 import json
+from keys import location_shard, raw_key, schedule_minute
+from lazy import lazy_import
+from metrics import instrumented, record, timed
 import os
-import requests
-import s3fs
+from profiling import profiled
 import time
 
+# Loaded on first use when the lazy_imports environment variable is set
+boto3 = lazy_import('boto3')
+pytz = lazy_import('pytz')
+requests = lazy_import('requests')
+s3fs = lazy_import('s3fs')
+
+
+# Overridden with the weather_api_url environment variable, e.g. to point at a fake server in load tests
+DEFAULT_API_URL = 'http://api.weatherapi.com'
+
+# Site polled when the job is not run for one of the configured locations
+DEFAULT_QUERY = '-37.504136, 145.744302'
+
+# Observations up to this size are passed to curation in the Step Functions payload. The
+# payload limit is 256 KB for the whole state, so inlining is capped well below it.
+DEFAULT_INLINE_PAYLOAD_BYTES = 32 * 1024
+MAX_INLINE_PAYLOAD_BYTES = 192 * 1024
+
 
 def is_date(string, fuzzy=False) -> bool:
     """
@@ -30,7 +50,6 @@ def is_date(string, fuzzy=False) -> bool:
 def get_local_datetime() -> datetime:
     """The function returns a datetime object with the AEST timezone"""
 
-    import pytz
     now = datetime.now(pytz.timezone('Australia/Melbourne'))
     return now
 
@@ -38,24 +57,29 @@ def get_local_datetime() -> datetime:
 def get_secret(secret_name) -> json:
     """Retrives the API ket from AWS Secrets manager"""
 
-    client = boto3.client('secretsmanager')
-    response = client.get_secret_value(
-        SecretId=secret_name
-    )
+    with timed('secret_fetch'):
+        client = boto3.client('secretsmanager')
+        response = client.get_secret_value(
+            SecretId=secret_name
+        )
     return response['SecretString']
 
 
-def save_raw_data(s3_client, response, dt, s3_bucket) -> json:
-    """Saves the raw data direct from the API into S3 in case there is an issue processing the later steps"""
+def save_raw_data(s3_client, response, dt, s3_bucket, location_id=None) -> json:
+    """
+    Saves the raw data direct from the API into S3 in case there is an issue processing the later steps.
 
-    try:
-        json_obj = response.json()
-        s3_key = f's3://{s3_bucket}/raw/{dt.year}/{dt.month}/{dt.day}/{dt.hour}.json'
+    Returns the decoded observation and its key, both None when the response is not JSON.
+    """
 
-        json_text = json.dumps(json_obj)
+    json_obj, s3_key = None, None
+
+    try:
+        with timed('json_decode'):
+            json_obj = response.json()
+        s3_key = raw_key(s3_bucket, dt, location_id, schedule_minute(dt), location_shard(location_id))
 
-        with s3_client.open(s3_key, 'w') as f:
-            json.dump(json_text, f)
+        archive_observation(s3_client, json_obj, s3_key)
         print(f'Raw API response saved to s3://{s3_bucket}/raw/')
 
     except ValueError:
@@ -64,37 +88,43 @@ def save_raw_data(s3_client, response, dt, s3_bucket) -> json:
     return json_obj, s3_key
 
 
-def call_api(secret_name):
+def inline_payload(response, max_bytes) -> dict:
+    """Returns the decoded observation if it is small enough to go in the Step Functions payload, otherwise None"""
+
+    try:
+        json_obj = response.json()
+    except ValueError:
+        return None
+
+    if len(json.dumps(json_obj).encode()) > min(max_bytes, MAX_INLINE_PAYLOAD_BYTES):
+        return None
+
+    return json_obj
+
+
+def call_api(secret_name, query=DEFAULT_QUERY):
     """Function that calls the API"""
 
     key = get_secret(secret_name)
-    url = 'http://api.weatherapi.com/v1/current.json?key={}&q=-37.504136, 145.744302&aqi=no'.format(key)
-    response = requests.get(url)
+    base_url = os.getenv('weather_api_url', DEFAULT_API_URL)
+    url = '{}/v1/current.json?key={}&q={}&aqi=no'.format(base_url, key, query)
+    with timed('api_call'):
+        response = requests.get(url)
     return response
 
 
-def handler(event, context) -> dict:
-    """Handler function used to run the code for AWS Labmda.
-
-        event: -> Returned with status and s3_key
-        context: -> Not utilised
+def fetch_observation(secret_name, query=DEFAULT_QUERY, retries=3):
     """
+    Calls the API until it responds with a '200' status or the retries run out.
 
-    return_obj = {"event": event, "status": "SUCCEEDED"}
-
-    s3_client = s3fs.S3FileSystem()
+    Returns the last response and whether it succeeded.
+    """
 
     test_status = False
-    retries = 3
     iterations = 0
 
-    raw_bucket = os.getenv('raw_bucket')
-    secret_name = os.getenv('secret_name')
-
-    dt = get_local_datetime()
-
     while not test_status and iterations < retries: # Keep retrying until you get a '200' status or reach the 'retries' limit
-        response = call_api(secret_name)
+        response = call_api(secret_name, query)
         if response.status_code != 200: # If you don't get a 200 status, it is assumed something went wrong and will retry
             print(f'API not responding, status code: {response.status_code}')        
             time.sleep(3) # Wait 3 seconds between retries
@@ -105,11 +135,57 @@ def handler(event, context) -> dict:
 
     if not test_status:
         print(f'API did not respond. Will retry at next scheduled interval.')
+
+    record('retries', iterations - 1)
+    record('payload_bytes', len(response.content), 'Bytes')
+
+    return response, test_status
+
+
+@profiled('raw')
+@instrumented('raw')
+def handler(event, context) -> dict:
+    """Handler function used to run the code for AWS Labmda.
+
+        event: -> Returned with status, s3_key, location and, when small enough, the observation as payload.
+                  An inlined observation is not archived yet ("archived": false), curation writes it to s3_key.
+        context: -> Not utilised
+    """
+
+    return_obj = {"event": event, "status": "SUCCEEDED"}
+
+    # Set when the job runs for one of the configured locations, e.g. {"id": "healesville", "q": "-37.5,145.7"}
+    location = event.get('location')
+    location_id = location['id'] if location else None
+    query = location['q'] if location else DEFAULT_QUERY
+    return_obj['location'] = location
+
+    raw_bucket = os.getenv('raw_bucket')
+    secret_name = os.getenv('secret_name')
+    inline_payload_bytes = int(os.getenv('inline_payload_bytes', DEFAULT_INLINE_PAYLOAD_BYTES))
+
+    dt = get_local_datetime()
+
+    response, test_status = fetch_observation(secret_name, query)
+
+    if not test_status:
         return_obj['status'] = "FAILED"
-        
-    json_obj, s3_key = save_raw_data(s3_client, response, dt, raw_bucket)
+
+    # An inlined observation is archived by curation while it curates it, which keeps the S3
+    # write off this invocation. Lambda freezes the process on return, so it cannot be left
+    # running in the background here.
+    payload = inline_payload(response, inline_payload_bytes) if test_status else None
+    if payload is not None:
+        return_obj['payload'] = payload
+        return_obj['s3_key'] = raw_key(raw_bucket, dt, location_id, schedule_minute(dt), location_shard(location_id))
+        return_obj['archived'] = False
+        return return_obj
+
+    json_obj, s3_key = save_raw_data(s3fs.S3FileSystem(), response, dt, raw_bucket, location_id)
 
     # Add the newly created S3 Key back into the SFN Payload so that the following jobs are able to access this.
     return_obj['s3_key'] = s3_key
+    if s3_key is None:
+        return_obj['status'] = "FAILED"
 
     return return_obj
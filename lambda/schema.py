@@ -0,0 +1,40 @@
+"""
+Canonical schema of the curated dataset.
+
+Curation conforms every table to this schema before writing it. Older curated files
+were written with a schema inferred from a single observation, so the same column can
+be null in one file, int32 in another and float32 in a third. Readers conform every file
+to this schema as well so that tables from different hours can be combined.
+"""
+
+from columns import CANONICAL_COLUMNS
+import pyarrow as pa
+
+
+# Arrow type of each Hive type used in the column list
+ARROW_TYPES = {
+    'string': pa.string(),
+    'float': pa.float32(),
+    'int': pa.int32(),
+}
+
+CANONICAL_SCHEMA = pa.schema([(name, ARROW_TYPES[kind]) for name, kind in CANONICAL_COLUMNS])
+
+
+def conform(table, schema=CANONICAL_SCHEMA) -> pa.Table:
+    """
+    Casts a table to the given schema.
+
+    Columns missing from the table are filled with nulls and columns that are not part
+    of the schema are dropped.
+    """
+
+    columns = []
+
+    for field in schema:
+        if field.name in table.column_names:
+            columns.append(table.column(field.name).cast(field.type))
+        else:
+            columns.append(pa.nulls(table.num_rows, field.type))
+
+    return pa.Table.from_arrays(columns, schema=schema)
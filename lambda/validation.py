@@ -0,0 +1,173 @@
+"""
+Data-quality validation of curated tables.
+
+Rows are checked against declarative rules before they are written to the curated zone:
+
+    ('required', column)                   the column is not null (or NaN)
+    ('range', column, low, high)           the value is within [low, high], nulls pass
+    ('monotonic', column, order_column)    per site, ordered by order_column, the column
+                                           never decreases
+
+Each rule is evaluated over whole columns as a NumPy mask, so a batch costs a few array
+operations per rule rather than a Python loop over rows. Rows failing any rule are moved
+to the quarantine zone (quarantine/ in the curated bucket, next to curated/ and outside
+the Glue table) with a reason column listing the codes of the rules they failed, e.g.
+'missing_temp_c,out_of_range_humidity'. When every row passes, the table is passed on
+as it is, without being filtered or copied.
+
+The monotonic rule catches stale observations: a poll answered with an older
+last_updated_epoch than an earlier poll of the same site. It only compares the rows of the
+table being validated, so it applies to the SQS batches held in memory (save_batch), which
+are validated an hour at a time. The chain, fused and map topologies and the chunked SQS
+path validate one observation at a time, where it cannot fail.
+"""
+
+import numpy as np
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
+
+
+RULES = [
+    ('required', 'localtime_epoch'),
+    ('required', 'last_updated_epoch'),
+    ('required', 'temp_c'),
+    ('range', 'lat', -90, 90),
+    ('range', 'lon', -180, 180),
+    ('range', 'temp_c', -90, 60),
+    ('range', 'humidity', 0, 100),
+    ('range', 'cloud', 0, 100),
+    ('range', 'wind_kph', 0, 410),
+    ('range', 'gust_kph', 0, 410),
+    ('range', 'wind_degree', 0, 360),
+    ('range', 'pressure_mb', 850, 1090),
+    ('range', 'precip_mm', 0, 500),
+    ('range', 'vis_km', 0, 100),
+    ('range', 'uv', 0, 20),
+    ('monotonic', 'last_updated_epoch', 'localtime_epoch'),
+]
+
+
+def numeric(table, column) -> np.ndarray:
+    """Returns a column as float64, with NaN for nulls"""
+
+    return table.column(column).cast(pa.float64()).to_numpy()
+
+
+def dictionary_codes(column) -> np.ndarray:
+    """Returns the index of each value of a column in its dictionary encoding, -1 for nulls"""
+
+    indices = column.combine_chunks().dictionary_encode().indices
+    return pc.fill_null(indices, pa.scalar(-1, indices.type)).to_numpy().astype(np.int64)
+
+
+def site_codes(table) -> np.ndarray:
+    """Returns an integer code per row identifying its site, by location id or else by name"""
+
+    sites = dictionary_codes(table.column('location_id'))
+    missing = sites < 0
+    if missing.any():
+        # Sites without a location id are numbered by name after the location ids, rows without either share one code
+        sites[missing] = sites.max() + 2 + dictionary_codes(table.column('name'))[missing]
+
+    return sites
+
+
+def decreasing(values, order, sites) -> np.ndarray:
+    """
+    Returns the rows whose value is lower than that of an earlier row of the same site,
+    ordered by order. Rows with a NaN value or order are not compared.
+    """
+
+    compared = ~(np.isnan(values) | np.isnan(order))
+    failed = np.zeros(len(values), dtype=bool)
+    if compared.sum() < 2:
+        return failed
+
+    rows = np.flatnonzero(compared)
+    rows = rows[np.lexsort((order[rows], sites[rows]))]
+    ordered_sites = sites[rows]
+    ordered = values[rows] - values[rows].min()
+
+    # Lifting each site above all the values of the sites before it lets one running maximum restart per site
+    lift = ordered_sites * (ordered.max() + 1)
+    running = np.maximum.accumulate(ordered + lift) - lift
+
+    previous = np.full(len(rows), -np.inf)
+    previous[1:] = running[:-1]
+    previous[np.r_[True, ordered_sites[1:] != ordered_sites[:-1]]] = -np.inf
+
+    failed[rows] = ordered < previous
+    return failed
+
+
+def rule_failures(table, rules=RULES) -> list:
+    """Returns (reason code, mask of failing rows) for every rule failed by at least one row"""
+
+    failures = []
+    sites = None
+
+    for rule in rules:
+        kind, column = rule[0], rule[1]
+        if column not in table.column_names:
+            continue
+
+        if kind == 'required':
+            code = f'missing_{column}'
+            column_type = table.schema.field(column).type
+            if pa.types.is_floating(column_type) or pa.types.is_integer(column_type):
+                mask = np.isnan(numeric(table, column))
+            else:
+                mask = pc.is_null(table.column(column)).to_numpy()
+        elif kind == 'range':
+            code = f'out_of_range_{column}'
+            values = numeric(table, column)
+            with np.errstate(invalid='ignore'):
+                mask = (values < rule[2]) | (values > rule[3])
+        elif kind == 'monotonic':
+            code = f'decreasing_{column}'
+            if sites is None:
+                sites = site_codes(table)
+            mask = decreasing(numeric(table, column), numeric(table, rule[2]), sites)
+        else:
+            raise ValueError(f"Unknown validation rule '{kind}'")
+
+        if mask.any():
+            failures.append((code, mask))
+
+    return failures
+
+
+def validate(table, rules=RULES) -> tuple:
+    """
+    Splits a canonical table into the rows passing every rule and the rows to quarantine.
+
+    Returns (valid, quarantined, failed) where valid is the table itself when every row
+    passes, quarantined is None then or the failing rows with their reason codes, and
+    failed is the mask of failing rows.
+    """
+
+    failures = rule_failures(table, rules)
+    failed = np.zeros(table.num_rows, dtype=bool)
+    if not failures:
+        return table, None, failed
+
+    reasons = np.full(table.num_rows, '', dtype=object)
+    for code, mask in failures:
+        failed |= mask
+        reasons[mask] = reasons[mask] + code + ','
+
+    valid = table.filter(pa.array(~failed))
+    quarantined = table.filter(pa.array(failed))
+    quarantined = quarantined.append_column('reason', pa.array([reason[:-1] for reason in reasons[failed]], pa.string()))
+
+    return valid, quarantined, failed
+
+
+def save_quarantine(fs, s3_key, table) -> None:
+    """Writes rows that failed validation to the quarantine zone"""
+
+    with fs.open(s3_key, 'wb') as f:
+        pq.write_table(table, f)
+
+    print(f'{table.num_rows} rows failing validation saved to {s3_key}')
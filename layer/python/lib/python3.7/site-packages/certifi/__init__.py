@@ -0,0 +1,3 @@
+from .core import contents, where
+
+__version__ = "2021.10.08"
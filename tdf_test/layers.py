@@ -0,0 +1,327 @@
+"""
+Builds the Lambda layers from the packages installed under layer/.
+
+layer/ holds every dependency in one directory, including test suites, Cython sources,
+headers, the plasma store and flight, and all of the botocore service models. The build
+splits it into a 'base' layer (s3fs, requests, dates) used by every function and
+an 'arrow' layer (pyarrow and numpy) only attached to the functions writing parquet, drops
+what the handlers never import, and zips each layer under a name containing a hash of its
+content. The stack deploys the zips from the manifest with that hash instead of hashing
+the layer directory on every synth.
+
+    python -m tdf_test.layers build
+    python -m tdf_test.layers report --python python3.7
+"""
+
+import argparse
+from fnmatch import fnmatch
+import hashlib
+import json
+import os
+import shutil
+import subprocess
+import zipfile
+
+
+SOURCE_DIR = 'layer'
+BUILD_DIR = os.path.join('build', 'layers')
+MANIFEST = os.path.join(BUILD_DIR, 'manifest.json')
+SITE_PACKAGES = os.path.join('python', 'lib', 'python3.7', 'site-packages')
+
+# Top level entries of site-packages that go in the arrow layer, everything else is base
+ARROW_PACKAGES = ('pyarrow', 'pyarrow-*', 'numpy', 'numpy-*', 'numpy.libs')
+
+# Layers attached to each handler
+FUNCTION_LAYERS = {
+    'raw': ['base'],
+    'curation': ['base', 'arrow'],
+    'pipeline': ['base', 'arrow'],
+}
+
+# Modules imported by each handler from its layers, checked by the build and timed by the report
+FUNCTION_IMPORTS = {
+    'raw': ['s3fs', 'requests', 'pytz', 'dateutil.parser'],
+    'curation': ['s3fs', 'pytz', 'dateutil.parser', 'numpy', 'pyarrow', 'pyarrow.parquet'],
+    'pipeline': ['s3fs', 'requests', 'pytz', 'dateutil.parser', 'numpy', 'pyarrow', 'pyarrow.parquet'],
+}
+
+# boto3 comes with the Lambda runtime and is not shipped, but it imports the botocore of the
+# base layer, so the service models of every client the handlers create are kept.
+# botocore service models used by the handlers, the other ~300 are dropped
+BOTOCORE_SERVICES = ('s3', 'secretsmanager', 'sts', 'sso', 'sso-oidc')
+
+# Paths relative to site-packages that are never imported in Lambda
+PRUNE_DIRS = ('__pycache__', 'tests', 'test', 'include', 'includes', 'bin', 'pyarrow/tensorflow',
+              'numpy/f2py', 'numpy/distutils', 'numpy/doc')
+PRUNE_FILES = ('*.pyc', '*.pyx', '*.pxd', '*.pxi', '*.pyi', '*.h', '*.c', '*.cpp', '*.webloc',
+               'pyarrow/plasma-store-server', 'pyarrow/_plasma*', 'pyarrow/plasma.py', 'pyarrow/libplasma*',
+               'pyarrow/_flight*', 'pyarrow/flight.py', 'pyarrow/libarrow_python_flight*')
+
+# Fixed timestamp so that a zip of the same files is byte for byte identical
+ZIP_DATE_TIME = (2020, 1, 1, 0, 0, 0)
+
+
+def layer_of(name) -> str:
+    """Returns the layer a top level site-packages entry belongs to"""
+
+    return 'arrow' if any(fnmatch(name, pattern) for pattern in ARROW_PACKAGES) else 'base'
+
+
+def is_pruned(relative, is_dir) -> bool:
+    """Returns whether a path relative to site-packages is left out of the layers"""
+
+    parts = relative.split('/')
+
+    if is_dir:
+        if parts[-1] in PRUNE_DIRS or relative in PRUNE_DIRS:
+            return True
+        if len(parts) == 3 and parts[:2] == ['botocore', 'data'] and parts[2] not in BOTOCORE_SERVICES:
+            return True
+        return False
+
+    return any(fnmatch(parts[-1], pattern) or fnmatch(relative, pattern) for pattern in PRUNE_FILES)
+
+
+def collect(source_dir=SOURCE_DIR) -> dict:
+    """
+    Returns the files kept in each layer as {layer: [relative path]} along with the bytes
+    pruned, walking site-packages once.
+    """
+
+    site_packages = os.path.join(source_dir, SITE_PACKAGES)
+    layers = {'base': [], 'arrow': []}
+    pruned = 0
+
+    for root, dirs, files in os.walk(site_packages):
+        relative_root = os.path.relpath(root, site_packages).replace(os.sep, '/')
+        relative_root = '' if relative_root == '.' else relative_root + '/'
+
+        kept = []
+        for name in sorted(dirs):
+            if is_pruned(relative_root + name, True):
+                pruned += directory_size(os.path.join(root, name))
+            else:
+                kept.append(name)
+        dirs[:] = kept
+
+        for name in sorted(files):
+            relative = relative_root + name
+            if is_pruned(relative, False):
+                pruned += os.path.getsize(os.path.join(root, name))
+            else:
+                layers[layer_of(relative.split('/')[0])].append(relative)
+
+    return {"files": layers, "pruned_bytes": pruned}
+
+
+def missing_imports(files, functions=FUNCTION_LAYERS, imports=FUNCTION_IMPORTS) -> dict:
+    """Returns {function: [module]} for the modules of a function that none of its layers has"""
+
+    missing = {}
+
+    for function, layers in functions.items():
+        shipped = {relative for name in layers for relative in files[name]}
+        for module in imports[function]:
+            path = module.replace('.', '/')
+            if f'{path}/__init__.py' not in shipped and f'{path}.py' not in shipped:
+                missing.setdefault(function, []).append(module)
+
+    return missing
+
+
+def directory_size(path) -> int:
+    """Returns the total size of the files under path"""
+
+    return sum(os.path.getsize(os.path.join(root, name)) for root, _, files in os.walk(path) for name in files)
+
+
+def content_hash(site_packages, files) -> str:
+    """Hashes the paths and contents of the files, in order"""
+
+    digest = hashlib.sha256()
+
+    for relative in files:
+        digest.update(relative.encode() + b'\0')
+        with open(os.path.join(site_packages, relative), 'rb') as f:
+            for block in iter(lambda: f.read(1 << 20), b''):
+                digest.update(block)
+
+    return digest.hexdigest()[:16]
+
+
+def write_zip(path, site_packages, files) -> None:
+    """Writes the files to a reproducible zip laid out as a Lambda layer"""
+
+    tmp = path + '.tmp'
+
+    with zipfile.ZipFile(tmp, 'w', zipfile.ZIP_DEFLATED) as zf:
+        for relative in files:
+            source = os.path.join(site_packages, relative)
+            info = zipfile.ZipInfo(f'{SITE_PACKAGES}/{relative}'.replace(os.sep, '/'), ZIP_DATE_TIME)
+            info.external_attr = (os.stat(source).st_mode & 0o777 | 0o100000) << 16
+            info.compress_type = zipfile.ZIP_DEFLATED
+            with open(source, 'rb') as f:
+                zf.writestr(info, f.read())
+
+    os.replace(tmp, path)
+
+
+def build(source_dir=SOURCE_DIR, build_dir=BUILD_DIR) -> dict:
+    """
+    Builds a pruned zip per layer and writes the manifest.
+
+    Zips are named after their content hash, so a layer whose files did not change is
+    not rewritten and keeps the same asset in CDK.
+    """
+
+    site_packages = os.path.join(source_dir, SITE_PACKAGES)
+    collected = collect(source_dir)
+
+    missing = missing_imports(collected['files'])
+    if missing:
+        raise ValueError(f'Modules missing from the layers: {missing}')
+
+    os.makedirs(build_dir, exist_ok=True)
+
+    manifest = {"layers": {}, "functions": FUNCTION_LAYERS, "pruned_bytes": collected['pruned_bytes']}
+
+    for name, files in collected['files'].items():
+        layer_hash = content_hash(site_packages, files)
+        path = os.path.join(build_dir, f'{name}-{layer_hash}.zip')
+
+        if not os.path.exists(path):
+            write_zip(path, site_packages, files)
+            print(f'Built {path}')
+
+        manifest['layers'][name] = {
+            "zip": path,
+            "hash": layer_hash,
+            "files": len(files),
+            "unpacked_bytes": sum(os.path.getsize(os.path.join(site_packages, relative)) for relative in files),
+        }
+
+    # Zips of earlier builds are no longer referenced
+    current = {os.path.basename(layer['zip']) for layer in manifest['layers'].values()}
+    for name in os.listdir(build_dir):
+        if name.endswith('.zip') and name not in current:
+            os.remove(os.path.join(build_dir, name))
+
+    with open(os.path.join(build_dir, 'manifest.json'), 'w') as f:
+        json.dump(manifest, f, indent=2)
+
+    return manifest
+
+
+def load_layer_manifest(path=MANIFEST) -> dict:
+    """Returns the manifest written by build, or None if the layers have not been built"""
+
+    if not path or not os.path.exists(path):
+        return None
+
+    with open(path) as f:
+        return json.load(f)
+
+
+def time_imports(python, paths, modules) -> float:
+    """
+    Returns the seconds taken to import the modules in a fresh interpreter with the
+    layer directories on the path, as in a cold start. None if python cannot import them.
+    """
+
+    script = (
+        'import time, importlib\n'
+        't = time.perf_counter()\n'
+        f'for m in {modules!r}: importlib.import_module(m)\n'
+        'print(time.perf_counter() - t)\n'
+    )
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(paths), PYTHONDONTWRITEBYTECODE='1')
+
+    try:
+        result = subprocess.run([python, '-c', script], env=env, capture_output=True, text=True, timeout=120)
+    except (OSError, subprocess.TimeoutExpired):
+        return None
+
+    if result.returncode != 0:
+        print(result.stderr.strip().splitlines()[-1] if result.stderr.strip() else f'{python} failed')
+        return None
+
+    return float(result.stdout.strip())
+
+
+def report(manifest, source_dir=SOURCE_DIR, build_dir=BUILD_DIR, python=None) -> dict:
+    """
+    Compares the unpacked size and import time of each function's layers with the
+    single layer built from layer/.
+
+    Import times need an interpreter matching the layer (python3.7 on Linux x86_64) and
+    are left out when one is not given.
+    """
+
+    original = directory_size(source_dir)
+    rows = {"original": {"unpacked_bytes": original, "import_seconds": None}}
+
+    extracted = {}
+    if python:
+        for name, layer in manifest['layers'].items():
+            target = os.path.join(build_dir, 'unpacked', name)
+            shutil.rmtree(target, ignore_errors=True)
+            with zipfile.ZipFile(layer['zip']) as zf:
+                zf.extractall(target)
+            extracted[name] = os.path.join(target, SITE_PACKAGES)
+
+    for function, layers in manifest['functions'].items():
+        row = {
+            "layers": layers,
+            "unpacked_bytes": sum(manifest['layers'][name]['unpacked_bytes'] for name in layers),
+            "import_seconds": None,
+            "original_import_seconds": None,
+        }
+
+        if python:
+            modules = FUNCTION_IMPORTS[function]
+            row['import_seconds'] = time_imports(python, [extracted[name] for name in layers], modules)
+            row['original_import_seconds'] = time_imports(python, [os.path.join(source_dir, SITE_PACKAGES)], modules)
+
+        rows[function] = row
+
+    if python:
+        shutil.rmtree(os.path.join(build_dir, 'unpacked'), ignore_errors=True)
+
+    return rows
+
+
+def print_report(rows) -> None:
+    """Prints the report as a table"""
+
+    def seconds(value):
+        return '-' if value is None else f'{value:.3f}s'
+
+    print(f"{'':<10} {'layers':<12} {'unpacked':>10} {'import':>8} {'before':>8}")
+    for name, row in rows.items():
+        layers = '+'.join(row.get('layers', ['layer/']))
+        print(f"{name:<10} {layers:<12} {row['unpacked_bytes'] / 2**20:>8.1f}MB "
+              f"{seconds(row['import_seconds']):>8} {seconds(row.get('original_import_seconds')):>8}")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Builds pruned, content hashed Lambda layers from layer/')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    build_parser = commands.add_parser('build', help='build the layer zips and manifest')
+    report_parser = commands.add_parser('report', help='report unpacked size and import time per function')
+    report_parser.add_argument('--python', help='interpreter matching the Lambda runtime, used to time imports')
+
+    for command in (build_parser, report_parser):
+        command.add_argument('--source', default=SOURCE_DIR)
+        command.add_argument('--build-dir', default=BUILD_DIR)
+
+    args = parser.parse_args()
+
+    manifest = build(args.source, args.build_dir)
+
+    if args.command == 'build':
+        for name, layer in manifest['layers'].items():
+            print(f"{name}: {layer['zip']} ({layer['files']} files, {layer['unpacked_bytes'] / 2**20:.1f}MB unpacked)")
+        print(f"Pruned {manifest['pruned_bytes'] / 2**20:.1f}MB")
+    else:
+        print_report(report(manifest, args.source, args.build_dir, args.python))
@@ -0,0 +1,381 @@
+"""
+In-process interpreter of the state machine defined by TdfTestStack.
+
+The definition is taken from the synthesized template, so the local runs follow the same
+graph as the deployed state machine ('Raw Complete?', 'Job Complete?', 'Publish
+message', the location Map, ...). Lambda and SNS tasks are handed to callables, which
+run the real handlers or stubs:
+
+    definition, functions = definition_from_stack(TdfTestStack(core.App(), 'tdf-test'))
+    executor = LocalExecutor(definition, invoke, publish)
+    execution = executor.execute({})
+
+invoke(function, payload) is called with the logical id of the Lambda function and
+returns the handler's result; exceptions it raises are errors of the task, named after
+their class as Lambda does, and go through Retry and Catch. publish(topic, message) is
+called with the logical id of the topic.
+
+The interpreter covers the Amazon States Language used by the stack: Task, Choice,
+Pass, Map, Succeed and Fail states, InputPath, Parameters, ResultSelector, ResultPath
+and OutputPath, Retry and Catch, and paths made of fields, indices and equality filters.
+Retry intervals are multiplied by retry_scale, 0 by default so retries do not wait, and
+timeouts are not enforced. transition_delay adds a wait before every state, to stand in
+for the time Step Functions takes per transition.
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+import copy
+import json
+import re
+import threading
+import time
+import uuid
+
+
+PATH_TOKEN = re.compile(r"\.([^.\[]+)|\[(\d+)\]|\[\?\(@\.(\w+) == '([^']*)'\)\]")
+
+
+class StatesError(Exception):
+    """Error raised in a state, caught by Retry and Catch by its name"""
+
+    def __init__(self, error, cause=''):
+        super().__init__(f'{error}: {cause}')
+        self.error = error
+        self.cause = cause
+
+
+def resolve(value):
+    """Replaces Ref and Fn::GetAtt tokens of a template value with the logical ids they refer to"""
+
+    if isinstance(value, dict):
+        if 'Ref' in value:
+            return 'aws' if value['Ref'] == 'AWS::Partition' else value['Ref']
+        if 'Fn::GetAtt' in value:
+            return value['Fn::GetAtt'][0]
+        if 'Fn::Join' in value:
+            separator, parts = value['Fn::Join']
+            return separator.join(resolve(part) for part in parts)
+        return {key: resolve(item) for key, item in value.items()}
+
+    if isinstance(value, list):
+        return [resolve(item) for item in value]
+
+    return value
+
+
+def definition_from_template(template) -> tuple:
+    """
+    Returns the state machine definition of a synthesized template, and the handler and
+    environment of each Lambda function it invokes by logical id. Lambda functions and SNS topics are
+    named by their logical ids in the definition, and buckets by their logical ids in
+    lower case in the environments.
+    """
+
+    definition = None
+    functions = {}
+
+    for logical_id, resource in template['Resources'].items():
+        properties = resource.get('Properties', {})
+
+        if resource['Type'] == 'AWS::StepFunctions::StateMachine':
+            definition = json.loads(resolve(properties['DefinitionString']))
+        elif resource['Type'] == 'AWS::Lambda::Function' and properties.get('Handler', '').count('.') == 1:
+            variables = properties.get('Environment', {}).get('Variables', {})
+            functions[logical_id] = {
+                "handler": properties['Handler'],
+                "environment": {
+                    key: resolve(value).lower() if isinstance(value, dict) else value
+                    for key, value in variables.items()
+                },
+            }
+
+    if definition is None:
+        raise ValueError('The template does not define a state machine')
+
+    # Only the functions the state machine invokes, not the providers of custom resources
+    invoked = json.dumps(definition)
+    functions = {logical_id: function for logical_id, function in functions.items() if f'"{logical_id}"' in invoked}
+
+    return definition, functions
+
+
+def definition_from_stack(stack) -> tuple:
+    """Returns the state machine definition and Lambda functions of a TdfTestStack"""
+
+    from aws_cdk import assertions
+    return definition_from_template(assertions.Template.from_stack(stack).to_json())
+
+
+def read_path(data, path, context=None):
+    """Returns the value at a path of data, or of the context object for paths starting with $$"""
+
+    if path.startswith('$$'):
+        value, rest = context, path[2:]
+    elif path.startswith('$'):
+        value, rest = data, path[1:]
+    else:
+        raise StatesError('States.Runtime', f"Invalid path '{path}'")
+
+    position = 0
+    while position < len(rest):
+        match = PATH_TOKEN.match(rest, position)
+        if match is None:
+            raise StatesError('States.Runtime', f"Unsupported path '{path}'")
+        name, index, field, literal = match.groups()
+
+        try:
+            if name is not None:
+                value = value[name]
+            elif index is not None:
+                value = value[int(index)]
+            else:
+                value = [item for item in value if isinstance(item, dict) and item.get(field) == literal]
+        except (KeyError, IndexError, TypeError):
+            raise StatesError('States.Runtime', f"Path '{path}' not found in the input")
+
+        position = match.end()
+
+    return value
+
+
+def write_path(data, path, value):
+    """Returns a copy of data with value set at a reference path, replacing it all for '$'"""
+
+    if path == '$':
+        return value
+
+    names = re.findall(r'\.([^.\[]+)', path)
+    if not path.startswith('$') or '.'.join([''] + names) != path[1:]:
+        raise StatesError('States.Runtime', f"Unsupported result path '{path}'")
+
+    result = copy.deepcopy(data) if isinstance(data, dict) else {}
+    target = result
+    for name in names[:-1]:
+        target = target.setdefault(name, {})
+    target[names[-1]] = value
+
+    return result
+
+
+def apply_parameters(template, data, context=None):
+    """Builds the input of a state from a Parameters or ResultSelector template"""
+
+    if isinstance(template, dict):
+        result = {}
+        for key, value in template.items():
+            if key.endswith('.$'):
+                result[key[:-2]] = read_path(data, value, context)
+            else:
+                result[key] = apply_parameters(value, data, context)
+        return result
+
+    if isinstance(template, list):
+        return [apply_parameters(item, data, context) for item in template]
+
+    return template
+
+
+def matches(rule, data) -> bool:
+    """Evaluates a Choice rule against the input"""
+
+    if 'And' in rule:
+        return all(matches(item, data) for item in rule['And'])
+    if 'Or' in rule:
+        return any(matches(item, data) for item in rule['Or'])
+    if 'Not' in rule:
+        return not matches(rule['Not'], data)
+
+    if 'IsPresent' in rule:
+        try:
+            read_path(data, rule['Variable'])
+            present = True
+        except StatesError:
+            present = False
+        return present == rule['IsPresent']
+
+    try:
+        value = read_path(data, rule['Variable'])
+    except StatesError:
+        return False
+
+    comparisons = {
+        'StringEquals': lambda expected: isinstance(value, str) and value == expected,
+        'BooleanEquals': lambda expected: isinstance(value, bool) and value == expected,
+        'NumericEquals': lambda expected: isinstance(value, (int, float)) and value == expected,
+        'NumericLessThan': lambda expected: isinstance(value, (int, float)) and value < expected,
+        'NumericGreaterThan': lambda expected: isinstance(value, (int, float)) and value > expected,
+        'IsNull': lambda expected: (value is None) == expected,
+    }
+
+    for operator, compare in comparisons.items():
+        if operator in rule:
+            return compare(rule[operator])
+
+    raise StatesError('States.Runtime', f'Unsupported choice rule {rule}')
+
+
+def error_matches(names, error) -> bool:
+    return error in names or ('States.ALL' in names and error != 'States.Runtime')
+
+
+class LocalExecutor:
+    """Runs executions of a state machine definition in process"""
+
+    def __init__(self, definition, invoke, publish, retry_scale=0.0, transition_delay=0.0):
+        self.definition = definition
+        self.invoke = invoke
+        self.publish = publish
+        self.retry_scale = retry_scale
+        self.transition_delay = transition_delay
+
+    def execute(self, execution_input=None) -> dict:
+        """
+        Runs one execution, returning its status, output or error, duration and the time
+        spent in each state visited, as [(state, milliseconds)].
+        """
+
+        timings = []
+        lock = threading.Lock()
+
+        def record(state, milliseconds):
+            with lock:
+                timings.append((state, milliseconds))
+
+        start = time.perf_counter()
+        result = {"status": "SUCCEEDED", "output": None}
+
+        try:
+            result['output'] = self._run(self.definition, execution_input or {}, record)
+        except StatesError as e:
+            result.update(status="FAILED", error=e.error, cause=e.cause)
+
+        result['duration_ms'] = (time.perf_counter() - start) * 1000
+        result['timings'] = timings
+
+        return result
+
+    def execute_many(self, inputs, concurrency=1) -> list:
+        """Runs an execution for each input, with up to concurrency of them at the same time"""
+
+        with ThreadPoolExecutor(max_workers=max(concurrency, 1)) as pool:
+            return list(pool.map(self.execute, inputs))
+
+    def _run(self, machine, data, record, context=None):
+        """Runs the states of a machine (the definition or a Map iterator) from StartAt to the end"""
+
+        name = machine['StartAt']
+
+        while True:
+            state = machine['States'][name]
+            if self.transition_delay:
+                time.sleep(self.transition_delay)
+
+            start = time.perf_counter()
+            try:
+                data, following = self._state(state, data, record, context)
+            finally:
+                record(name, (time.perf_counter() - start) * 1000)
+
+            if following is None:
+                return data
+            name = following
+
+    def _state(self, state, data, record, context):
+        """Runs one state, returning its output and the next state (None at the end)"""
+
+        kind = state['Type']
+        following = None if state.get('End') else state.get('Next')
+
+        if kind == 'Succeed':
+            return data, None
+        if kind == 'Fail':
+            raise StatesError(state.get('Error', 'States.Fail'), state.get('Cause', ''))
+        if kind == 'Choice':
+            for choice in state['Choices']:
+                if matches(choice, data):
+                    return data, choice['Next']
+            if 'Default' not in state:
+                raise StatesError('States.NoChoiceMatched', 'No choice matched and there is no default')
+            return data, state['Default']
+
+        effective = read_path(data, state.get('InputPath', '$'))
+
+        try:
+            if kind == 'Pass' and 'Result' in state:
+                result = state['Result']
+            elif kind == 'Pass':
+                result = apply_parameters(state['Parameters'], effective, context) if 'Parameters' in state else effective
+            elif kind == 'Task':
+                task_input = apply_parameters(state['Parameters'], effective, context) if 'Parameters' in state else effective
+                result = self._task(state, task_input)
+                if 'ResultSelector' in state:
+                    result = apply_parameters(state['ResultSelector'], result)
+            elif kind == 'Map':
+                result = self._map(state, effective, record)
+            else:
+                raise StatesError('States.Runtime', f"Unsupported state type '{kind}'")
+        except StatesError as e:
+            for catcher in state.get('Catch', []):
+                if error_matches(catcher['ErrorEquals'], e.error):
+                    output = write_path(data, catcher.get('ResultPath', '$'), {"Error": e.error, "Cause": e.cause})
+                    return output, catcher['Next']
+            raise
+
+        if 'ResultPath' in state and state['ResultPath'] is None:
+            output = data
+        else:
+            output = write_path(data, state.get('ResultPath', '$'), result)
+
+        return read_path(output, state.get('OutputPath', '$')), following
+
+    def _task(self, state, task_input):
+        """Runs a Lambda invoke or SNS publish task with its Retry policy"""
+
+        resource = state['Resource']
+        attempts = {}
+
+        while True:
+            try:
+                if resource.endswith(':lambda:invoke'):
+                    try:
+                        payload = self.invoke(task_input['FunctionName'], task_input.get('Payload'))
+                    except StatesError:
+                        raise
+                    except Exception as e:
+                        raise StatesError(type(e).__name__, str(e))
+                    return {"Payload": payload, "StatusCode": 200, "ExecutedVersion": "$LATEST"}
+
+                if resource.endswith(':sns:publish'):
+                    self.publish(task_input['TopicArn'], task_input['Message'])
+                    return {"MessageId": str(uuid.uuid4())}
+
+                raise StatesError('States.Runtime', f"Unsupported task resource '{resource}'")
+            except StatesError as e:
+                retrier = next((retrier for retrier in state.get('Retry', [])
+                                if error_matches(retrier['ErrorEquals'], e.error)), None)
+                if retrier is None:
+                    raise
+
+                index = state['Retry'].index(retrier)
+                attempts[index] = attempts.get(index, 0) + 1
+                if attempts[index] > retrier.get('MaxAttempts', 3):
+                    raise
+
+                interval = retrier.get('IntervalSeconds', 1) * retrier.get('BackoffRate', 2.0) ** (attempts[index] - 1)
+                time.sleep(interval * self.retry_scale)
+
+    def _map(self, state, data, record):
+        """Runs the iterator of a Map state over its items, returning the outputs in order"""
+
+        items = read_path(data, state.get('ItemsPath', '$'))
+        if not isinstance(items, list):
+            raise StatesError('States.Runtime', 'The items of a Map state must be a list')
+
+        def iteration(index):
+            context = {"Map": {"Item": {"Index": index, "Value": items[index]}}}
+            item_input = apply_parameters(state['Parameters'], data, context) if 'Parameters' in state else items[index]
+            return self._run(state['Iterator'], item_input, record, context)
+
+        concurrency = state.get('MaxConcurrency') or len(items) or 1
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            return list(pool.map(iteration, range(len(items))))
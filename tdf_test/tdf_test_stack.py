@@ -3,28 +3,138 @@ from aws_cdk import (
     Duration,
     RemovalPolicy,
     aws_lambda as _lambda,
+    aws_lambda_event_sources as lambda_event_sources,
     aws_iam as iam,
+    aws_ec2 as ec2,
+    aws_efs as efs,
     aws_events as events,
     aws_events_targets as targets,
+    aws_glue as glue,
     aws_s3 as s3,
+    aws_s3_notifications as s3n,
     aws_secretsmanager as secretsmanager,
     aws_stepfunctions as _aws_stepfunctions,
     aws_stepfunctions_tasks as _aws_stepfunctions_tasks,
     aws_sns as sns,
     aws_sns_subscriptions as subscriptions,
+    aws_sqs as sqs,
 )
 import aws_cdk as cdk
 from aws_cdk.aws_events import Rule, Schedule
 from constructs import Construct
+import importlib.util
 import os, json
+import re
+from tdf_test.layers import MANIFEST, load_layer_manifest
+
+
+# Glue database and table of the curated dataset
+GLUE_DATABASE = 'tdf_weather'
+GLUE_TABLE = 'curated'
+
+
+def canonical_columns() -> list:
+    """Loads the canonical (name, type) columns from lambda/columns.py, which the stack cannot import as a package"""
+
+    path = os.path.join(os.path.dirname(__file__), '..', 'lambda', 'columns.py')
+    spec = importlib.util.spec_from_file_location('columns', path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module.CANONICAL_COLUMNS
+
+
+# Sites polled by the 'map' topology unless tdf:locations is set in the context
+DEFAULT_LOCATIONS = [
+    {"id": "healesville", "q": "-37.504136,145.744302"},
+]
 
 class TdfTestStack(Stack):
 
-    def __init__(self, scope: Construct, construct_id: str, **kwargs) -> None:
+    def __init__(self, scope: Construct, construct_id: str, topology: str = None, locations: list = None,
+                 max_concurrency: int = None, inline_payload_bytes: int = None, sqs_batch_size: int = None,
+                 sqs_batching_window: int = None, schedule_minutes: int = None, express: bool = None,
+                 layer_manifest: str = None, shard_count: int = None,
+                 metrics_namespace: str = None, lazy_imports: bool = None,
+                 profile_rate: float = None, memory_budget: float = None, buffer_dir: str = None, **kwargs) -> None:
         super().__init__(scope, construct_id, **kwargs)
 
-        # Secret manager
-        with open('key_details.json') as f:
+        # Pipeline options, set in code or in the cdk.json context (e.g. cdk deploy -c tdf:topology=map)
+        #   topology        - 'chain' runs raw then curation once for the original site,
+        #                     'fused' runs both in a single Lambda (pipeline.handler) for the original site,
+        #                     'map' runs them for every configured location in a Map state,
+        #                     'events' runs raw from the state machine and curates batches of raw objects
+        #                     queued in SQS by S3 ObjectCreated notifications
+        #   locations       - list of {"id": ..., "q": ...} sites polled by the 'map' topology
+        #   max_concurrency - number of locations processed at the same time by the 'map' topology
+        #   inline_payload_bytes - observations up to this size are passed from raw to curation in the
+        #                     Step Functions payload instead of being read back from S3, and curation
+        #                     archives them (0 disables, the 'events' topology never inlines)
+        #   sqs_batch_size, sqs_batching_window - raw objects per curation invocation, and seconds to wait
+        #                     for a batch to fill, in the 'events' topology
+        #   schedule_minutes - minutes between runs, a divisor of 60 from 1 (every minute) to 60 (hourly)
+        #   express         - deploy an Express workflow, cheaper for high-frequency runs but limited to
+        #                     five minutes per execution
+        #   layer_manifest  - manifest of the pruned layers built by 'python -m tdf_test.layers build',
+        #                     the single layer/ directory is deployed when it has not been built
+        #   shard_count     - number of hash shard prefixes that location data is spread over (0 keeps the
+        #                     date path directly under raw/ and curated/)
+        #   metrics_namespace - CloudWatch namespace of the per-stage timings the handlers log in embedded
+        #                     metric format, unset leaves the instrumentation off
+        #   lazy_imports    - import s3fs, boto3, requests and the other heavy modules of the handlers on
+        #                     first use instead of during the Lambda init phase
+        #   profile_rate    - share of invocations (0 to 1) run under cProfile and tracemalloc, with the
+        #                     captures saved under profiling/ in the function's bucket (0 disables)
+        #   memory_budget   - share of the curation function's memory (0 to 1) that a batch curated from
+        #                     SQS holds before writing it as a row group, 0 keeps whole batches in memory
+        #   buffer_dir      - mount path (/mnt/...) of an EFS file system holding the write-ahead buffer of
+        #                     curated observations (lambda/buffer.py), unset writes every observation
+        topology = topology or self.node.try_get_context('tdf:topology') or 'chain'
+        locations = locations or self.node.try_get_context('tdf:locations') or DEFAULT_LOCATIONS
+        max_concurrency = max_concurrency or int(self.node.try_get_context('tdf:max_concurrency') or 10)
+        if inline_payload_bytes is None:
+            inline_payload_bytes = int(self.node.try_get_context('tdf:inline_payload_bytes') or 32 * 1024)
+        sqs_batch_size = sqs_batch_size or int(self.node.try_get_context('tdf:sqs_batch_size') or 100)
+        if sqs_batching_window is None:
+            # 0 is a valid window, invoking curation as soon as messages arrive
+            sqs_batching_window = self.node.try_get_context('tdf:sqs_batching_window')
+            sqs_batching_window = 60 if sqs_batching_window is None else int(sqs_batching_window)
+
+        schedule_minutes = schedule_minutes or int(self.node.try_get_context('tdf:schedule_minutes') or 60)
+        if express is None:
+            express = str(self.node.try_get_context('tdf:express') or '').lower() in ('1', 'true', 'yes')
+
+        if shard_count is None:
+            shard_count = int(self.node.try_get_context('tdf:shard_count') or 0)
+        metrics_namespace = metrics_namespace or self.node.try_get_context('tdf:metrics_namespace') or ''
+        if lazy_imports is None:
+            lazy_imports = str(self.node.try_get_context('tdf:lazy_imports') or '').lower() in ('1', 'true', 'yes')
+        if profile_rate is None:
+            profile_rate = float(self.node.try_get_context('tdf:profile_rate') or 0)
+        if memory_budget is None:
+            memory_budget = float(self.node.try_get_context('tdf:memory_budget') or 0)
+        layer_manifest = load_layer_manifest(layer_manifest or self.node.try_get_context('tdf:layer_manifest') or MANIFEST)
+        buffer_dir = buffer_dir or self.node.try_get_context('tdf:buffer_dir') or ''
+
+        if schedule_minutes < 1 or 60 % schedule_minutes:
+            raise ValueError(f"schedule_minutes must be a divisor of 60, got {schedule_minutes}")
+
+        if not 0 <= profile_rate <= 1:
+            raise ValueError(f"profile_rate must be between 0 and 1, got {profile_rate}")
+
+        if not 0 <= memory_budget < 1:
+            raise ValueError(f"memory_budget must be at least 0 and below 1, got {memory_budget}")
+
+        if topology not in ('chain', 'fused', 'map', 'events'):
+            raise ValueError(f"Unknown topology '{topology}', expected 'chain', 'fused', 'map' or 'events'")
+
+        if buffer_dir and not re.fullmatch(r'/mnt/[a-zA-Z0-9_.-]+', buffer_dir):
+            raise ValueError(f"buffer_dir must be a Lambda file system mount path such as /mnt/buffer, got '{buffer_dir}'")
+
+        if buffer_dir and topology == 'events':
+            raise ValueError("buffer_dir does not apply to the 'events' topology, which curates batches already")
+
+        # Secret manager, from the key_details.json written by set_key.sh at the root of the repo
+        with open(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'key_details.json')) as f:
             try:
                 json_f = json.loads(f.read())
                 secret_arn = json_f['ARN']
@@ -66,57 +176,149 @@ class TdfTestStack(Stack):
          removal_policy=RemovalPolicy.DESTROY,
          auto_delete_objects=True)
 
-        # PyArrow Layer
-        pyarrow_layer = _lambda.LayerVersion(self, 'pyarrow_layer',
-                                     code=_lambda.Code.from_asset("layer"),
-                                     description='PyArrow Library',
-                                     compatible_runtimes=[_lambda.Runtime.PYTHON_3_6, _lambda.Runtime.PYTHON_3_7, _lambda.Runtime.PYTHON_3_8],
+        self.curated_table(bucket_curated, topology, locations, shard_count)
+
+        if layer_manifest is None:
+            # PyArrow Layer
+            pyarrow_layer = _lambda.LayerVersion(self, 'pyarrow_layer',
+                                         code=_lambda.Code.from_asset("layer"),
+                                         description='PyArrow Library',
+                                         compatible_runtimes=[_lambda.Runtime.PYTHON_3_6, _lambda.Runtime.PYTHON_3_7, _lambda.Runtime.PYTHON_3_8],
+                                         removal_policy=RemovalPolicy.DESTROY
+                                         )
+            raw_layers = curated_layers = [pyarrow_layer]
+        else:
+            # Pruned layers, the zips are named by content hash so CDK does not hash them again
+            built_layers = {
+                name: _lambda.LayerVersion(self, f'{name}_layer',
+                                     code=_lambda.Code.from_asset(layer['zip'], asset_hash=layer['hash'], asset_hash_type=cdk.AssetHashType.CUSTOM),
+                                     description=f'Pruned {name} dependencies',
+                                     compatible_runtimes=[_lambda.Runtime.PYTHON_3_7],
                                      removal_policy=RemovalPolicy.DESTROY
                                      )
+                for name, layer in layer_manifest['layers'].items()
+            }
+            raw_layers = [built_layers[name] for name in layer_manifest['functions']['raw']]
+            curated_layers = [built_layers[name] for name in layer_manifest['functions']['curation']]
 
         # Lambda policies for S3 access
         lambda_policy_s3_raw = iam.PolicyStatement(effect=iam.Effect.ALLOW, resources=[f'{bucket_raw.bucket_arn}/*'], actions=['s3:PutObject'])
         lambda_policy_s3_curated = iam.PolicyStatement(effect=iam.Effect.ALLOW, resources=[f'{bucket_curated.bucket_arn}/*'], actions=['s3:PutObject'])
         lambda_policy_raw_curated = iam.PolicyStatement(effect=iam.Effect.ALLOW, resources=[f'{bucket_raw.bucket_arn}/*'], actions=['s3:GetObject'])
 
-        # Raw Lambda job
-        lambda_raw = _lambda.Function(
-            self, 'TDFRawHandler',
-            runtime = _lambda.Runtime.PYTHON_3_7,
-            function_name='tdf_raw_handler',
-            code = _lambda.Code.from_asset('lambda'), # folder
-            timeout = cdk.Duration.seconds(300),
-            handler = 'raw.handler', # file_name.handler_function
-            environment={
-                "raw_bucket": bucket_raw.bucket_name,
-                "secret_name": key_name,
-            },
-            layers=[pyarrow_layer],
-        )
-
-        # Curated Lambda job
-        lambda_curated = _lambda.Function(
-            self, 'TDFCuratedHandler',
-            runtime = _lambda.Runtime.PYTHON_3_7,
-            function_name='tdf_curated_handler',
-            code = _lambda.Code.from_asset('lambda'), # folder
-            timeout = cdk.Duration.seconds(300),
-            handler = 'curation.handler', # file_name.handler_function
-            environment={
-                "curated_bucket": bucket_curated.bucket_name
-            },
-            layers=[pyarrow_layer],
-        )
+        if topology == 'fused':
+            # Fused Lambda job, fetches, archives the raw response and curates in one invocation
+            lambda_pipeline = _lambda.Function(
+                self, 'TDFPipelineHandler',
+                runtime = _lambda.Runtime.PYTHON_3_7,
+                function_name='tdf_pipeline_handler',
+                code = _lambda.Code.from_asset('lambda'), # folder
+                timeout = cdk.Duration.seconds(300),
+                handler = 'pipeline.handler', # file_name.handler_function
+                environment={
+                    "raw_bucket": bucket_raw.bucket_name,
+                    "curated_bucket": bucket_curated.bucket_name,
+                    "secret_name": key_name,
+                    "schedule_minutes": str(schedule_minutes),
+                    "shard_count": str(shard_count),
+                    "metrics_namespace": metrics_namespace,
+                    "lazy_imports": '1' if lazy_imports else '',
+                    "profile_rate": str(profile_rate),
+                    "buffer_dir": buffer_dir,
+                },
+                layers=curated_layers,
+                # The pipeline calls the API and Secrets Manager, so it reaches the internet through NAT
+                **self.buffer_filesystem(buffer_dir, internet=True),
+            )
+
+            ## Get rid of these when destroying
+            lambda_pipeline.apply_removal_policy=RemovalPolicy.DESTROY
+
+            # Add policies to Lambda
+            lambda_pipeline.add_to_role_policy(lambda_policy_s3_raw)
+            lambda_pipeline.add_to_role_policy(lambda_policy_s3_curated)
+            secret.grant_read(lambda_pipeline)
+        else:
+            # Raw Lambda job
+            lambda_raw = _lambda.Function(
+                self, 'TDFRawHandler',
+                runtime = _lambda.Runtime.PYTHON_3_7,
+                function_name='tdf_raw_handler',
+                code = _lambda.Code.from_asset('lambda'), # folder
+                timeout = cdk.Duration.seconds(300),
+                handler = 'raw.handler', # file_name.handler_function
+                environment={
+                    "raw_bucket": bucket_raw.bucket_name,
+                    "secret_name": key_name,
+                    # Events curation is triggered by the raw object, so raw always writes it
+                    "inline_payload_bytes": '0' if topology == 'events' else str(inline_payload_bytes),
+                    "schedule_minutes": str(schedule_minutes),
+                    "shard_count": str(shard_count),
+                    "metrics_namespace": metrics_namespace,
+                    "lazy_imports": '1' if lazy_imports else '',
+                    "profile_rate": str(profile_rate),
+                },
+                layers=raw_layers,
+            )
+
+            # Curated Lambda job
+            lambda_curated = _lambda.Function(
+                self, 'TDFCuratedHandler',
+                runtime = _lambda.Runtime.PYTHON_3_7,
+                function_name='tdf_curated_handler',
+                code = _lambda.Code.from_asset('lambda'), # folder
+                timeout = cdk.Duration.seconds(300),
+                handler = 'curation.sqs_handler' if topology == 'events' else 'curation.handler', # file_name.handler_function
+                environment={
+                    "curated_bucket": bucket_curated.bucket_name,
+                    "schedule_minutes": str(schedule_minutes),
+                    "shard_count": str(shard_count),
+                    "metrics_namespace": metrics_namespace,
+                    "lazy_imports": '1' if lazy_imports else '',
+                    "profile_rate": str(profile_rate),
+                    "memory_budget": str(memory_budget),
+                    "buffer_dir": buffer_dir,
+                },
+                layers=curated_layers,
+                **self.buffer_filesystem(buffer_dir, internet=False),
+            )
         
-        ## Get rid of these when destroying
-        lambda_raw.apply_removal_policy=RemovalPolicy.DESTROY
-        lambda_curated.apply_removal_policy=RemovalPolicy.DESTROY
+            ## Get rid of these when destroying
+            lambda_raw.apply_removal_policy=RemovalPolicy.DESTROY
+            lambda_curated.apply_removal_policy=RemovalPolicy.DESTROY
+
+            # Add policies to Lambda
+            lambda_raw.add_to_role_policy(lambda_policy_s3_raw)
+            lambda_curated.add_to_role_policy(lambda_policy_s3_curated)
+            lambda_curated.add_to_role_policy(lambda_policy_raw_curated)
+            if topology != 'events':
+                # Curation archives the observations inlined by the raw job
+                lambda_curated.add_to_role_policy(lambda_policy_s3_raw)
+            secret.grant_read(lambda_raw)
+
+        if topology == 'events':
+            # Queue of raw objects waiting to be curated, fed by the raw bucket notifications
+            curation_dlq = sqs.Queue(self, "CurationDeadLetterQueue",
+                retention_period=Duration.days(14),
+                removal_policy=RemovalPolicy.DESTROY,
+            )
+            curation_queue = sqs.Queue(self, "CurationQueue",
+                visibility_timeout=Duration.seconds(6 * 300),
+                dead_letter_queue=sqs.DeadLetterQueue(max_receive_count=3, queue=curation_dlq),
+                removal_policy=RemovalPolicy.DESTROY,
+            )
+
+            bucket_raw.add_event_notification(
+                s3.EventType.OBJECT_CREATED,
+                s3n.SqsDestination(curation_queue),
+                s3.NotificationKeyFilter(prefix='raw/'),
+            )
 
-        # Add policies to Lambda
-        lambda_raw.add_to_role_policy(lambda_policy_s3_raw)
-        lambda_curated.add_to_role_policy(lambda_policy_s3_curated)
-        lambda_curated.add_to_role_policy(lambda_policy_raw_curated)
-        secret.grant_read(lambda_raw)
+            lambda_curated.add_event_source(lambda_event_sources.SqsEventSource(curation_queue,
+                batch_size=sqs_batch_size,
+                max_batching_window=Duration.seconds(sqs_batching_window),
+                report_batch_item_failures=True,
+            ))
 
         # Create SNS topic
         topic = sns.Topic(self, "Topic",
@@ -142,17 +344,24 @@ class TdfTestStack(Stack):
 
         # Step Function to run the job
         # Create Chain
-        raw_job = _aws_stepfunctions_tasks.LambdaInvoke(
-            self, "Retrieve Raw",
-            lambda_function=lambda_raw,
-            output_path="$.Payload",
-        )
+        if topology == 'fused':
+            pipeline_job = _aws_stepfunctions_tasks.LambdaInvoke(
+                self, "Run Pipeline",
+                lambda_function=lambda_pipeline,
+                output_path="$.Payload",
+            )
+        else:
+            raw_job = _aws_stepfunctions_tasks.LambdaInvoke(
+                self, "Retrieve Raw",
+                lambda_function=lambda_raw,
+                output_path="$.Payload",
+            )
 
-        curated_job = _aws_stepfunctions_tasks.LambdaInvoke(
-            self, "Curate to Parquet",
-            lambda_function=lambda_curated,
-            output_path="$.Payload",
-        )
+            curated_job = _aws_stepfunctions_tasks.LambdaInvoke(
+                self, "Curate to Parquet",
+                lambda_function=lambda_curated,
+                output_path="$.Payload",
+            )
 
         publish_message = _aws_stepfunctions_tasks.SnsPublish(self, "Publish message",
             topic=topic,
@@ -171,29 +380,231 @@ class TdfTestStack(Stack):
             comment='AWS Batch Job succeeded'
         )
 
-        definition = raw_job.next(_aws_stepfunctions.Choice(self, 'Raw Complete?')
-                                        .when(_aws_stepfunctions.Condition.string_equals('$.status', 'SUCCEEDED'),
-                                            curated_job.next(_aws_stepfunctions.Choice(self, 'Job Complete?')\
-                                                            .when(_aws_stepfunctions.Condition.string_equals('$.status', 'SUCCEEDED'),succeed_job)
-                                                            .otherwise(publish_message)
-                                                            )
-                                            )
-                                        .otherwise(publish_message)
-                                )
-                                            
-                                    
+        if topology == 'chain':
+            definition = raw_job.next(_aws_stepfunctions.Choice(self, 'Raw Complete?')
+                                            .when(_aws_stepfunctions.Condition.string_equals('$.status', 'SUCCEEDED'),
+                                                curated_job.next(_aws_stepfunctions.Choice(self, 'Job Complete?')\
+                                                                .when(_aws_stepfunctions.Condition.string_equals('$.status', 'SUCCEEDED'),succeed_job)
+                                                                .otherwise(publish_message)
+                                                                )
+                                                )
+                                            .otherwise(publish_message)
+                                    )
+            sm_timeout = Duration.minutes(5)
+            sm_input = None
+        elif topology == 'events':
+            # Curation is triggered by the raw object landing in S3
+            definition = raw_job.next(_aws_stepfunctions.Choice(self, 'Raw Complete?')
+                                            .when(_aws_stepfunctions.Condition.string_equals('$.status', 'SUCCEEDED'), succeed_job)
+                                            .otherwise(publish_message)
+                                    )
+            sm_timeout = Duration.minutes(5)
+            sm_input = None
+        elif topology == 'fused':
+            # An error raised by the pipeline is reported like a FAILED status, as chain reports a failed job
+            pipeline_job.add_catch(
+                _aws_stepfunctions.Pass(self, 'Pipeline Errored',
+                    result=_aws_stepfunctions.Result.from_string('FAILED'),
+                    result_path='$.status',
+                ).next(publish_message),
+                result_path='$.error',
+            )
+            definition = pipeline_job.next(_aws_stepfunctions.Choice(self, 'Pipeline Complete?')
+                                            .when(_aws_stepfunctions.Condition.string_equals('$.status', 'SUCCEEDED'), succeed_job)
+                                            .otherwise(publish_message)
+                                    )
+            sm_timeout = Duration.minutes(5)
+            sm_input = None
+        else:
+            definition = self.location_map_definition(raw_job, curated_job, topic, succeed_job, max_concurrency)
+            # Finish before the next scheduled run starts
+            sm_timeout = Duration.minutes(max(schedule_minutes - 5, 5))
+            sm_input = events.RuleTargetInput.from_object({"locations": locations})
 
+        if express:
+            # Express executions cannot run for longer than five minutes
+            sm_timeout = Duration.minutes(5)
 
         # Create state machine
         sm = _aws_stepfunctions.StateMachine(
             self, "StateMachine",
             definition=definition,
-            timeout=Duration.minutes(5),
+            timeout=sm_timeout,
+            state_machine_type=_aws_stepfunctions.StateMachineType.EXPRESS if express else _aws_stepfunctions.StateMachineType.STANDARD,
         )
         sm.apply_removal_policy=RemovalPolicy.DESTROY
 
-        # Add Hourly cron job Cloud Watch Event for Step Function
-        rule_sf = events.Rule(self, "Schedule Rule Step Function", schedule=events.Schedule.cron(minute="0") )
-        rule_sf.add_target(targets.SfnStateMachine(sm))
+        # Add cron job Cloud Watch Event for Step Function, hourly unless a shorter schedule is set
+        minute = "0" if schedule_minutes == 60 else f"0/{schedule_minutes}"
+        rule_sf = events.Rule(self, "Schedule Rule Step Function", schedule=events.Schedule.cron(minute=minute) )
+        rule_sf.add_target(targets.SfnStateMachine(sm, input=sm_input))
+
+    def buffer_filesystem(self, buffer_dir, internet=False) -> dict:
+        """
+        Returns the arguments mounting an EFS file system at buffer_dir on a curating function,
+        or none when buffering is off.
+
+        Lambda mounts EFS from inside a VPC. Curation only reaches S3, through a gateway
+        endpoint from isolated subnets; with internet the function is placed in private
+        subnets behind a NAT gateway instead.
+        """
+
+        if not buffer_dir:
+            return {}
+
+        subnet_type = ec2.SubnetType.PRIVATE_WITH_NAT if internet else ec2.SubnetType.PRIVATE_ISOLATED
+        vpc = ec2.Vpc(self, "BufferVpc",
+            max_azs=2,
+            nat_gateways=1 if internet else 0,
+            subnet_configuration=[
+                ec2.SubnetConfiguration(name='public', subnet_type=ec2.SubnetType.PUBLIC),
+                ec2.SubnetConfiguration(name='buffer', subnet_type=subnet_type),
+            ] if internet else [ec2.SubnetConfiguration(name='buffer', subnet_type=subnet_type)],
+            gateway_endpoints={"S3": ec2.GatewayVpcEndpointOptions(service=ec2.GatewayVpcEndpointAwsService.S3)},
+        )
+
+        file_system = efs.FileSystem(self, "BufferFileSystem",
+            vpc=vpc,
+            vpc_subnets=ec2.SubnetSelection(subnet_type=subnet_type),
+            removal_policy=RemovalPolicy.DESTROY,
+        )
+        # The Lambda runtime user, which owns the buffer directory
+        access_point = file_system.add_access_point("BufferAccessPoint",
+            path='/buffer',
+            create_acl=efs.Acl(owner_uid='1001', owner_gid='1001', permissions='750'),
+            posix_user=efs.PosixUser(uid='1001', gid='1001'),
+        )
+
+        return {
+            "vpc": vpc,
+            "vpc_subnets": ec2.SubnetSelection(subnet_type=subnet_type),
+            "filesystem": _lambda.FileSystem.from_efs_access_point(access_point, buffer_dir),
+        }
+
+    def curated_table(self, bucket_curated, topology, locations, shard_count=0):
+        """
+        Glue table over the curated bucket using partition projection, so Athena works out
+        the partitions from the query instead of a crawler or metastore lookups.
+
+        Every topology writes under curated/{year}/{month}/{day}/{hour}/, projected as the
+        dt partition (e.g. '2022/3/4/5') in Melbourne time. The 'map' topology adds a directory
+        per location, projected as the location partition from the configured ids, which
+        batch files of a location are written in as well. With sharding on, the
+        shard directory ahead of the date is projected as the shard partition; Athena
+        cannot derive it from the location, so every shard is listed unless it is filtered.
+        """
+
+        database = glue.CfnDatabase(self, "CuratedDatabase",
+            catalog_id=self.account,
+            database_input=glue.CfnDatabase.DatabaseInputProperty(name=GLUE_DATABASE),
+        )
+
+        location = f's3://{bucket_curated.bucket_name}/curated/'
+        partition_keys = [glue.CfnTable.ColumnProperty(name='dt', type='string')]
+        parameters = {
+            "classification": "parquet",
+            "projection.enabled": "true",
+            "projection.dt.type": "date",
+            "projection.dt.format": "yyyy/M/d/H",
+            # Keys are in Melbourne time, up to 11 hours ahead of the UTC NOW of Athena
+            "projection.dt.range": "2022/1/1/0,NOW+11HOURS",
+            "projection.dt.interval": "1",
+            "projection.dt.interval.unit": "HOURS",
+        }
+
+        if topology == 'map':
+            partition_keys.append(glue.CfnTable.ColumnProperty(name='location', type='string'))
+            parameters.update({
+                "projection.location.type": "enum",
+                "projection.location.values": ','.join(item['id'] for item in locations),
+                "storage.location.template": location + '${dt}/${location}/',
+            })
+
+            if shard_count:
+                partition_keys.insert(0, glue.CfnTable.ColumnProperty(name='shard', type='string'))
+                parameters.update({
+                    "projection.shard.type": "enum",
+                    "projection.shard.values": ','.join(f'shard-{shard:02d}' for shard in range(shard_count)),
+                    "storage.location.template": location + '${shard}/${dt}/${location}/',
+                })
+        else:
+            parameters["storage.location.template"] = location + '${dt}/'
+
+        table = glue.CfnTable(self, "CuratedTable",
+            catalog_id=self.account,
+            database_name=GLUE_DATABASE,
+            table_input=glue.CfnTable.TableInputProperty(
+                name=GLUE_TABLE,
+                table_type='EXTERNAL_TABLE',
+                parameters=parameters,
+                partition_keys=partition_keys,
+                storage_descriptor=glue.CfnTable.StorageDescriptorProperty(
+                    columns=[glue.CfnTable.ColumnProperty(name=name, type=kind) for name, kind in canonical_columns()],
+                    location=location,
+                    input_format='org.apache.hadoop.hive.ql.io.parquet.MapredParquetInputFormat',
+                    output_format='org.apache.hadoop.hive.ql.io.parquet.MapredParquetOutputFormat',
+                    serde_info=glue.CfnTable.SerdeInfoProperty(
+                        serialization_library='org.apache.hadoop.hive.ql.io.parquet.serde.ParquetHiveSerDe',
+                    ),
+                ),
+            ),
+        )
+        table.add_depends_on(database)
+
+        return table
+
+    def location_map_definition(self, raw_job, curated_job, topic, succeed_job, max_concurrency):
+        """
+        Runs raw then curation for every location in $.locations with at most
+        max_concurrency locations in flight. Each location ends with a {location, status}
+        item, whether it failed in a handler or with an error, and a single SNS message
+        lists the failed locations once all of them have finished.
+        """
+
+        item_succeeded = _aws_stepfunctions.Pass(self, "Location Succeeded",
+            parameters={"location.$": "$.location", "status": "SUCCEEDED"},
+        )
+        item_failed = _aws_stepfunctions.Pass(self, "Location Failed",
+            parameters={"location.$": "$.location", "status": "FAILED"},
+        )
+        item_errored = _aws_stepfunctions.Pass(self, "Location Errored",
+            parameters={"location.$": "$.location", "status": "FAILED", "error.$": "$.error"},
+        )
+
+        raw_job.add_catch(item_errored, result_path="$.error")
+        curated_job.add_catch(item_errored, result_path="$.error")
+
+        iterator = raw_job.next(_aws_stepfunctions.Choice(self, 'Location Raw Complete?')
+                                    .when(_aws_stepfunctions.Condition.string_equals('$.status', 'SUCCEEDED'),
+                                        curated_job.next(_aws_stepfunctions.Choice(self, 'Location Complete?')
+                                                        .when(_aws_stepfunctions.Condition.string_equals('$.status', 'SUCCEEDED'), item_succeeded)
+                                                        .otherwise(item_failed)
+                                                        )
+                                        )
+                                    .otherwise(item_failed)
+                                )
+
+        location_map = _aws_stepfunctions.Map(self, "Process Locations",
+            items_path="$.locations",
+            max_concurrency=max_concurrency,
+            parameters={"location.$": "$$.Map.Item.Value"},
+            result_path="$.results",
+        )
+        location_map.iterator(iterator)
+
+        collect_failures = _aws_stepfunctions.Pass(self, "Collect Failures",
+            parameters={"failed.$": "$.results[?(@.status == 'FAILED')]"},
+        )
+
+        publish_summary = _aws_stepfunctions_tasks.SnsPublish(self, "Publish failure summary",
+            topic=topic,
+            message=_aws_stepfunctions.TaskInput.from_object({"status": "FAILED", "failed.$": "$.failed"}),
+            result_path="$.publish",
+        )
+
+        return location_map.next(collect_failures).next(_aws_stepfunctions.Choice(self, 'Any Failures?')
+                                    .when(_aws_stepfunctions.Condition.is_present('$.failed[0]'), publish_summary)
+                                    .otherwise(succeed_job)
+                                )
 
 
@@ -0,0 +1,48 @@
+import json
+import os
+import sys
+
+# The Lambda modules import each other as top-level modules, as they do in the Lambda runtime,
+# and the benchmark scripts are run as scripts from benchmarks/
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', '..', 'lambda'))
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', '..', 'benchmarks'))
+
+from fsspec.implementations.memory import MemoryFileSystem
+import pytest
+
+
+class S3MemoryFileSystem(MemoryFileSystem):
+    """In-memory filesystem treating s3://bucket/key and bucket/key as the same object, as s3fs does"""
+
+    @classmethod
+    def _strip_protocol(cls, path):
+        if isinstance(path, str) and path.startswith('s3://'):
+            path = path[len('s3://'):]
+        return super()._strip_protocol(path)
+
+
+@pytest.fixture
+def s3():
+    """Empty in-memory stand-in for S3"""
+
+    MemoryFileSystem.store.clear()
+    MemoryFileSystem.pseudo_dirs[:] = ['']
+    return S3MemoryFileSystem()
+
+
+@pytest.fixture(autouse=True, scope='session')
+def key_details():
+    """Writes the key_details.json set_key.sh would, for synthesizing the stack, when it is not there"""
+
+    path = os.path.join(os.path.dirname(__file__), '..', '..', 'key_details.json')
+    if os.path.exists(path):
+        yield path
+        return
+
+    with open(path, 'w') as f:
+        json.dump({"ARN": "arn:aws:secretsmanager:ap-southeast-2:123456789012:secret:my_tdf_test/api_key-AbCdEf",
+                   "Name": "my_tdf_test/api_key"}, f)
+    try:
+        yield path
+    finally:
+        os.remove(path)
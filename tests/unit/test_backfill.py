@@ -0,0 +1,152 @@
+from datetime import datetime
+import json
+from types import SimpleNamespace
+
+from fsspec.implementations.local import LocalFileSystem
+from fsspec.implementations.memory import MemoryFileSystem
+import pyarrow.parquet as pq
+import pytest
+
+import backfill
+from backfill import RateLimiter, backfill_day, curated_hours, expected_hours, fetch_history_day, history_observation, local_timezone, plan_backfill, run_backfill
+
+
+@pytest.fixture
+def buckets(tmp_path):
+    return str(tmp_path / 'raw-bucket'), str(tmp_path / 'curated-bucket')
+
+
+def touch(fs, path):
+    fs.makedirs(path.rsplit('/', 1)[0], exist_ok=True)
+    fs.touch(path)
+
+
+def test_expected_hours_follow_daylight_saving():
+    # Daylight saving ends at 3am on 3 April 2022, repeating 2am
+    ending = expected_hours(datetime(2022, 4, 3, 1), datetime(2022, 4, 3, 4))
+    assert [hour.hour for hour in ending] == [1, 2, 3]
+
+    # and starts at 2am on 2 October 2022, skipping it
+    starting = expected_hours(datetime(2022, 10, 2, 1), datetime(2022, 10, 2, 4))
+    assert [hour.hour for hour in starting] == [1, 3]
+
+    assert len(expected_hours(datetime(2022, 3, 1), datetime(2022, 3, 2))) == 24
+
+
+def test_curated_hours_of_a_location_include_its_batches(buckets):
+    fs = LocalFileSystem()
+    _, curated = buckets
+    touch(fs, f'{curated}/curated/2022/3/4/5/healesville/weather.parquet')
+    touch(fs, f'{curated}/curated/2022/3/4/6/healesville/batch-abc.parquet')
+    touch(fs, f'{curated}/curated/2022/3/4/7/batch-abc.parquet')
+
+    start, end = datetime(2022, 3, 4), datetime(2022, 3, 5)
+    assert curated_hours(fs, curated, start, end, 'healesville') == {datetime(2022, 3, 4, 5), datetime(2022, 3, 4, 6)}
+    assert curated_hours(fs, curated, start, end) == {datetime(2022, 3, 4, 7)}
+
+
+def test_plan_splits_hours_to_curate_again_and_to_fetch(buckets):
+    fs = LocalFileSystem()
+    raw, curated = buckets
+    touch(fs, f'{raw}/raw/2022/3/4/5.json')
+    touch(fs, f'{raw}/raw/2022/3/4/6.json')
+    touch(fs, f'{curated}/curated/2022/3/4/5/weather.parquet')
+
+    gaps = plan_backfill(fs, raw, curated, datetime(2022, 3, 4, 5), datetime(2022, 3, 4, 8))
+
+    assert gaps['recurate'] == {datetime(2022, 3, 4, 6): [f'{raw}/raw/2022/3/4/6.json']}
+    assert gaps['fetch'] == [datetime(2022, 3, 4, 7)]
+
+
+def test_raw_only_backfill_leaves_curation_to_the_pipeline():
+    # Raw and curated keys are built as s3:// URLs
+    MemoryFileSystem.store.clear()
+    fs = MemoryFileSystem()
+    hour = datetime(2022, 3, 4, 5)
+    epoch = int(local_timezone().localize(hour).timestamp())
+    history = {
+        "location": {"name": "Healesville"},
+        "forecast": {"forecastday": [{"hour": [{"time_epoch": epoch, "time": "2022-03-04 05:00", "temp_c": 20.1}]}]},
+    }
+
+    done = backfill_day(fs, history, [hour], 'raw', 'curated', curate=False)
+
+    assert done == [hour]
+    assert fs.exists('s3://raw/raw/2022/3/4/5.json')
+    assert fs.find('s3://curated') == []
+
+
+class FindRecorder(LocalFileSystem):
+    """Local filesystem recording the paths listed with find"""
+
+    found = []
+
+    def find(self, path, **kwargs):
+        self.found.append(path)
+        return super().find(path, **kwargs)
+
+
+def test_plan_lists_only_the_days_of_the_window(buckets):
+    fs = FindRecorder()
+    raw, curated = buckets
+    touch(fs, f'{raw}/raw/2022/3/4/6.json')
+    touch(fs, f'{raw}/raw/2022/3/5/6.json')
+    touch(fs, f'{raw}/raw/shard-01/2022/3/4/6/healesville.json')
+    touch(fs, f'{curated}/curated/2022/3/3/5/weather.parquet')
+
+    gaps = plan_backfill(fs, raw, curated, datetime(2022, 3, 4, 5), datetime(2022, 3, 4, 8))
+
+    assert sorted(gaps['recurate']) == [datetime(2022, 3, 4, 6)]
+    assert sorted(path[len(raw) + 1:] for path in fs.found if path.startswith(raw)) == [
+        'raw/2022/3/4', 'raw/shard-01/2022/3/4']
+    assert [path[len(curated) + 1:] for path in fs.found if path.startswith(curated)] == ['curated/2022/3/4']
+
+
+def observation(last_updated_epoch, temp_c) -> dict:
+    return {
+        "location": {"name": "Healesville", "region": "Victoria", "country": "Australia", "lat": -37.5, "lon": 145.74,
+                     "tz_id": "Australia/Melbourne", "localtime_epoch": 1646352000, "localtime": "2022-03-04 11:00"},
+        "current": {"last_updated_epoch": last_updated_epoch, "last_updated": "2022-03-04 05:00", "temp_c": temp_c,
+                    "condition": {"text": "Sunny", "code": 1000}, "wind_kph": 3.6, "humidity": 56, "cloud": 0},
+    }
+
+
+def test_every_raw_object_of_an_hour_is_curated_again(s3, monkeypatch):
+    monkeypatch.setenv('schedule_minutes', '15')
+    for minute, temp_c in ((0, 20.0), (15, 21.0)):
+        with s3.open(f'raw/raw/2022/3/4/5/weather_{minute:02d}.json', 'w') as f:
+            json.dump(json.dumps(observation(1646330400 + minute * 60, temp_c)), f)
+
+    summary = run_backfill(s3, 'raw', 'curated', datetime(2022, 3, 4, 5), datetime(2022, 3, 4, 6), 'key')
+
+    assert summary == {"recurated": 1, "fetched": 0, "failed": []}
+    for minute, temp_c in ((0, 20.0), (15, 21.0)):
+        with s3.open(f'curated/curated/2022/3/4/5/weather_{minute:02d}.parquet', 'rb') as f:
+            assert pq.read_table(f).column('temp_c').to_pylist() == [temp_c]
+
+
+def test_history_observation_is_dated_at_its_hour():
+    hour = datetime(2022, 3, 4, 5)
+    epoch = int(local_timezone().localize(hour).timestamp())
+    history = {
+        "location": {"name": "Healesville", "localtime_epoch": 1646611200, "localtime": "2022-03-07 11:00"},
+        "forecast": {"forecastday": [{"hour": [{"time_epoch": epoch, "time": "2022-03-04 05:00", "temp_c": 20.1}]}]},
+    }
+
+    found = history_observation(history, hour)
+
+    assert found['location'] == {"name": "Healesville", "localtime_epoch": epoch, "localtime": "2022-03-04 5:00"}
+    assert found['current'] == {"last_updated_epoch": epoch, "last_updated": "2022-03-04 05:00", "temp_c": 20.1}
+    # The response is left as it was
+    assert history['location']['localtime'] == "2022-03-07 11:00"
+
+
+def test_history_is_fetched_from_the_configured_api(monkeypatch):
+    urls = []
+    response = SimpleNamespace(status_code=200, json=lambda: {"forecast": {"forecastday": []}})
+    monkeypatch.setenv('weather_api_url', 'http://localhost:8080')
+    monkeypatch.setattr(backfill, 'requests', SimpleNamespace(get=lambda url, timeout: urls.append(url) or response))
+
+    fetch_history_day('key', 'Healesville', datetime(2022, 3, 4), RateLimiter(0))
+
+    assert urls == ['http://localhost:8080/v1/history.json?key=key&q=Healesville&dt=2022-03-04']
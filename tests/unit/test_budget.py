@@ -0,0 +1,77 @@
+import pyarrow as pa
+import pyarrow.parquet as pq
+import pytest
+
+from budget import ChunkedWriter, MemoryBudget
+from curation import close_chunked_batch
+from schema import conform
+
+
+def chunk(*temps) -> pa.Table:
+    return conform(pa.table({"temp_c": pa.array(temps, pa.float32())}))
+
+
+class RowBudget(MemoryBudget):
+    """Budget over the pending rows only, ignoring the rest of the Arrow pool"""
+
+    def exceeded(self, pending_bytes) -> bool:
+        self.sample()
+        return pending_bytes >= self.limit_bytes
+
+
+class FailingOpen:
+    """Filesystem failing to open the keys given"""
+
+    def __init__(self, fs, failing):
+        self.fs = fs
+        self.failing = failing
+
+    def open(self, path, mode='rb'):
+        if path in self.failing:
+            raise IOError('Slow Down')
+        return self.fs.open(path, mode)
+
+    def rm(self, path):
+        self.fs.rm(path)
+
+
+def test_chunks_are_flushed_as_row_groups_once_over_budget(s3):
+    writer = ChunkedWriter(s3, RowBudget(chunk(1.0).nbytes * 2))
+
+    writer.write('curated/a.parquet', chunk(1.0))
+    assert writer.row_groups == 0
+
+    writer.write('curated/a.parquet', chunk(2.0))
+    writer.write('curated/a.parquet', chunk(3.0))
+    writer.close('curated/a.parquet')
+
+    with s3.open('curated/a.parquet') as f:
+        parquet = pq.ParquetFile(f)
+        assert parquet.num_row_groups == 2
+        assert parquet.read().column('temp_c').to_pylist() == [1.0, 2.0, 3.0]
+    assert writer.pending_bytes == 0
+
+
+def test_failed_flush_fails_every_message_of_its_object(s3):
+    writer = ChunkedWriter(FailingOpen(s3, {'curated/b.parquet'}), RowBudget(1 << 30))
+    hours = {
+        'curated/a.parquet': [('m1', None), ('m2', None)],
+        'curated/b.parquet': [('m3', None), ('m4', None)],
+    }
+    writer.write('curated/a.parquet', chunk(1.0))
+    writer.write('curated/b.parquet', chunk(2.0))
+    writer.write('curated/a.parquet', chunk(3.0))
+
+    # The budget is reached while writing a row of m4, and b cannot be written
+    writer.budget.limit_bytes = 1
+    with pytest.raises(IOError):
+        writer.write('curated/b.parquet', chunk(4.0))
+    failed = {'m4'}
+
+    close_chunked_batch(writer, hours, failed)
+
+    assert failed == {'m3', 'm4'}
+    assert not s3.exists('curated/b.parquet')
+    with s3.open('curated/a.parquet') as f:
+        assert pq.read_table(f).column('temp_c').to_pylist() == [1.0, 3.0]
+    assert writer.pending_bytes == 0
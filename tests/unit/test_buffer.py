@@ -0,0 +1,71 @@
+from datetime import datetime
+from unittest import mock
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from buffer import WriteAheadBuffer
+from dataset import read_curated
+from schema import CANONICAL_SCHEMA, conform
+
+
+def observation(location_id, temp_c) -> pa.Table:
+    return conform(pa.table({"location_id": [location_id], "temp_c": pa.array([temp_c], pa.float32())}))
+
+
+def test_flush_writes_a_file_per_hour_and_location(tmp_path, s3):
+    buffer = WriteAheadBuffer(str(tmp_path))
+    buffer.append(datetime(2022, 3, 4, 5, 10), observation('healesville', 20.0))
+    buffer.append(datetime(2022, 3, 4, 5, 20), observation('melbourne', 21.0))
+    buffer.append(datetime(2022, 3, 4, 5, 30), observation(None, 22.0))
+    buffer.append(datetime(2022, 3, 4, 5, 40), observation('healesville', 20.5))
+    buffer.append(datetime(2022, 3, 4, 6, 10), observation('healesville', 19.5))
+
+    with mock.patch.dict('os.environ', {"shard_count": "0"}):
+        keys = buffer.flush(s3, 'curated')
+
+    written = {}
+    for key in keys:
+        with s3.open(key, 'rb') as f:
+            parquet = pq.ParquetFile(f)
+            # Each file is a single row group with the canonical schema
+            assert parquet.num_row_groups == 1
+            table = parquet.read()
+        assert table.schema.equals(CANONICAL_SCHEMA)
+        # Directory of the file under the day, the hour then the location if any
+        directory = key.split('/2022/3/4/')[1].rsplit('/', 1)[0]
+        written[directory] = table.column('temp_c').to_pylist()
+
+    assert written == {
+        '5/healesville': [20.0, 20.5],
+        '5/melbourne': [21.0],
+        '5': [22.0],
+        '6/healesville': [19.5],
+    }
+    assert buffer.read().num_rows == 0
+
+
+def test_quiet_buffer_flushes_on_age_when_read(tmp_path, s3):
+    buffer = WriteAheadBuffer(str(tmp_path), max_records=100, max_seconds=0)
+    buffer.append(datetime(2022, 3, 4, 5, 10), observation('healesville', 20.0))
+
+    env = {"buffer_dir": str(tmp_path), "buffer_max_records": "100", "buffer_max_seconds": "0", "shard_count": "0"}
+    with mock.patch.dict('os.environ', env):
+        table = read_curated(s3, 'curated', columns=['temp_c'])
+
+    # Flushed by the read and counted once
+    assert table.column('temp_c').to_pylist() == [20.0]
+    assert len(s3.find('curated/curated')) == 1
+    assert buffer.read().num_rows == 0
+
+
+def test_flush_if_due_waits_for_records_or_age(tmp_path, s3):
+    buffer = WriteAheadBuffer(str(tmp_path), max_records=2, max_seconds=3600)
+    buffer.append(datetime(2022, 3, 4, 5, 10), observation('healesville', 20.0))
+
+    assert buffer.flush_if_due(s3, 'curated') == []
+
+    buffer.append(datetime(2022, 3, 4, 5, 20), observation('healesville', 21.0))
+
+    with buffer.locked():
+        assert len(buffer.flush_if_due(s3, 'curated')) == 1
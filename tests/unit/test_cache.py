@@ -0,0 +1,105 @@
+from unittest import mock
+
+from fsspec.implementations.local import LocalFileSystem
+from fsspec.implementations.memory import MemoryFileSystem
+import pytest
+
+from cache import CuratedCache, object_etag
+
+
+@pytest.fixture
+def fs():
+    MemoryFileSystem.store.clear()
+    MemoryFileSystem.pseudo_dirs[:] = ['']
+    return MemoryFileSystem()
+
+
+def write(fs, path, data):
+    with fs.open(path, 'wb') as f:
+        f.write(data)
+
+
+def test_memory_cache_hits_and_evicts_least_recently_used(fs):
+    for name in 'abc':
+        write(fs, f'/bucket/{name}.parquet', b'x' * 100)
+    cache = CuratedCache(fs, mode='memory', max_bytes=250)
+
+    for name in 'abca':
+        assert cache.open(f'/bucket/{name}.parquet').read() == b'x' * 100
+
+    stats = cache.stats()
+    assert (stats['hits'], stats['misses'], stats['evictions']) == (0, 4, 2)
+    assert stats['bytes'] == 200
+    assert list(cache._entries) == ['/bucket/c.parquet', '/bucket/a.parquet']
+
+
+def test_memory_cache_invalidates_changed_objects(fs):
+    write(fs, '/bucket/a.parquet', b'old')
+    cache = CuratedCache(fs, mode='memory')
+    cache.open('/bucket/a.parquet')
+    write(fs, '/bucket/a.parquet', b'newer')
+
+    assert cache.open('/bucket/a.parquet').read() == b'newer'
+    assert cache.stats()['invalidations'] == 1
+    assert cache.size() == 5
+
+
+def test_listed_info_saves_the_head_request(fs):
+    write(fs, '/bucket/a.parquet', b'data')
+    cache = CuratedCache(fs, mode='memory')
+
+    with mock.patch.object(fs, 'info', side_effect=AssertionError('HEAD request')):
+        cache.open('/bucket/a.parquet', info={"name": '/bucket/a.parquet', "ETag": '"abc"'}).read()
+        cache.open('/bucket/a.parquet', info={"name": '/bucket/a.parquet', "ETag": '"abc"'}).read()
+
+    assert cache.stats()['hits'] == 1
+
+
+def test_object_etag_prefers_the_etag():
+    assert object_etag({"ETag": '"abc"', "size": 1}) == 'abc'
+    assert object_etag({"size": 3, "mtime": 1.5}) == '3-1.5'
+
+
+def test_disk_cache_keeps_etags_for_the_next_process(tmp_path):
+    fs = LocalFileSystem()
+    source = tmp_path / 'source'
+    source.mkdir()
+    for name in 'ab':
+        (source / f'{name}.parquet').write_bytes(b'x' * 10000)
+
+    cache_dir = str(tmp_path / 'cache')
+    cache = CuratedCache(fs, mode='disk', max_bytes=2 ** 20, cache_dir=cache_dir)
+    for name in 'ab':
+        with cache.open(str(source / f'{name}.parquet')) as f:
+            f.read()
+
+    reopened = CuratedCache(fs, mode='disk', max_bytes=2 ** 20, cache_dir=cache_dir)
+    with reopened.open(str(source / 'a.parquet')) as f:
+        assert f.read() == b'x' * 10000
+    assert reopened.stats()['hits'] == 1
+
+    # Over budget, the least recently used file goes and each file is measured once
+    reopened.max_bytes = 1
+    with mock.patch.object(reopened, '_local_size', wraps=reopened._local_size) as local_size:
+        reopened._evict(keep=str(source / 'a.parquet'))
+    assert list(reopened._entries) == [str(source / 'a.parquet')]
+    assert local_size.call_count == 3
+
+
+def test_disk_cache_refetches_files_of_unknown_etag(tmp_path):
+    fs = LocalFileSystem()
+    path = tmp_path / 'a.parquet'
+    path.write_bytes(b'x' * 10000)
+
+    cache_dir = tmp_path / 'cache'
+    with CuratedCache(fs, mode='disk', cache_dir=str(cache_dir)).open(str(path)) as f:
+        f.read()
+
+    # An earlier process left no ETag for the file, which then changed
+    (cache_dir / 'etags.json').unlink()
+    path.write_bytes(b'y' * 10000)
+
+    reopened = CuratedCache(fs, mode='disk', cache_dir=str(cache_dir))
+    with reopened.open(str(path)) as f:
+        assert f.read() == b'y' * 10000
+    assert reopened.stats()['invalidations'] == 1
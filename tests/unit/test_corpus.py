@@ -0,0 +1,50 @@
+from datetime import datetime
+import json
+import os
+import subprocess
+import sys
+
+import pyarrow as pa
+
+from corpus import generate, payloads
+from curation import generate_parquet_table
+from derived import add_derived
+from schema import conform
+from validation import validate
+
+
+CORPUS = os.path.join(os.path.dirname(__file__), '..', '..', 'benchmarks', 'corpus.py')
+
+
+def test_corpus_is_the_same_whatever_the_workers():
+    serial = list(generate(4, datetime(2022, 3, 1), 2, seed=3, workers=1))
+    parallel = list(generate(4, datetime(2022, 3, 1), 2, seed=3, workers=2))
+
+    assert serial == parallel
+    assert sum(len(lines) for lines in serial) == 4 * 2 * 24
+
+
+def test_generated_payloads_curate_with_the_expected_quarantine_share():
+    observations = list(payloads(10, datetime(2022, 3, 1), 3, seed=1, null_rate=0.05, workers=1))
+
+    table = add_derived(pa.concat_tables([conform(generate_parquet_table(observation)) for observation in observations]))
+    curated, rejected, _ = validate(table)
+
+    # Only rows with a null temperature fail, the other values are generated within range
+    missing = sum(observation['current']['temp_c'] is None for observation in observations)
+    assert set(rejected.column('reason').to_pylist()) == {'missing_temp_c'}
+    assert rejected.num_rows == missing
+    assert curated.num_rows == len(observations) - missing
+    assert 0.02 < missing / len(observations) < 0.08
+
+
+def test_output_stops_quietly_when_the_reader_closes_the_pipe():
+    process = subprocess.Popen([sys.executable, CORPUS, '--sites', '50', '--days', '10', '--workers', '2'],
+                               stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    first = process.stdout.readline()
+    process.stdout.close()
+    _, stderr = process.communicate(timeout=60)
+
+    assert json.loads(first)['location']['country'] == 'Australia'
+    assert process.returncode == 0
+    assert b'BrokenPipeError' not in stderr
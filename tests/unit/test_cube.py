@@ -0,0 +1,54 @@
+from datetime import datetime
+
+from fsspec.implementations.local import LocalFileSystem
+import numpy as np
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from cube import Cube, build_cube
+from schema import conform
+
+
+def test_write_rows_spans_locations_and_years(tmp_path):
+    cube = Cube(str(tmp_path), metrics=['temp_c', 'humidity'])
+    table = pa.table({"temp_c": [20.5, 21.5, None], "humidity": [50, 60, 70]})
+
+    cube.write_rows(['a', 'b', 'a'], [datetime(2021, 12, 31, 23), datetime(2022, 1, 1, 0), datetime(2022, 1, 1, 1)], table)
+
+    values = cube.read('a', datetime(2021, 12, 31, 23), datetime(2022, 1, 1, 2))
+    np.testing.assert_array_equal(values, [[20.5, 50], [np.nan, np.nan], [np.nan, 70]])
+    np.testing.assert_array_equal(cube.read('b', datetime(2022, 1, 1), datetime(2022, 1, 1, 1)), [[21.5, 60]])
+
+
+def test_locations_added_by_another_process_are_kept(tmp_path):
+    first = Cube(str(tmp_path), metrics=['temp_c'])
+    second = Cube(str(tmp_path), metrics=['temp_c'])
+
+    first.write('a', datetime(2022, 3, 4, 5), {"temp_c": 1.0})
+    second.write('b', datetime(2022, 3, 4, 5), {"temp_c": 2.0})
+
+    reopened = Cube(str(tmp_path))
+    assert reopened.locations == ['a', 'b']
+    assert reopened.read('a', datetime(2022, 3, 4, 5), datetime(2022, 3, 4, 6))[0, 0] == 1.0
+    assert reopened.read('b', datetime(2022, 3, 4, 5), datetime(2022, 3, 4, 6))[0, 0] == 2.0
+
+
+def test_build_cube_from_single_and_batch_files(tmp_path):
+    fs = LocalFileSystem()
+    bucket = str(tmp_path / 'bucket')
+
+    def write(path, **columns):
+        fs.makedirs(path.rsplit('/', 1)[0], exist_ok=True)
+        with fs.open(path, 'wb') as f:
+            pq.write_table(conform(pa.table(columns)), f)
+
+    write(f'{bucket}/curated/2022/3/4/5/healesville/weather.parquet', temp_c=pa.array([10.0], pa.float32()))
+    write(f'{bucket}/curated/2022/3/4/6/batch-1.parquet', location_id=['healesville', 'yarra'],
+          temp_c=pa.array([11.0, 12.0], pa.float32()))
+
+    cube = build_cube(fs, bucket, str(tmp_path / 'cube'), batch_rows=2)
+
+    assert cube.locations == ['healesville', 'yarra']
+    temps = cube.read('healesville', datetime(2022, 3, 4, 5), datetime(2022, 3, 4, 7), ['temp_c'])
+    np.testing.assert_array_equal(temps[:, 0], [10.0, 11.0])
+    assert cube.read('yarra', datetime(2022, 3, 4, 6), datetime(2022, 3, 4, 7), ['temp_c'])[0, 0] == 12.0
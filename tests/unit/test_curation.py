@@ -0,0 +1,105 @@
+from datetime import datetime
+import json
+from types import SimpleNamespace
+from unittest import mock
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+import curation
+from curation import raw_keys_from_message, save_curated_data
+from schema import conform
+
+
+def observation(temp_c, last_updated_epoch=1646351100) -> dict:
+    return {
+        "location": {"name": "Healesville", "region": "Victoria", "country": "Australia", "lat": -37.5, "lon": 145.74,
+                     "tz_id": "Australia/Melbourne", "localtime_epoch": 1646352000, "localtime": "2022-03-04 11:00"},
+        "current": {"last_updated_epoch": last_updated_epoch, "last_updated": "2022-03-04 10:45", "temp_c": temp_c,
+                    "condition": {"text": "Sunny", "code": 1000}, "wind_kph": 3.6, "humidity": 56, "cloud": 0},
+    }
+
+
+def message(message_id, *keys, event_name='ObjectCreated:Put') -> dict:
+    """SQS message carrying the S3 notification of raw objects written to the raw bucket"""
+
+    records = [{"eventName": event_name, "s3": {"bucket": {"name": "raw"}, "object": {"key": key}}} for key in keys]
+    return {"messageId": message_id, "body": json.dumps({"Records": records})}
+
+
+def archive(s3, key, json_obj) -> None:
+    with s3.open(f'raw/raw/{key}', 'w') as f:
+        json.dump(json.dumps(json_obj), f)
+
+
+class FailingWrites:
+    """Filesystem failing to write under the prefix given"""
+
+    def __init__(self, fs, prefix):
+        self.fs = fs
+        self.prefix = prefix
+
+    def open(self, path, mode='rb'):
+        if 'w' in mode and self.fs._strip_protocol(path).lstrip('/').startswith(self.prefix):
+            raise IOError('Slow Down')
+        return self.fs.open(path, mode)
+
+
+def run_batch(fs, *messages) -> dict:
+    with mock.patch.dict('os.environ', {"curated_bucket": "curated", "memory_budget": "", "shard_count": "0"}), \
+            mock.patch.object(curation, 's3fs', SimpleNamespace(S3FileSystem=lambda: fs)):
+        return curation.sqs_handler({"Records": list(messages)}, SimpleNamespace(aws_request_id='batch'))
+
+
+def test_curated_file_is_written_from_the_parquet_buffer(s3):
+    table = conform(pa.table({"temp_c": pa.array([20.5], pa.float32())}))
+
+    save_curated_data(s3, table, datetime(2022, 3, 4, 5), 'curated', 'healesville')
+
+    with s3.open('curated/curated/2022/3/4/5/healesville/weather.parquet', 'rb') as f:
+        assert pq.read_table(f).equals(table)
+
+
+def test_raw_keys_are_read_from_s3_notifications():
+    created = message('1', 'raw/2022/3/4/11/mount+buller.json', 'raw/2022/3/4/11/weather_15.json')
+    removed = message('2', 'raw/2022/3/4/11.json', event_name='ObjectRemoved:Delete')
+
+    assert raw_keys_from_message(created) == ['s3://raw/raw/2022/3/4/11/mount buller.json',
+                                              's3://raw/raw/2022/3/4/11/weather_15.json']
+    assert raw_keys_from_message(removed) == []
+
+
+def test_s3_test_event_carries_no_raw_keys():
+    test_event = {"messageId": '1', "body": json.dumps({"Service": "Amazon S3", "Event": "s3:TestEvent", "Bucket": "raw"})}
+
+    assert raw_keys_from_message(test_event) == []
+
+
+def test_batch_reports_only_the_messages_that_failed(s3):
+    archive(s3, '2022/3/4/11/healesville.json', observation(21.0))
+    archive(s3, '2022/3/4/11/geelong.json', {"error": {"code": 1006, "message": "No matching location found."}})
+
+    result = run_batch(s3, message('ok', 'raw/2022/3/4/11/healesville.json'),
+                       message('missing', 'raw/2022/3/4/11/ballarat.json'),
+                       message('api-error', 'raw/2022/3/4/11/geelong.json'),
+                       {"messageId": 'test', "body": json.dumps({"Event": "s3:TestEvent"})})
+
+    # The error response is skipped rather than retried, as retrying cannot turn it into an observation
+    assert result == {"batchItemFailures": [{"itemIdentifier": 'missing'}]}
+    with s3.open('curated/curated/2022/3/4/11/healesville/batch-batch.parquet', 'rb') as f:
+        assert pq.read_table(f).column('temp_c').to_pylist() == [21.0]
+    assert not s3.exists('curated/curated/2022/3/4/11/geelong')
+
+
+def test_failed_object_fails_every_message_in_it(s3):
+    archive(s3, '2022/3/4/11/weather_00.json', observation(20.0, 1646350200))
+    archive(s3, '2022/3/4/11/weather_15.json', observation(21.0, 1646351100))
+    archive(s3, '2022/3/4/12/weather_00.json', observation(22.0, 1646353800))
+
+    result = run_batch(FailingWrites(s3, 'curated/curated/2022/3/4/11/'),
+                       message('a', 'raw/2022/3/4/11/weather_00.json'),
+                       message('b', 'raw/2022/3/4/11/weather_15.json'),
+                       message('c', 'raw/2022/3/4/12/weather_00.json'))
+
+    assert result == {"batchItemFailures": [{"itemIdentifier": 'a'}, {"itemIdentifier": 'b'}]}
+    assert s3.exists('curated/curated/2022/3/4/12/batch-batch.parquet')
@@ -0,0 +1,23 @@
+from datetime import datetime
+
+from dataset import list_zone
+from keys import curated_key, location_shard
+
+
+def test_zone_listing_returns_the_objects_of_every_shard(s3):
+    dt = datetime(2022, 3, 4, 5)
+    keys = [curated_key('curated', dt, location, shard=location_shard(location, 4))
+            for location in ('healesville', 'melbourne', 'mount_buller', 'geelong')]
+    # Objects of the single site, written before sharding, sit next to the shard directories
+    keys.append(curated_key('curated', dt))
+    for key in keys:
+        s3.pipe(key, b'parquet')
+
+    listed = [path.lstrip('/') for path in list_zone(s3, 'curated', 'curated', workers=3)]
+
+    assert sorted(listed) == sorted(key[len('s3://'):] for key in keys)
+    assert {path.split('/')[2] for path in listed} == {'shard-00', 'shard-01', 'shard-02', '2022'}
+
+
+def test_missing_zone_lists_nothing(s3):
+    assert list_zone(s3, 'curated', 'curated') == []
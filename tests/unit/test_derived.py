@@ -0,0 +1,51 @@
+import numpy as np
+import pyarrow as pa
+import pytest
+
+from derived import add_derived, dew_point, heat_index, wind_chill
+from schema import conform
+
+
+def observations(**columns) -> pa.Table:
+    return conform(pa.table(columns))
+
+
+def test_derived_values_only_fill_nulls():
+    table = observations(
+        temp_c=pa.array([30.0, 30.0], pa.float32()),
+        humidity=pa.array([60, 60], pa.int32()),
+        wind_kph=pa.array([10.0, 10.0], pa.float32()),
+        dewpoint_c=pa.array([5.0, None], pa.float32()),
+    )
+
+    derived = add_derived(table)
+
+    dewpoint = derived.column('dewpoint_c').to_pylist()
+    assert dewpoint[0] == 5.0
+    assert dewpoint[1] == pytest.approx(21.4, abs=0.1)
+    assert derived.schema == table.schema
+
+
+def test_rows_missing_an_input_get_nulls():
+    table = observations(
+        temp_c=pa.array([None, 20.0, 5.0], pa.float32()),
+        humidity=pa.array([50, None, 50], pa.int32()),
+        wind_kph=pa.array([10.0, 10.0, None], pa.float32()),
+    )
+
+    derived = add_derived(table)
+
+    assert derived.column('dewpoint_c').to_pylist()[:2] == [None, None]
+    assert derived.column('heatindex_c').to_pylist()[:2] == [None, None]
+    assert derived.column('windchill_c').to_pylist()[2] is None
+    assert derived.column('apparent_temp_c').to_pylist() == [None, None, None]
+
+
+def test_indices_equal_the_temperature_outside_their_range():
+    temp_c = np.array([20.0, 32.0, 15.0, -5.0])
+
+    assert heat_index(temp_c, np.array([50.0] * 4))[0] == pytest.approx(20.0)
+    assert heat_index(temp_c, np.array([50.0] * 4))[1] > 32.0
+    assert wind_chill(temp_c, np.array([20.0, 20.0, 20.0, 3.0])).tolist()[1:] == [32.0, 15.0, -5.0]
+    assert wind_chill(np.array([-5.0]), np.array([20.0]))[0] < -5.0
+    assert np.isnan(dew_point(np.array([20.0]), np.array([0.0])))[0]
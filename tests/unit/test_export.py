@@ -0,0 +1,72 @@
+import csv
+from datetime import datetime
+import json
+
+from fsspec.implementations.local import LocalFileSystem
+import pyarrow as pa
+import pyarrow.parquet as pq
+import pytest
+
+from export import export_extract, export_snapshot, read_snapshot_metadata
+from schema import conform
+
+
+@pytest.fixture
+def bucket(tmp_path):
+    return str(tmp_path / 'curated-bucket')
+
+
+def write_curated(fs, path, temps):
+    fs.makedirs(path.rsplit('/', 1)[0], exist_ok=True)
+    with fs.open(path, 'wb') as f:
+        pq.write_table(conform(pa.table({"temp_c": pa.array(temps, pa.float32())})), f)
+
+
+def snapshot_temps(path) -> list:
+    return pa.ipc.open_file(pa.memory_map(path)).read_all().column('temp_c').to_pylist()
+
+
+def test_refresh_appends_files_landing_late_for_an_exported_hour(tmp_path, bucket):
+    fs = LocalFileSystem()
+    output = str(tmp_path / 'snapshot.arrow')
+    write_curated(fs, f'{bucket}/curated/2022/3/4/10/a.parquet', [1.0])
+    write_curated(fs, f'{bucket}/curated/2022/3/4/11/a.parquet', [2.0])
+
+    first = export_snapshot(fs, bucket, output)
+    assert first['rows_appended'] == 2
+
+    # A second location and an SQS batch land for hours the snapshot already covers
+    write_curated(fs, f'{bucket}/curated/2022/3/4/10/b.parquet', [3.0])
+    write_curated(fs, f'{bucket}/curated/2022/3/4/11/batch-1.parquet', [4.0, 5.0])
+
+    refreshed = export_snapshot(fs, bucket, output, refresh=True)
+
+    assert (refreshed['rows_kept'], refreshed['rows_appended'], refreshed['files']) == (2, 3, 2)
+    assert sorted(snapshot_temps(output)) == [1.0, 2.0, 3.0, 4.0, 5.0]
+    assert len(read_snapshot_metadata(output)['files']) == 4
+    assert read_snapshot_metadata(output)['last_hour'] == datetime(2022, 3, 4, 11)
+
+    # Nothing new, nothing appended
+    assert export_snapshot(fs, bucket, output, refresh=True)['rows_appended'] == 0
+    assert len(snapshot_temps(output)) == 5
+
+
+@pytest.mark.parametrize("fmt", ["csv", "ndjson"])
+def test_extract_round_trips_in_batches(tmp_path, bucket, fmt):
+    fs = LocalFileSystem()
+    for hour in range(5):
+        write_curated(fs, f'{bucket}/curated/2022/3/4/{hour}/a.parquet', [hour + 0.1, hour + 0.2])
+    output = str(tmp_path / f'extract.{fmt}')
+
+    result = export_extract(fs, bucket, output, fmt, start=datetime(2022, 3, 4, 1), end=datetime(2022, 3, 4, 4),
+                            columns=['location_id', 'temp_c'], batch_rows=2)
+
+    with open(output) as f:
+        if fmt == 'csv':
+            rows = list(csv.DictReader(f))
+        else:
+            rows = [json.loads(line) for line in f]
+
+    assert result['rows'] == len(rows) == 6
+    assert [float(row['temp_c']) for row in rows] == [1.1, 1.2, 2.1, 2.2, 3.1, 3.2]
+    assert set(rows[0]) == {'location_id', 'temp_c'}
@@ -0,0 +1,59 @@
+from datetime import datetime
+from unittest import mock
+
+from fsspec.implementations.local import LocalFileSystem
+import pyarrow as pa
+import pyarrow.flight as flight
+import pyarrow.parquet as pq
+import pytest
+
+from dataset import list_curated
+from flight_server import CuratedFlightServer, encode_query
+from schema import conform
+
+
+@pytest.fixture
+def bucket(tmp_path):
+    fs = LocalFileSystem()
+    bucket = str(tmp_path / 'curated-bucket')
+    for day, hour, location, temp in [(1, 5, 'a', 1.0), (1, 6, 'b', 2.0), (2, 5, 'a', 3.0), (9, 5, 'a', 4.0)]:
+        path = f'{bucket}/curated/2022/3/{day}/{hour}/{location}/weather.parquet'
+        fs.makedirs(path.rsplit('/', 1)[0], exist_ok=True)
+        with fs.open(path, 'wb') as f:
+            pq.write_table(conform(pa.table({"location_id": [location], "temp_c": pa.array([temp], pa.float32())})), f)
+    return bucket
+
+
+def test_list_curated_only_lists_the_days_in_the_window(bucket):
+    fs = LocalFileSystem()
+
+    with mock.patch.object(fs, 'find', wraps=fs.find) as find:
+        paths = list_curated(fs, bucket, datetime(2022, 3, 1, 6), datetime(2022, 3, 3))
+
+    assert [path.split('/curated/')[1] for path in paths] == ['2022/3/1/6/b/weather.parquet', '2022/3/2/5/a/weather.parquet']
+    assert sorted(call[0][0].split('/curated/')[1] for call in find.call_args_list) == ['2022/3/1', '2022/3/2']
+
+
+def test_tickets_carry_the_keys_of_their_day(bucket):
+    fs = LocalFileSystem()
+    server = CuratedFlightServer(fs, bucket, 'grpc://127.0.0.1:0')
+    try:
+        client = flight.connect(f'grpc://127.0.0.1:{server.port}')
+        descriptor = flight.FlightDescriptor.for_command(
+            encode_query(datetime(2022, 3, 1), datetime(2022, 3, 3), columns=['location_id', 'temp_c']))
+        info = client.get_flight_info(descriptor)
+        assert len(info.endpoints) == 2
+
+        # Serving the tickets does not list the bucket again
+        with mock.patch('flight_server.list_curated', side_effect=AssertionError('listed again')):
+            tables = [client.do_get(endpoint.ticket).read_all() for endpoint in info.endpoints]
+
+        assert [table.column('temp_c').to_pylist() for table in tables] == [[1.0, 2.0], [3.0]]
+
+        # Keys outside the curated zone of the bucket are refused
+        for path in ['/etc/passwd', f'{bucket}/curated/../../other/curated/2022/3/1/5/a/weather.parquet',
+                     f'{bucket}/raw/curated/2022/3/1/5/a/weather.parquet']:
+            with pytest.raises(flight.FlightServerError):
+                client.do_get(flight.Ticket(encode_query(paths=[path]))).read_all()
+    finally:
+        server.shutdown()
@@ -0,0 +1,81 @@
+from datetime import datetime
+
+from keys import CURATED_KEY, RAW_KEY, curated_batch_key, curated_key, location_shard, parse_curated_key, parse_curated_location, parse_raw_key, raw_key, schedule_minute
+
+
+def test_batch_keys_follow_the_location_layout():
+    dt = datetime(2022, 3, 4, 5)
+    shard = location_shard('healesville', 4)
+
+    key = curated_batch_key('curated', dt, 'abc', 'healesville', shard)
+
+    assert key == f's3://curated/curated/{shard}/2022/3/4/5/healesville/batch-abc.parquet'
+    assert parse_curated_key(key) == dt
+    assert parse_curated_location(key) == 'healesville'
+    assert curated_batch_key('curated', dt, 'abc') == 's3://curated/curated/2022/3/4/5/batch-abc.parquet'
+
+
+def test_schedule_minute_is_the_start_of_the_slot():
+    assert schedule_minute(datetime(2022, 3, 4, 5, 0), 15) == 0
+    assert schedule_minute(datetime(2022, 3, 4, 5, 29), 15) == 15
+    assert schedule_minute(datetime(2022, 3, 4, 5, 59), 5) == 55
+    assert schedule_minute(datetime(2022, 3, 4, 5, 7), 1) == 7
+    # Hourly runs keep the original names without a minute
+    assert schedule_minute(datetime(2022, 3, 4, 5, 29), 60) is None
+
+
+def test_schedule_minute_defaults_to_the_stack_schedule(monkeypatch):
+    monkeypatch.setenv('schedule_minutes', '10')
+    assert schedule_minute(datetime(2022, 3, 4, 5, 29)) == 20
+
+    monkeypatch.delenv('schedule_minutes')
+    assert schedule_minute(datetime(2022, 3, 4, 5, 29)) is None
+
+
+def test_minute_slots_are_named_inside_the_hour():
+    dt = datetime(2022, 3, 4, 5, 30)
+
+    assert raw_key('raw', dt, minute=30) == 's3://raw/raw/2022/3/4/5/weather_30.json'
+    assert raw_key('raw', dt, 'healesville', 5) == 's3://raw/raw/2022/3/4/5/healesville/weather_05.json'
+    assert curated_key('curated', dt, minute=30) == 's3://curated/curated/2022/3/4/5/weather_30.parquet'
+    assert curated_key('curated', dt, 'healesville', 5) == 's3://curated/curated/2022/3/4/5/healesville/weather_05.parquet'
+
+
+def test_hourly_and_minute_keys_are_parsed():
+    # Keys written before sub-hourly runs, which have no minute
+    assert parse_raw_key('raw/raw/2022/3/4/5.json') == (datetime(2022, 3, 4, 5), None)
+    assert parse_raw_key('raw/raw/2022/3/4/5/healesville.json') == (datetime(2022, 3, 4, 5), 'healesville')
+    assert parse_curated_key('curated/curated/2022/3/4/5/weather.parquet') == datetime(2022, 3, 4, 5)
+
+    # weather_MM keys of sub-hourly runs
+    assert parse_raw_key('raw/raw/2022/3/4/5/weather_15.json') == (datetime(2022, 3, 4, 5, 15), None)
+    assert parse_raw_key('raw/raw/2022/3/4/5/healesville/weather_45.json') == (datetime(2022, 3, 4, 5, 45), 'healesville')
+    assert parse_curated_key('curated/curated/2022/3/4/5/healesville/weather_45.parquet') == datetime(2022, 3, 4, 5, 45)
+    assert parse_curated_location('curated/curated/2022/3/4/5/healesville/weather_45.parquet') == 'healesville'
+
+    assert parse_raw_key('raw/raw/2022/3/4/notes.txt') is None
+    assert parse_curated_key('curated/curated/2022/3/4/5/weather.json') is None
+
+
+def test_sharded_keys_round_trip():
+    dt = datetime(2022, 3, 4, 5, 15)
+    shard = location_shard('healesville', 16)
+
+    raw = raw_key('raw', dt, 'healesville', 15, shard)
+    curated = curated_key('curated', dt, 'healesville', 15, shard)
+
+    assert raw == 's3://raw/raw/shard-09/2022/3/4/5/healesville/weather_15.json'
+    assert RAW_KEY.search(raw) and parse_raw_key(raw) == (dt, 'healesville')
+    assert curated == 's3://curated/curated/shard-09/2022/3/4/5/healesville/weather_15.parquet'
+    assert CURATED_KEY.search(curated) and parse_curated_key(curated) == dt
+    assert parse_curated_location(curated) == 'healesville'
+
+
+def test_location_shards_are_stable():
+    # The md5 of the location id, so shards do not move between processes as hash() would
+    assert [location_shard(location, 4) for location in ('healesville', 'melbourne', 'mount_buller')] == [
+        'shard-01', 'shard-02', 'shard-00']
+    assert location_shard('healesville', 16) == 'shard-09'
+
+    assert location_shard('healesville', 0) is None
+    assert location_shard(None, 4) is None
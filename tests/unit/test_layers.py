@@ -0,0 +1,45 @@
+import os
+import zipfile
+
+import pytest
+
+from tdf_test import layers
+
+
+def module_files(module) -> set:
+    path = module.replace('.', '/')
+    return {f'{path}/__init__.py', f'{path}.py'}
+
+
+def test_listed_modules_are_in_the_source_layer():
+    if not os.path.isdir(os.path.join(layers.SOURCE_DIR, layers.SITE_PACKAGES)):
+        pytest.skip('layer/ is not installed')
+
+    assert layers.missing_imports(layers.collect()['files']) == {}
+
+
+def test_built_layers_ship_every_listed_module(tmp_path):
+    site_packages = tmp_path / 'layer' / layers.SITE_PACKAGES
+    modules = {module for imports in layers.FUNCTION_IMPORTS.values() for module in imports}
+    for module in modules:
+        path = site_packages / (module.replace('.', '/') + '/__init__.py')
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_text('')
+
+    manifest = layers.build(str(tmp_path / 'layer'), str(tmp_path / 'build'))
+
+    for function, imports in layers.FUNCTION_IMPORTS.items():
+        shipped = set()
+        for name in manifest['functions'][function]:
+            with zipfile.ZipFile(manifest['layers'][name]['zip']) as zf:
+                shipped |= {path[len(layers.SITE_PACKAGES) + 1:] for path in zf.namelist()}
+        assert all(module_files(module) & shipped for module in imports), function
+
+
+def test_build_fails_on_a_missing_module(tmp_path):
+    site_packages = tmp_path / 'layer' / layers.SITE_PACKAGES
+    (site_packages / 's3fs').mkdir(parents=True)
+    (site_packages / 's3fs' / '__init__.py').write_text('')
+
+    with pytest.raises(ValueError, match='pyarrow'):
+        layers.build(str(tmp_path / 'layer'), str(tmp_path / 'build'))
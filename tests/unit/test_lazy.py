@@ -0,0 +1,53 @@
+import sys
+
+import pytest
+
+from lazy import LazyModule, lazy_import
+
+
+@pytest.fixture
+def probe(tmp_path, monkeypatch):
+    """Package lazy_probe with a submodule, found on sys.path and not imported yet"""
+
+    package = tmp_path / 'lazy_probe'
+    package.mkdir()
+    (package / '__init__.py').write_text('VALUE = 42\n')
+    (package / 'parser.py').write_text('def parse(text):\n    return text.upper()\n')
+    monkeypatch.syspath_prepend(str(tmp_path))
+
+    yield
+
+    for name in ('lazy_probe', 'lazy_probe.parser'):
+        sys.modules.pop(name, None)
+
+
+def test_lazy_module_is_imported_on_first_attribute_access(probe, monkeypatch):
+    monkeypatch.setenv('lazy_imports', '1')
+
+    module = lazy_import('lazy_probe')
+
+    assert isinstance(module, LazyModule)
+    assert 'lazy_probe' not in sys.modules
+
+    assert module.VALUE == 42
+    assert 'lazy_probe' in sys.modules
+
+
+def test_lazy_and_eager_modules_behave_the_same(probe, monkeypatch):
+    monkeypatch.setenv('lazy_imports', 'true')
+    lazy = lazy_import('lazy_probe.parser')
+
+    monkeypatch.setenv('lazy_imports', '')
+    eager = lazy_import('lazy_probe.parser')
+
+    # Eager mode imports straight away and returns the module itself
+    assert eager is sys.modules['lazy_probe.parser']
+    assert lazy.parse('melbourne') == eager.parse('melbourne') == 'MELBOURNE'
+    assert lazy.parse is eager.parse
+
+
+def test_imported_module_is_returned_as_is(probe, monkeypatch):
+    import lazy_probe
+    monkeypatch.setenv('lazy_imports', '1')
+
+    assert lazy_import('lazy_probe') is lazy_probe
@@ -0,0 +1,54 @@
+import random
+
+import pytest
+
+from load_harness import FakeWeatherAPI, MemoryBuckets, bucket_filesystem, parse_latency, run_load, summarise
+
+
+LOCATIONS = [{"id": "healesville", "q": "Healesville"}, {"id": "geelong", "q": "Geelong"}]
+
+
+def test_latency_specs():
+    rng = random.Random(0)
+
+    assert parse_latency('fixed:80')(rng) == 0.08
+    assert 0.1 <= parse_latency('uniform:100:200')(rng) <= 0.2
+    assert parse_latency('lognormal:120:0.6')(rng) > 0
+
+    with pytest.raises(Exception, match='Expected fixed'):
+        parse_latency('fixed:1:2')
+
+
+def test_memory_buckets_store_s3_urls_by_bucket():
+    fs = bucket_filesystem('memory')
+
+    with fs.open('s3://raw/raw/2022/3/4/5.json', 'w') as f:
+        f.write('{}')
+
+    assert isinstance(fs, MemoryBuckets)
+    assert fs.exists('/raw/raw/2022/3/4/5.json')
+
+
+def test_load_run_curates_every_location_and_hour():
+    fs = bucket_filesystem('memory')
+
+    with FakeWeatherAPI(parse_latency('fixed:0')) as server:
+        result = run_load(fs, server.url, LOCATIONS, hours=2)
+
+    summary = summarise(result)
+    assert (summary['runs'], summary['failed'], server.calls) == (4, 0, 4)
+    assert summary['stages']['pipeline.end_to_end']['count'] == 4
+    assert summary['stages']['raw.api_call']['count'] == 4
+    assert len(fs.find('/load-test-curated/curated')) == 4
+    assert len(fs.find('/load-test-raw/raw')) == 4
+
+
+def test_load_run_counts_api_failures():
+    fs = bucket_filesystem('memory')
+
+    with FakeWeatherAPI(parse_latency('fixed:0'), error_rate=1.0) as server:
+        result = run_load(fs, server.url, LOCATIONS[:1], hours=1, retry_wait=False)
+
+    # The raw handler tries three times before giving up on the hour
+    assert (result['runs'], result['failed'], server.calls, server.errors) == (1, 1, 3, 3)
+    assert fs.find('/load-test-curated') == []
@@ -0,0 +1,174 @@
+from datetime import datetime
+import importlib
+import json
+from types import SimpleNamespace
+from unittest import mock
+
+import aws_cdk as core
+import pyarrow.parquet as pq
+import pytz
+
+from tdf_test.local_executor import LocalExecutor, definition_from_stack
+from tdf_test.tdf_test_stack import TdfTestStack
+
+
+OBSERVATION = {
+    "location": {"name": "Healesville", "region": "Victoria", "country": "Australia", "lat": -37.5, "lon": 145.74,
+                 "tz_id": "Australia/Melbourne", "localtime_epoch": 1646352000, "localtime": "2022-03-04 11:00"},
+    "current": {"last_updated_epoch": 1646351100, "last_updated": "2022-03-04 10:45", "temp_c": 21.0,
+                "condition": {"text": "Sunny", "code": 1000}, "wind_kph": 3.6, "humidity": 56, "cloud": 0},
+}
+
+
+class Response:
+    """requests response answering with a JSON observation"""
+
+    status_code = 200
+
+    def __init__(self, observation):
+        self.content = json.dumps(observation).encode()
+
+    def json(self):
+        return json.loads(self.content)
+
+
+def stub_handlers(functions, results):
+    """Returns an invoke callable answering each handler with results[handler](payload)"""
+
+    def invoke(function, payload):
+        return results[functions[function]['handler']](payload)
+
+    return invoke
+
+
+def test_chain_publishes_when_raw_fails():
+    definition, functions = definition_from_stack(TdfTestStack(core.App(), "tdf-test"))
+    published = []
+    invoke = stub_handlers(functions, {
+        "raw.handler": lambda event: {"event": event, "status": "FAILED"},
+        "curation.handler": lambda event: {"event": event, "status": "SUCCEEDED"},
+    })
+
+    execution = LocalExecutor(definition, invoke, lambda topic, message: published.append(message)).execute({})
+
+    assert execution['status'] == "SUCCEEDED"
+    assert published == ["FAILED"]
+    assert [state for state, _ in execution['timings']] == ["Retrieve Raw", "Raw Complete?", "Publish message"]
+
+
+def test_chain_succeeds():
+    definition, functions = definition_from_stack(TdfTestStack(core.App(), "tdf-test"))
+    invoke = stub_handlers(functions, {
+        "raw.handler": lambda event: {"event": event, "status": "SUCCEEDED", "s3_key": "s3://raw/raw/2022/3/4/5.json"},
+        "curation.handler": lambda event: {"event": event, "status": "SUCCEEDED"},
+    })
+
+    execution = LocalExecutor(definition, invoke, lambda topic, message: None).execute({})
+
+    assert [state for state, _ in execution['timings']] == [
+        "Retrieve Raw", "Raw Complete?", "Curate to Parquet", "Job Complete?", "Succeeded"]
+
+
+def test_location_map_collects_failures():
+    locations = [{"id": "a", "q": "1,1"}, {"id": "b", "q": "2,2"}, {"id": "c", "q": "3,3"}]
+    definition, functions = definition_from_stack(TdfTestStack(core.App(), "tdf-test", topology="map", locations=locations))
+    published = []
+
+    def raw(event):
+        if event['location']['id'] == 'c':
+            raise ValueError("API key rejected")
+        return {"event": event, "location": event['location'], "status": "FAILED" if event['location']['id'] == 'b' else "SUCCEEDED"}
+
+    invoke = stub_handlers(functions, {
+        "raw.handler": raw,
+        "curation.handler": lambda event: {"event": event, "location": event['location'], "status": "SUCCEEDED"},
+    })
+
+    executions = LocalExecutor(definition, invoke, lambda topic, message: published.append(message)).execute_many(
+        [{"locations": locations}] * 4, concurrency=4)
+
+    assert all(execution['status'] == "SUCCEEDED" for execution in executions)
+    assert len(published) == 4
+    assert [item['location']['id'] for item in published[0]['failed']] == ["b", "c"]
+    assert published[0]['failed'][1]['error']['Error'] == "ValueError"
+
+
+def test_fused_publishes_when_the_pipeline_raises():
+    definition, functions = definition_from_stack(TdfTestStack(core.App(), "tdf-test", topology="fused"))
+    published = []
+
+    def pipeline(event):
+        raise RuntimeError("Task timed out")
+
+    invoke = stub_handlers(functions, {"pipeline.handler": pipeline})
+    execution = LocalExecutor(definition, invoke, lambda topic, message: published.append(message)).execute({})
+
+    assert execution['status'] == "SUCCEEDED"
+    assert published == ["FAILED"]
+    assert execution['output']['error']['Error'] == "RuntimeError"
+    assert [state for state, _ in execution['timings']] == ["Run Pipeline", "Pipeline Errored", "Publish message"]
+
+
+def run_chain(s3, raw_buckets, **overrides):
+    """Runs the chain topology with the real handlers against s3, returning the execution and environment"""
+
+    definition, functions = definition_from_stack(TdfTestStack(core.App(), "tdf-test"))
+
+    env = dict({"metrics_namespace": "", "profile_rate": "0"}, **overrides)
+    for function in functions.values():
+        env = dict(function['environment'], **env)
+
+    handlers = {}
+    for logical_id, function in functions.items():
+        module, name = function['handler'].split('.')
+        handlers[logical_id] = getattr(importlib.import_module(module), name)
+
+    payloads = []
+
+    def invoke(function, payload):
+        # Payloads go through JSON between states, as in Step Functions
+        payloads.append(json.loads(json.dumps(payload)))
+        return json.loads(json.dumps(handlers[function](payloads[-1], None)))
+
+    raw, curation = importlib.import_module('raw'), importlib.import_module('curation')
+    secrets = SimpleNamespace(get_secret_value=lambda SecretId: {"SecretString": "key"})
+    now = pytz.timezone('Australia/Melbourne').localize(datetime(2022, 3, 4, 11, 2))
+
+    with mock.patch.dict('os.environ', env), \
+            mock.patch.object(raw, 's3fs', raw_buckets), \
+            mock.patch.object(curation, 's3fs', SimpleNamespace(S3FileSystem=lambda: s3)), \
+            mock.patch.object(raw, 'boto3', SimpleNamespace(client=lambda service: secrets)), \
+            mock.patch.object(raw, 'requests', SimpleNamespace(get=lambda url: Response(OBSERVATION))), \
+            mock.patch.object(raw, 'get_local_datetime', lambda: now):
+        execution = LocalExecutor(definition, invoke, lambda topic, message: None).execute({})
+
+    assert [state for state, _ in execution['timings']] == [
+        "Retrieve Raw", "Raw Complete?", "Curate to Parquet", "Job Complete?", "Succeeded"]
+
+    with s3.open(f"{env['curated_bucket']}/curated/2022/3/4/11/weather.parquet") as f:
+        table = pq.read_table(f)
+    assert table.column('temp_c').to_pylist() == [21.0]
+    assert table.column('name').to_pylist() == ['Healesville']
+
+    return env, payloads
+
+
+def test_chain_runs_the_real_handlers(s3):
+    env, payloads = run_chain(s3, SimpleNamespace(S3FileSystem=lambda: s3), inline_payload_bytes="0")
+
+    # Curated from the raw object archived by the raw job
+    assert 'payload' not in payloads[-1]
+    assert s3.exists(f"{env['raw_bucket']}/raw/2022/3/4/11.json")
+
+
+def test_chain_archives_inline_payloads_during_curation(s3):
+    def no_raw_writes():
+        raise AssertionError("the raw job wrote an inlined observation")
+
+    env, payloads = run_chain(s3, SimpleNamespace(S3FileSystem=no_raw_writes))
+
+    # Curated from the inline payload, the raw job left the archive to curation
+    assert payloads[-1]['payload'] == OBSERVATION
+    assert payloads[-1]['archived'] is False
+    with s3.open(f"{env['raw_bucket']}/raw/2022/3/4/11.json") as f:
+        assert json.loads(json.load(f)) == OBSERVATION
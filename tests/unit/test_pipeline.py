@@ -0,0 +1,49 @@
+from datetime import datetime
+from types import SimpleNamespace
+from unittest import mock
+
+from fsspec.implementations.memory import MemoryFileSystem
+import pytest
+
+import pipeline
+
+
+class Response:
+    def __init__(self, body, status_code=200):
+        self.body = body
+        self.status_code = status_code
+        self.content = body.encode()
+
+    def json(self):
+        import json
+        return json.loads(self.body)
+
+
+@pytest.fixture
+def fs():
+    MemoryFileSystem.store.clear()
+    MemoryFileSystem.pseudo_dirs[:] = ['']
+    fs = MemoryFileSystem()
+    with mock.patch.object(pipeline, 's3fs', SimpleNamespace(S3FileSystem=lambda: fs)), \
+            mock.patch.object(pipeline, 'get_local_datetime', lambda: datetime(2022, 3, 4, 5)), \
+            mock.patch.dict('os.environ', {"raw_bucket": 'raw', "curated_bucket": 'curated'}):
+        yield fs
+
+
+def test_malformed_json_fails_without_archiving(fs):
+    with mock.patch.object(pipeline, 'fetch_observation', lambda secret_name, query: (Response('<html>'), True)):
+        result = pipeline.handler({}, None)
+
+    assert result['status'] == "FAILED"
+    assert result['s3_key'] is None
+    assert fs.find('/') == []
+
+
+def test_failed_call_archives_the_error_without_curating(fs):
+    body = '{"error": {"code": 1006, "message": "No matching location found."}}'
+    with mock.patch.object(pipeline, 'fetch_observation', lambda secret_name, query: (Response(body, 400), False)):
+        result = pipeline.handler({}, None)
+
+    assert result['status'] == "FAILED"
+    assert result['s3_key'] == 's3://raw/raw/2022/3/4/5.json'
+    assert [path for path in fs.find('/') if '/curated/' in path] == []
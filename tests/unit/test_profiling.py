@@ -0,0 +1,47 @@
+import json
+from types import SimpleNamespace
+from unittest import mock
+
+import pytest
+
+import profiling
+
+
+@pytest.fixture
+def sampled(s3):
+    env = {"profile_rate": "1", "profile_bucket": "profiles", "profile_prefix": ""}
+    with mock.patch.object(profiling, 's3fs', SimpleNamespace(S3FileSystem=lambda: s3)), \
+            mock.patch.dict('os.environ', env):
+        yield s3
+
+
+def handler(event, context):
+    return {"status": "SUCCEEDED", "sizes": [len(str(i)) for i in range(1000)]}
+
+
+def test_sampled_invocation_uploads_stats_and_summary(sampled):
+    result = profiling.profiled('curation')(handler)({}, SimpleNamespace(aws_request_id='abc'))
+
+    assert result['status'] == "SUCCEEDED"
+    keys = sorted(sampled.find('profiles/profiling/curation'))
+    assert [key.rsplit('/', 1)[1] for key in keys] == ['abc.json', 'abc.prof']
+
+    with sampled.open(keys[0]) as f:
+        summary = json.load(f)
+    assert summary['function'] == 'curation'
+    assert summary['traced_peak_bytes'] >= summary['traced_bytes'] > 0
+    assert summary['top_allocations']
+
+
+def test_unsampled_invocation_is_not_profiled(sampled):
+    with mock.patch.dict('os.environ', {"profile_rate": "0"}):
+        profiling.profiled('curation')(handler)({}, None)
+
+    assert sampled.find('profiles') == []
+
+
+def test_failed_upload_does_not_fail_the_invocation(sampled):
+    with mock.patch.object(profiling, 'upload_capture', side_effect=IOError('Access Denied')):
+        result = profiling.profiled('raw')(handler)({}, None)
+
+    assert result['status'] == "SUCCEEDED"
@@ -1,5 +1,9 @@
+import json
+import zipfile
+
 import aws_cdk as core
 import aws_cdk.assertions as assertions
+import pytest
 
 from tdf_test.tdf_test_stack import TdfTestStack
 
@@ -13,3 +17,248 @@ def test_sqs_queue_created():
 #     template.has_resource_properties("AWS::SQS::Queue", {
 #         "VisibilityTimeout": 300
 #     })
+
+
+def state_machine_definition(template) -> str:
+    """Returns the state machine definition with the CloudFormation references left out"""
+
+    state_machines = template.find_resources("AWS::StepFunctions::StateMachine")
+    definition = list(state_machines.values())[0]["Properties"]["DefinitionString"]
+    return "".join(part for part in definition["Fn::Join"][1] if isinstance(part, str))
+
+
+def test_location_map_topology():
+    app = core.App()
+    stack = TdfTestStack(app, "tdf-test", topology="map", max_concurrency=25)
+    template = assertions.Template.from_stack(stack)
+
+    definition = state_machine_definition(template)
+    assert '"Type":"Map"' in definition
+    assert '"MaxConcurrency":25' in definition
+    assert '"Publish failure summary"' in definition
+
+
+def test_fused_topology():
+    app = core.App()
+    stack = TdfTestStack(app, "tdf-test", topology="fused")
+    template = assertions.Template.from_stack(stack)
+
+    template.has_resource_properties("AWS::Lambda::Function", {
+        "Handler": "pipeline.handler",
+    })
+    template.resource_count_is("AWS::Lambda::Function", 2)  # the pipeline and the bucket auto delete handler
+
+    definition = state_machine_definition(template)
+    assert '"Run Pipeline"' in definition
+    assert '"Publish message"' in definition
+
+
+def test_events_topology():
+    app = core.App()
+    stack = TdfTestStack(app, "tdf-test", topology="events", sqs_batch_size=50, sqs_batching_window=30)
+    template = assertions.Template.from_stack(stack)
+
+    template.has_resource_properties("AWS::Lambda::EventSourceMapping", {
+        "BatchSize": 50,
+        "MaximumBatchingWindowInSeconds": 30,
+        "FunctionResponseTypes": ["ReportBatchItemFailures"],
+    })
+    template.has_resource_properties("AWS::Lambda::Function", {
+        "Handler": "curation.sqs_handler",
+    })
+
+    definition = state_machine_definition(template)
+    assert '"Curate to Parquet"' not in definition
+
+
+def test_events_topology_without_batching_window():
+    app = core.App(context={"tdf:sqs_batching_window": 0})
+    stack = TdfTestStack(app, "tdf-test", topology="events")
+    template = assertions.Template.from_stack(stack)
+
+    template.has_resource_properties("AWS::Lambda::EventSourceMapping", {
+        "MaximumBatchingWindowInSeconds": 0,
+    })
+
+
+def test_express_sub_hourly_schedule():
+    app = core.App()
+    stack = TdfTestStack(app, "tdf-test", schedule_minutes=5, express=True)
+    template = assertions.Template.from_stack(stack)
+
+    template.has_resource_properties("AWS::StepFunctions::StateMachine", {
+        "StateMachineType": "EXPRESS",
+    })
+    template.has_resource_properties("AWS::Events::Rule", {
+        "ScheduleExpression": "cron(0/5 * * * ? *)",
+    })
+    template.has_resource_properties("AWS::Lambda::Function", {
+        "Handler": "raw.handler",
+        "Environment": {"Variables": assertions.Match.object_like({"schedule_minutes": "5"})},
+    })
+
+
+def test_pruned_layers(tmp_path):
+    layers = {}
+    for name in ("base", "arrow"):
+        path = tmp_path / f"{name}-0123456789abcdef.zip"
+        with zipfile.ZipFile(path, "w") as zf:
+            zf.writestr(f"python/lib/python3.7/site-packages/{name}.py", "")
+        layers[name] = {"zip": str(path), "hash": f"{name}0123456789abcdef"}
+
+    manifest = tmp_path / "manifest.json"
+    manifest.write_text(json.dumps({
+        "layers": layers,
+        "functions": {"raw": ["base"], "curation": ["base", "arrow"], "pipeline": ["base", "arrow"]},
+    }))
+
+    app = core.App()
+    stack = TdfTestStack(app, "tdf-test", layer_manifest=str(manifest))
+    template = assertions.Template.from_stack(stack)
+
+    template.resource_count_is("AWS::Lambda::LayerVersion", 2)
+
+    functions = template.find_resources("AWS::Lambda::Function")
+    layer_counts = {
+        resource["Properties"]["Handler"]: len(resource["Properties"]["Layers"])
+        for resource in functions.values()
+        if "Layers" in resource["Properties"]
+    }
+    assert layer_counts == {"raw.handler": 1, "curation.handler": 2}
+
+
+def test_curated_glue_table():
+    app = core.App()
+    stack = TdfTestStack(app, "tdf-test", topology="map",
+                         locations=[{"id": "healesville", "q": "1,2"}, {"id": "melbourne", "q": "3,4"}])
+    template = assertions.Template.from_stack(stack)
+
+    template.has_resource_properties("AWS::Glue::Table", {
+        "TableInput": assertions.Match.object_like({
+            "PartitionKeys": [{"Name": "dt", "Type": "string"}, {"Name": "location", "Type": "string"}],
+            "Parameters": assertions.Match.object_like({
+                "projection.enabled": "true",
+                "projection.location.values": "healesville,melbourne",
+                "projection.dt.range": "2022/1/1/0,NOW+11HOURS",
+            }),
+            "StorageDescriptor": assertions.Match.object_like({
+                "Columns": assertions.Match.array_with([{"Name": "location_id", "Type": "string"},
+                                                        {"Name": "temp_c", "Type": "float"}]),
+            }),
+        }),
+    })
+
+
+def test_sharded_layout():
+    app = core.App()
+    stack = TdfTestStack(app, "tdf-test", topology="map", shard_count=4)
+    template = assertions.Template.from_stack(stack)
+
+    template.has_resource_properties("AWS::Lambda::Function", {
+        "Handler": "raw.handler",
+        "Environment": {"Variables": assertions.Match.object_like({"shard_count": "4"})},
+    })
+    template.has_resource_properties("AWS::Glue::Table", {
+        "TableInput": assertions.Match.object_like({
+            "Parameters": assertions.Match.object_like({
+                "projection.shard.values": "shard-00,shard-01,shard-02,shard-03",
+            }),
+        }),
+    })
+
+
+def test_metrics_namespace():
+    app = core.App()
+    stack = TdfTestStack(app, "tdf-test", metrics_namespace="TdfPipeline")
+    template = assertions.Template.from_stack(stack)
+
+    for handler in ("raw.handler", "curation.handler"):
+        template.has_resource_properties("AWS::Lambda::Function", {
+            "Handler": handler,
+            "Environment": {"Variables": assertions.Match.object_like({"metrics_namespace": "TdfPipeline"})},
+        })
+
+
+def test_lazy_imports():
+    app = core.App(context={"tdf:lazy_imports": "true"})
+    stack = TdfTestStack(app, "tdf-test")
+    template = assertions.Template.from_stack(stack)
+
+    for handler in ("raw.handler", "curation.handler"):
+        template.has_resource_properties("AWS::Lambda::Function", {
+            "Handler": handler,
+            "Environment": {"Variables": assertions.Match.object_like({"lazy_imports": "1"})},
+        })
+
+
+def test_profile_rate():
+    app = core.App()
+    stack = TdfTestStack(app, "tdf-test", profile_rate=0.01)
+    template = assertions.Template.from_stack(stack)
+
+    template.has_resource_properties("AWS::Lambda::Function", {
+        "Handler": "curation.handler",
+        "Environment": {"Variables": assertions.Match.object_like({"profile_rate": "0.01"})},
+    })
+
+    with pytest.raises(ValueError):
+        TdfTestStack(core.App(), "tdf-test", profile_rate=2)
+
+
+def test_memory_budget():
+    app = core.App()
+    stack = TdfTestStack(app, "tdf-test", topology="events", memory_budget=0.25)
+    template = assertions.Template.from_stack(stack)
+
+    template.has_resource_properties("AWS::Lambda::Function", {
+        "Handler": "curation.sqs_handler",
+        "Environment": {"Variables": assertions.Match.object_like({"memory_budget": "0.25"})},
+    })
+
+
+def test_buffer_dir():
+    app = core.App(context={"tdf:buffer_dir": "/mnt/buffer"})
+    stack = TdfTestStack(app, "tdf-test")
+    template = assertions.Template.from_stack(stack)
+
+    template.has_resource_properties("AWS::Lambda::Function", {
+        "Handler": "curation.handler",
+        "Environment": {"Variables": assertions.Match.object_like({"buffer_dir": "/mnt/buffer"})},
+        "FileSystemConfigs": [assertions.Match.object_like({"LocalMountPath": "/mnt/buffer"})],
+        "VpcConfig": assertions.Match.any_value(),
+    })
+    template.resource_count_is("AWS::EFS::FileSystem", 1)
+    template.has_resource_properties("AWS::EFS::AccessPoint", {
+        "PosixUser": {"Uid": "1001", "Gid": "1001"},
+    })
+    # Curation reaches S3 through the gateway endpoint, without a NAT gateway
+    template.has_resource_properties("AWS::EC2::VPCEndpoint", {"VpcEndpointType": "Gateway"})
+    template.resource_count_is("AWS::EC2::NatGateway", 0)
+
+    # The raw job is left out of the VPC
+    raw = template.find_resources("AWS::Lambda::Function", {"Properties": {"Handler": "raw.handler"}})
+    assert all('VpcConfig' not in resource['Properties'] for resource in raw.values())
+
+
+def test_buffer_dir_fused_topology():
+    stack = TdfTestStack(core.App(), "tdf-test", topology="fused", buffer_dir="/mnt/buffer")
+    template = assertions.Template.from_stack(stack)
+
+    template.has_resource_properties("AWS::Lambda::Function", {
+        "Handler": "pipeline.handler",
+        "FileSystemConfigs": [assertions.Match.object_like({"LocalMountPath": "/mnt/buffer"})],
+    })
+    # The pipeline calls the weather API
+    template.resource_count_is("AWS::EC2::NatGateway", 1)
+
+
+def test_buffer_dir_is_off_by_default():
+    template = assertions.Template.from_stack(TdfTestStack(core.App(), "tdf-test"))
+
+    template.resource_count_is("AWS::EFS::FileSystem", 0)
+    template.resource_count_is("AWS::EC2::VPC", 0)
+
+    with pytest.raises(ValueError):
+        TdfTestStack(core.App(), "tdf-test", buffer_dir="/tmp/buffer")
+    with pytest.raises(ValueError):
+        TdfTestStack(core.App(), "tdf-test", topology="events", buffer_dir="/mnt/buffer")
@@ -0,0 +1,55 @@
+import pyarrow as pa
+
+from schema import conform
+from validation import site_codes, validate
+
+
+def observations(**columns) -> pa.Table:
+    return conform(pa.table(columns))
+
+
+def test_failing_rows_are_quarantined_with_their_reasons():
+    table = observations(
+        localtime_epoch=[1, 2, 3],
+        last_updated_epoch=[1, 2, 3],
+        temp_c=pa.array([20.0, None, 21.0], pa.float32()),
+        humidity=pa.array([50, 60, 130], pa.int32()),
+    )
+
+    valid, quarantined, failed = validate(table)
+
+    assert failed.tolist() == [False, True, True]
+    assert valid.column('temp_c').to_pylist() == [20.0]
+    assert quarantined.column('reason').to_pylist() == ['missing_temp_c', 'out_of_range_humidity']
+
+
+def test_valid_table_is_passed_on_as_it_is():
+    table = observations(localtime_epoch=[1], last_updated_epoch=[1], temp_c=pa.array([20.0], pa.float32()))
+
+    valid, quarantined, _ = validate(table)
+
+    assert valid is table
+    assert quarantined is None
+
+
+def test_stale_observation_of_a_site_in_a_batch_is_quarantined():
+    table = observations(
+        location_id=['a', 'b', 'a', 'a'],
+        localtime_epoch=[100, 100, 200, 300],
+        last_updated_epoch=[90, 50, 190, 150],
+        temp_c=pa.array([20.0, 21.0, 22.0, 23.0], pa.float32()),
+    )
+
+    _, quarantined, failed = validate(table)
+
+    assert failed.tolist() == [False, False, False, True]
+    assert quarantined.column('reason').to_pylist() == ['decreasing_last_updated_epoch']
+
+
+def test_sites_without_a_location_id_are_told_apart_by_name():
+    table = observations(location_id=['a', None, None, 'a', None], name=['X', 'Healesville', 'Melbourne', 'Y', None])
+
+    codes = site_codes(table).tolist()
+
+    assert codes[0] == codes[3]
+    assert len({codes[0], codes[1], codes[2], codes[4]}) == 4